@@ -5,6 +5,8 @@ from dateutil.parser import parse as parse_date
 from collections import OrderedDict
 from lxml import etree as le  # python-lxml on rpm based systems
 
+from helper import NumberFormatter
+
 
 def filter_dict(d, *keys):
     r"""Filter a dictionary by passed keys
@@ -104,9 +106,9 @@ def add_sample_aperture(det, z=0, diameter=0):
     add_comment_section(det, 'COMPONENT and TYPE: SAMPLE APERTURE')
     le.SubElement(det.root, 'type', name='sample_aperture')
     aperture = le.SubElement(det.root, 'component', type='sample_aperture')
-    le.SubElement(aperture, 'location', z=str(z))
+    le.SubElement(aperture, 'location', z=det.formatter.length(z))
     parameter_size = le.SubElement(aperture, 'parameter', name="Size")
-    le.SubElement(parameter_size, 'value', val=str(diameter))
+    le.SubElement(parameter_size, 'value', val=det.formatter.length(diameter))
     return aperture
 
 
@@ -185,7 +187,7 @@ def add_flat_panel_type(det, num_elem, width, gap, type_elem='fourpack',
     pack_start = (effective_width / 2.0) * (num_elem - 1)
     for i in range(num_elem):
         kwargs = dict(name=f'{name_elem}{first_index+i}',
-                      x='{:.5f}'.format(pack_start - (i * effective_width)))
+                      x=det.formatter.length(pack_start - (i * effective_width), 5))
         le.SubElement(component, 'location', **kwargs)
     return assembly
 
@@ -219,8 +221,8 @@ def add_double_pack(det, assembly_type, pack_type, separation, slip=0.0):
     prefix = ('front', 'back')
     for i in range(2):
         kwargs = dict(name=f'{prefix[i]}-{pack_type}',
-                      x=str(pack_start_x + slip * i),
-                      z=str(pack_start_z + separation * i))
+                      x=det.formatter.length(pack_start_x + slip * i),
+                      z=det.formatter.length(pack_start_z + separation * i))
         le.SubElement(component, 'location', **kwargs)
     return assembly
 
@@ -320,8 +322,8 @@ def add_curved_panel_type(det, num_elem, radius, dtheta, theta_0=0.,
     lxml.etree.subelement
         Handle to the curved panel object
     """
-    def to_str(vv):
-        return [f'{v:.5f}' for v in vv]
+    def to_str(vv, quantity='length'):
+        return det.formatter.formatArray(vv, quantity, 5)
     add_comment_section(det, 'TYPE: CURVED PANEL')
     type_assembly = le.SubElement(det.root, 'type', name=assemb_type)
     le.SubElement(type_assembly, 'properties')
@@ -331,7 +333,7 @@ def add_curved_panel_type(det, num_elem, radius, dtheta, theta_0=0.,
     x = to_str(radius * np.sin(np.deg2rad(theta_angles)) + transl[0])
     y = to_str(transl[1] * np.ones(num_elem))
     z = to_str(radius * np.cos(np.deg2rad(theta_angles)) + transl[2])
-    rot = to_str(theta_angles)
+    rot = to_str(theta_angles, 'angle')
     rot_axis = {'axis-x': '0', 'axis-y': '1', 'axis-z': '0'}
     for i in range(num_elem):
         kwargs = dict(name=f'{name_elem}{first_index+i}',
@@ -504,7 +506,7 @@ def insert_location_from_logs(element, log_key='detectorZ',
         le.SubElement(par, 'logfile', **dict(id=log_keys[i], eq=equations[i]))
 
 
-def insert_side_by_side_view(element, x, y):
+def insert_side_by_side_view(element, x, y, formatter=None):
     r"""
     Insert a side-by-side view of the detector
 
@@ -519,5 +521,10 @@ def insert_side_by_side_view(element, x, y):
         x coordinate to place the center of the element, in meters
     y: float
         y coordinate to place the center of the element, in meters
+    formatter: NumberFormatter
+        Formatter of the coordinates, usually the one of the MantidGeom
+        instance. Coordinates are written with str() if None
     """
-    view = le.SubElement(element, 'side-by-side-view-location', **dict(x=str(x), y=str(y)))
+    formatter = NumberFormatter() if formatter is None else formatter
+    view = le.SubElement(element, 'side-by-side-view-location',
+                         **dict(x=formatter.length(x), y=formatter.length(y)))
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 
 from sns_geometry import Geometry, Component, Maths, Recipe, Vector, \
-     extractValueFromFile, generateGeom, getEuler
+     generateGeom, getEuler
 
 from math import cos, sin, acos,  atan2, pi, sqrt
+import os
+import sys
+sys.path.insert(0, os.path.normpath(os.path.dirname(__file__)) + "/../")
+from detcal import DetCal
 from datetime import datetime, date
 import numpy as np
 
@@ -403,41 +407,24 @@ detCalFile = (raw_input("Please enter the name of the DetCal file: "))
 
 all_names = []
 
-for row in range(len(open(detCalFile).readlines())):
-    #Parse each row
-    flag = extractValueFromFile(detCalFile,None,row,None,0)
-    #Detector number. 
-    if flag == "7": #Is it in use?
-        l1 = float(extractValueFromFile(detCalFile,None,row,None,1))
-        t0 = float(extractValueFromFile(detCalFile,None,row,None,2))
-        print "<!-- XML Code automatically generated on %s for the Mantid instrument definition file from %s -->" % (datetime.now(), detCalFile)
-        writeToFile(makeMantidGeometryIntro(l1), "w")
-        writeToFile2(makeMantidParameters(t0), "w")
-        writeToFile( "<!-- XML Code automatically generated on %s for the Mantid instrument definition file from %s -->" % (datetime.now(), detCalFile), "a")
-    if flag == "5": #Is it in use?
-        # Bank number; as of Jan 2011, starts at 10 and goes up to 59.
-        det_num = int(extractValueFromFile(detCalFile,None,row,None,1))
-        local_name = "bank%d" % det_num
-        
-        #Distance, kept in cm
-        distance = float(extractValueFromFile(detCalFile,None,row,None,7))
-        cenX = float(extractValueFromFile(detCalFile,None,row,None,8))
-        cenY = float(extractValueFromFile(detCalFile,None,row,None,9))
-        cenZ = float(extractValueFromFile(detCalFile,None,row,None,10))
-        baseX = float(extractValueFromFile(detCalFile,None,row,None,11))
-        baseY = float(extractValueFromFile(detCalFile,None,row,None,12))
-        baseZ = float(extractValueFromFile(detCalFile,None,row,None,13))
-        upX = float(extractValueFromFile(detCalFile,None,row,None,14))
-        upY = float(extractValueFromFile(detCalFile,None,row,None,15))
-        upZ = float(extractValueFromFile(detCalFile,None,row,None,16))
-        widX = float(extractValueFromFile(detCalFile,None,row,None,4))
-        widY = float(extractValueFromFile(detCalFile,None,row,None,5))
-        center = Vector([cenX,cenY,cenZ])
-        base = Vector([baseX,baseY,baseZ])
-        up = Vector([upX,upY,upZ])
-
-        addBank(instrument, det_num, local_name, distance, cenX, cenY, cenZ, base, up)
-        all_names.append(local_name)
+detCal = DetCal(detCalFile)
+
+print "<!-- XML Code automatically generated on %s for the Mantid instrument definition file from %s -->" % (datetime.now(), detCalFile)
+writeToFile(makeMantidGeometryIntro(detCal.header["L1"]), "w")
+writeToFile2(makeMantidParameters(detCal.t0), "w")
+writeToFile( "<!-- XML Code automatically generated on %s for the Mantid instrument definition file from %s -->" % (datetime.now(), detCalFile), "a")
+
+# Bank number; as of Jan 2011, starts at 10 and goes up to 59.
+# Distance and centers are kept in cm
+for det_num, distance, cenX, cenY, cenZ, base, up in zip(
+        detCal.det_num.tolist(), detCal.column("DETD").tolist(), detCal.column("CenterX").tolist(),
+        detCal.column("CenterY").tolist(), detCal.column("CenterZ").tolist(),
+        detCal.base.tolist(), detCal.up.tolist()):
+    local_name = "bank%d" % det_num
+    addBank(instrument, det_num, local_name, distance, cenX, cenY, cenZ, Vector(base), Vector(up))
+    all_names.append(local_name)
+# the panel type takes the size of the last bank, as when the rows were read one by one
+widX, widY = detCal.column("WIDTH")[-1], detCal.column("HEIGHT")[-1]
 
 print "<!-- List of all the bank names:"
 print ",".join(all_names)
@@ -1,32 +1,73 @@
 #!/usr/bin/env python
 
 # imports...
+import os
 import xml.dom.minidom
 from datetime import date
 
+class TextTable():
+    """A whitespace separated table, e.g. a DetCal file, read once for the
+    extractValue functions. The values are kept as strings. detcal.DetCal
+    is the reader of the DetCal values themselves."""
+    def __init__(self, filename):
+        datafile = open(filename, "r")
+        try:
+            self.rows = [line.split() for line in datafile]
+        finally:
+            datafile.close()
+
+        # the first line labels the columns for extractValueByName
+        self.__columns = {}
+        if len(self.rows) > 0:
+            for i, label in enumerate(self.rows[0]):
+                self.__columns.setdefault(label, i)
+
+        # first row starting with each name for extractValueByNames
+        self.__names = {}
+        for i, elements in enumerate(self.rows):
+            if len(elements) > 0:
+                self.__names.setdefault(elements[0], i)
+
+    def value(self, row, column):
+        """Value by row and column number, None past the last row"""
+        if row >= len(self.rows):
+            return None
+        return self.rows[row][column]
+
+    def columnNumber(self, columnName):
+        if columnName not in self.__columns:
+            raise ValueError("'%s' is not a column label" % columnName)
+        return self.__columns[columnName]
+
+    def rowNumber(self, bankName):
+        """First row starting with bankName, None if there is none"""
+        return self.__names.get(bankName)
+
+_textTables = {}
+
+def loadTable(filename):
+    """TextTable of a file, only read again when the file changes"""
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+    table = _textTables.get(key)
+    if table is None:
+        table = TextTable(filename)
+        _textTables.clear()
+        _textTables[key] = table
+    return table
+
 def extractValueByNumber(filename, bankNumber, columnNumber):
-    datafile = open(filename, "r")
-    i=0
-    for line in datafile:
-        if (i==bankNumber):
-            elements = line.split()
-            return elements[columnNumber]
-        i=i+1    
+    return loadTable(filename).value(bankNumber, columnNumber)
 
 def extractValueByName(filename, bankNumber, columnName):
-    datafile = open(filename, "r")
-    headers = datafile.readline().split()
-    columnNumber=headers.index(columnName)
-    return extractValueByNumber(filename, bankNumber, columnNumber)
+    table = loadTable(filename)
+    return table.value(bankNumber, table.columnNumber(columnName))
 
 def extractValueByNames(filename, bankName, columnName):
-    datafile=open(filename, "r")
-    i=0
-    for line in datafile:
-        elements=line.split()
-        if (elements[0] == bankName):
-            return extractValueByName(filename, i, columnName)
-        i=i+1
+    table = loadTable(filename)
+    row = table.rowNumber(bankName)
+    if row is not None:
+        return table.value(row, table.columnNumber(columnName))
 
 def extractValueFromFile(filename, bankName=None, bankNumber=None, columnName=None, columnNumber=None):
     if (bankName is None) and (bankNumber is None):
@@ -866,7 +907,19 @@ def testNormal():
 def testCenter():
     testGetCenter((-1,-1,0), (-1,1,0), (1,1,0), (1,-1,0), (0,0,0))
 
+def testDetCal():
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "SNS", "MANDI", "MANDI_April2020.DetCal")
+    print "L1 by name == 3004.6507",
+    printTestResult(extractValueFromFile(filename, "7", None, "L1"), "3004.6507")
+    print "row 1 column 2 == -5.364",
+    printTestResult(extractValueFromFile(filename, None, 1, None, 2), "-5.364")
+    print "the file is read once for all lookups",
+    printTestResult(loadTable(filename) is loadTable(filename), True)
+
 if __name__ == "__main__":
+    print "******************** Testing DetCal ********************"
+    testDetCal()
     print "******************** Testing Vector ********************"
     testVector()
     print "**************** Testing getOrientation ****************"
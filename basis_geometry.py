@@ -1,12 +1,14 @@
 #! /usr/bin/python
 
 from __future__ import print_function
-from helper import MantidGeom
+from helper import MantidGeom, generateVariants
 import h5py
 import math
 import numpy as np
 import os
 import sys
+import tempfile
+import zipfile
 
 """
 Runs with 311 analyzer have "3.2750" as /entry/DASlogs/chopWL/value.
@@ -34,6 +36,8 @@ reflections = {'generic': {'nexus': nexus_file_111,
               }
 
 n_inelastic_banks = 4
+BANK_IDS = ["bank%d" % (i+1) for i in range(n_inelastic_banks)]
+INST_NAME = "BASIS"
 
 INCH_TO_METRE = 0.0254
 
@@ -90,6 +94,157 @@ ELASTIC_TUBE_THICKNESS = ("tube_thickness",  (0.01 * INCH_TO_METRE), "metre")
 ELASTIC_TUBE_TEMPERATURE = ("tube_temperature", 290.0, "K")
 
 
+# Slicer for removing ghosts. Due to the mapping, the ghost tubes sit
+# on the same sides of the arrays for all banks.
+REMOVE_GHOSTS = slice(-INELASTIC_TUBES_NGHOST)
+# datasets of /entry/instrument/bank<n> used for the inelastic pixels
+BANK_DATASETS = ("pixel_id", "distance", "polar_angle", "azimuthal_angle")
+# where the datasets extracted from the event files are kept, next to this
+# script. The caches are not committed (see .gitignore), running the script
+# on a machine with the event files under /SNS creates them.
+GEOMETRY_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SNS", "BASIS")
+
+
+def geometry_cache_file(nexus):
+    r"""
+    Name of the file the geometry extracted from an event file is stored in
+
+    Parameters
+    ----------
+    nexus: str
+        path to the event NeXus file
+    Returns
+    -------
+    str
+    """
+    name = os.path.basename(nexus).replace("_event.nxs", "") + "_geometry.npz"
+    return os.path.join(GEOMETRY_CACHE_DIR, name)
+
+
+def source_stat(nexus):
+    r"""
+    Size and modification time of an event file, stored with its geometry
+    cache to tell when the cache is out of date
+
+    Parameters
+    ----------
+    nexus: str
+        path to the event NeXus file
+    Returns
+    -------
+    dict
+        "source_size" and "source_mtime" arrays
+    """
+    stat = os.stat(nexus)
+    return {"source_size": np.array(stat.st_size), "source_mtime": np.array(stat.st_mtime_ns)}
+
+
+def extract_geometry(nexus, cache_file):
+    r"""
+    Read the pixel datasets of the inelastic banks and the analyzer
+    wavelengths from an event NeXus file and store them in cache_file. The
+    ghost tubes are left out of the hyperslab, so only the datasets needed
+    are read, not the events.
+
+    Parameters
+    ----------
+    nexus: str
+        path to the event NeXus file
+    cache_file: str
+        path to the npz file to write
+    Returns
+    -------
+    dict
+        arrays as stored in cache_file
+    """
+    arrays = {"nghost": np.array(INELASTIC_TUBES_NGHOST)}
+    arrays.update(source_stat(nexus))
+    with h5py.File(nexus, 'r') as nfile:
+        for i in range(n_inelastic_banks):
+            for name in BANK_DATASETS:
+                dataset = nfile["/entry/instrument/bank%d/%s" % (i+1, name)]
+                arrays["bank%d_%s" % (i+1, name)] = dataset[REMOVE_GHOSTS]
+            dataset = nfile["/entry/instrument/analyzer%d/wavelength" % (i+1)]
+            arrays["bank%d_wavelength" % (i+1)] = dataset[REMOVE_GHOSTS]
+    directory = os.path.dirname(cache_file) or os.curdir
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    # write next to the cache and rename, so an interrupted run does not
+    # leave a truncated cache behind
+    handle, temporary = tempfile.mkstemp(suffix=".npz", dir=directory)
+    saved = False
+    try:
+        with os.fdopen(handle, "wb") as cache:
+            np.savez_compressed(cache, **arrays)
+        os.replace(temporary, cache_file)
+        saved = True
+    finally:
+        if not saved:
+            os.remove(temporary)
+    return arrays
+
+
+def load_geometry_cache(cache_file):
+    r"""
+    Arrays stored in a geometry cache
+
+    Parameters
+    ----------
+    cache_file: str
+        path to the npz file
+    Returns
+    -------
+    dict
+        None if the file does not exist, can not be read or lacks a dataset
+    """
+    names = ["nghost"] + ["bank%d_%s" % (i+1, name) for i in range(n_inelastic_banks)
+                          for name in BANK_DATASETS + ("wavelength",)]
+    try:
+        with np.load(cache_file) as cache:
+            if not all(name in cache for name in names):
+                return None
+            return dict(cache.items())
+    except (IOError, OSError, ValueError, EOFError, zipfile.BadZipFile):
+        return None
+
+
+def read_geometry(nexus):
+    r"""
+    Pixel datasets of the inelastic banks, without the ghost tubes. They
+    are read from the geometry cache of the event file, which is extracted
+    first if it does not exist, was extracted with another number of ghost
+    tubes, or the size or modification time of the event file changed. A
+    cache that can not be read counts as out of date. The cache is used as it
+    is when the event file is not available.
+
+    Parameters
+    ----------
+    nexus: str
+        path to the event NeXus file
+    Returns
+    -------
+    list
+        one dictionary per bank of the BANK_DATASETS and "wavelength"
+    """
+    cache_file = geometry_cache_file(nexus)
+    arrays = load_geometry_cache(cache_file)
+    if arrays is not None:
+        current = int(arrays["nghost"]) == INELASTIC_TUBES_NGHOST
+        if current and os.path.exists(nexus):
+            current = all(name in arrays and int(arrays[name]) == int(value)
+                          for name, value in source_stat(nexus).items())
+        if not current:
+            arrays = None
+    if arrays is None:
+        if not os.path.exists(nexus):
+            message = '{} not found. Not creating geometry'.format(nexus)
+            raise FileExistsError(message)
+        arrays = extract_geometry(nexus, cache_file)
+    return [dict((name, arrays["bank%d_%s" % (i+1, name)])
+                 for name in BANK_DATASETS + ("wavelength",))
+            for i in range(n_inelastic_banks)]
+
+
 def pixels_physical_xyz(bank_id):
     r"""
     Generate the cartesian positions of each pixel in a given bank
@@ -122,31 +277,17 @@ def pixels_physical_xyz(bank_id):
     return [np.array(component) for component in (xbank, ybank, zbank)]
 
 
-def generate_reflection_file(reflection_key):
+def make_shared():
     r"""
-
-    Parameters
-    ----------
-    reflection_key: str
+    Parts of the definition that are the same for all reflections
 
     Returns
     -------
-
+    tuple
+        (head, tail): elements before and after the inelastic pixels, serialized
+        by MantidGeom.extractElements
     """
-    refl = reflections[reflection_key]
-    if not os.path.exists(refl['nexus']):
-        message = '{} not found. Not creating geometry'.format(refl['nexus'])
-        raise FileExistsError(message)
-    inst_name = "BASIS"
-    # Set header information
-    comment = "Created by Michael Reuter and Jose Borreguero"
-    # Time needs to be in UTC?
-    valid_from = "2014-01-01 00:00:00"
-
-    xml_outfile = '{}_Definition_Si{}.xml'.format(inst_name, reflection_key)
-    nfile = h5py.File(refl['nexus'], 'r')
-
-    det = MantidGeom(inst_name, comment=comment, valid_from=valid_from)
+    det = MantidGeom(INST_NAME)
     det.addSnsDefaults(indirect=True)
     det.addComment("SOURCE AND SAMPLE POSITION")
     det.addModerator(-84.0)
@@ -158,37 +299,9 @@ def generate_reflection_file(reflection_key):
     det.addComment('INELASTIC DECTECTORS')
     det.addComponent('silicon')
     handle_silicon = det.makeTypeElement("silicon")
-    # Slicer for removing ghosts. Due to the mapping, the ghost tubes sit
-    # on the same sides of the arrays for all banks.
-    remove_ghosts = slice(-INELASTIC_TUBES_NGHOST)
-
-    for i in range(n_inelastic_banks):
-        bank_id = "bank%d" % (i+1)
-        pixel_id = nfile["/entry/instrument/bank%d/pixel_id" % (i+1)].value[remove_ghosts]
-        distance = nfile["/entry/instrument/bank%d/distance" % (i+1)].value[remove_ghosts]
-        # theta or polar_angle: angle from the Z-axis towards the X-axis
-        polar_angle = nfile["/entry/instrument/bank%d/polar_angle" % (i+1)].value[remove_ghosts]
-        polar_angle *= (180.0/math.pi)
-        # phi or azimuthal_angle: angle in the XY-plane
-        azimuthal_angle = nfile["/entry/instrument/bank%d/azimuthal_angle" % (i+1)].value[remove_ghosts]
-        azimuthal_angle *= (180.0/math.pi)
-
-        analyser_wavelength = nfile["/entry/instrument/analyzer%d/wavelength" % (i+1)].value[remove_ghosts]
-        analyser_wavelength *= refl['ratio_to_irreducible_hkl']
-        analyser_energy = 81.8042051/analyser_wavelength**2
-
+    for bank_id in BANK_IDS:
         det.addComponent(bank_id, idlist=bank_id, root=handle_silicon)
-
-        xbank, ybank, zbank = pixels_physical_xyz(i)
-        det.addDetectorPixels(bank_id, x=xbank, y=ybank, z=zbank,
-                              names=pixel_id, energy=analyser_energy,
-                              nr=distance, ntheta=polar_angle,
-                              nphi=azimuthal_angle,
-                              output_efixed=refl['efixed'])
-
-        det.addDetectorPixelsIdList(bank_id, r=distance, names=pixel_id,
-                                    elg="multiple_ranges")
-
+    head = det.extractElements()
 
     # Create the diffraction bank information
     det.addComponent("elastic", "elastic")
@@ -251,13 +364,71 @@ def generate_reflection_file(reflection_key):
 
     det.addComment("MONITOR IDs")
     det.addMonitorIds(["-1"])
+    tail = det.extractElements()
+    return head, tail
+
+
+def generate_reflection_file(reflection_key, shared=None):
+    r"""
+
+    Parameters
+    ----------
+    reflection_key: str
+    shared: tuple
+        elements returned by make_shared(), built here if None
+
+    Returns
+    -------
+
+    """
+    refl = reflections[reflection_key]
+    banks = read_geometry(refl['nexus'])
+    if shared is None:
+        shared = make_shared()
+    head, tail = shared
+    # Set header information
+    comment = "Created by Michael Reuter and Jose Borreguero"
+    # Time needs to be in UTC?
+    valid_from = "2014-01-01 00:00:00"
+
+    xml_outfile = '{}_Definition_Si{}.xml'.format(INST_NAME, reflection_key)
+
+    det = MantidGeom(INST_NAME, comment=comment, valid_from=valid_from)
+    # the inelastic banks hold one element per pixel, so stream them to disk
+    with det.streamGeom(xml_outfile):
+        det.addElements(head)
+        # everything so far is complete, write it out before the pixel-heavy banks
+        det.flush()
+
+        for i, (bank_id, bank) in enumerate(zip(BANK_IDS, banks)):
+            pixel_id = bank["pixel_id"]
+            distance = bank["distance"]
+            # theta or polar_angle: angle from the Z-axis towards the X-axis
+            polar_angle = bank["polar_angle"] * (180.0/math.pi)
+            # phi or azimuthal_angle: angle in the XY-plane
+            azimuthal_angle = bank["azimuthal_angle"] * (180.0/math.pi)
+
+            analyser_wavelength = bank["wavelength"] * refl['ratio_to_irreducible_hkl']
+            analyser_energy = 81.8042051/analyser_wavelength**2
+
+            xbank, ybank, zbank = pixels_physical_xyz(i)
+            det.addDetectorPixels(bank_id, x=xbank, y=ybank, z=zbank,
+                                  names=pixel_id, energy=analyser_energy,
+                                  nr=distance, ntheta=polar_angle,
+                                  nphi=azimuthal_angle,
+                                  output_efixed=refl['efixed'])
 
-    det.writeGeom(xml_outfile)
+            det.addDetectorPixelsIdList(bank_id, r=distance, names=pixel_id,
+                                        elg="multiple_ranges")
+            # release the pixels of this bank before reading the next one
+            det.flush()
 
-    # Always clean after yourself
-    nfile.close()
+        det.addElements(tail)
 
 
 if __name__ == "__main__":
-    for key in reflections:
-        generate_reflection_file(key)
+    # extract the geometry caches before the reflections sharing them run in parallel
+    for nexus in sorted(set(refl['nexus'] for refl in reflections.values())):
+        read_geometry(nexus)
+    shared = make_shared()
+    generateVariants(generate_reflection_file, [(key, shared) for key in reflections])
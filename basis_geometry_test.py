@@ -0,0 +1,124 @@
+import os
+import unittest
+
+import h5py
+import numpy as np
+
+import basis_geometry
+from testutils import TempDirTestCase
+
+NTUBES = 10
+NPIXELS = 3
+
+
+class TestReadGeometry(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.cachedir = basis_geometry.GEOMETRY_CACHE_DIR
+        basis_geometry.GEOMETRY_CACHE_DIR = self.path("cache")
+        self.nexus = self.path("BSS_1_event.nxs")
+        self.writeNexus(0.)
+        self.extracted = 0
+        self.extract = basis_geometry.extract_geometry
+
+        def countExtract(nexus, cache_file):
+            self.extracted += 1
+            return self.extract(nexus, cache_file)
+        basis_geometry.extract_geometry = countExtract
+
+    def tearDown(self):
+        basis_geometry.GEOMETRY_CACHE_DIR = self.cachedir
+        basis_geometry.extract_geometry = self.extract
+        TempDirTestCase.tearDown(self)
+
+    def writeNexus(self, offset, ntubes=NTUBES):
+        with h5py.File(self.nexus, "w") as nfile:
+            for i in range(basis_geometry.n_inelastic_banks):
+                values = np.arange(ntubes * NPIXELS, dtype=float).reshape(ntubes, NPIXELS)
+                values += 100. * i + offset
+                bank = nfile.create_group("entry/instrument/bank%d" % (i+1))
+                for name in basis_geometry.BANK_DATASETS:
+                    bank[name] = values
+                analyzer = nfile.create_group("entry/instrument/analyzer%d" % (i+1))
+                analyzer["wavelength"] = values
+
+    def checkBanks(self, banks, offset):
+        self.assertEqual(len(banks), basis_geometry.n_inelastic_banks)
+        nreal = NTUBES - basis_geometry.INELASTIC_TUBES_NGHOST
+        for i, bank in enumerate(banks):
+            expected = np.arange(nreal * NPIXELS, dtype=float).reshape(nreal, NPIXELS)
+            expected += 100. * i + offset
+            for name in basis_geometry.BANK_DATASETS + ("wavelength",):
+                np.testing.assert_array_equal(bank[name], expected)
+
+    def testHyperslab(self):
+        self.checkBanks(basis_geometry.read_geometry(self.nexus), 0.)
+        self.assertEqual(self.extracted, 1)
+        self.assertEqual(os.listdir(self.path("cache")), ["BSS_1_geometry.npz"])
+
+    def testCacheReused(self):
+        basis_geometry.read_geometry(self.nexus)
+        self.checkBanks(basis_geometry.read_geometry(self.nexus), 0.)
+        self.assertEqual(self.extracted, 1)
+
+    def testNghostChanged(self):
+        basis_geometry.read_geometry(self.nexus)
+        basis_geometry.INELASTIC_TUBES_NGHOST += 1
+        try:
+            basis_geometry.read_geometry(self.nexus)
+        finally:
+            basis_geometry.INELASTIC_TUBES_NGHOST -= 1
+        self.assertEqual(self.extracted, 2)
+
+    def testSizeChanged(self):
+        basis_geometry.read_geometry(self.nexus)
+        stat = os.stat(self.nexus)
+        self.writeNexus(0., 2 * NTUBES)
+        os.utime(self.nexus, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertNotEqual(os.stat(self.nexus).st_size, stat.st_size)
+        banks = basis_geometry.read_geometry(self.nexus)
+        self.assertEqual(self.extracted, 2)
+        nreal = 2 * NTUBES - basis_geometry.INELASTIC_TUBES_NGHOST
+        self.assertEqual(banks[0]["pixel_id"].shape, (nreal, NPIXELS))
+
+    def testMtimeChanged(self):
+        basis_geometry.read_geometry(self.nexus)
+        stat = os.stat(self.nexus)
+        self.writeNexus(1.)
+        os.utime(self.nexus, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(os.stat(self.nexus).st_size, stat.st_size)
+        self.checkBanks(basis_geometry.read_geometry(self.nexus), 1.)
+        self.assertEqual(self.extracted, 2)
+
+    def testNexusMissing(self):
+        basis_geometry.read_geometry(self.nexus)
+        os.remove(self.nexus)
+        self.checkBanks(basis_geometry.read_geometry(self.nexus), 0.)
+        self.assertEqual(self.extracted, 1)
+
+    def testCorruptCache(self):
+        basis_geometry.read_geometry(self.nexus)
+        with open(basis_geometry.geometry_cache_file(self.nexus), "w") as handle:
+            handle.write("not an npz file")
+        self.checkBanks(basis_geometry.read_geometry(self.nexus), 0.)
+        self.assertEqual(self.extracted, 2)
+        os.remove(self.nexus)
+        with open(basis_geometry.geometry_cache_file(self.nexus), "w") as handle:
+            handle.write("not an npz file")
+        self.assertRaises(FileExistsError, basis_geometry.read_geometry, self.nexus)
+
+    def testFailedWrite(self):
+        def failingSave(handle, **arrays):
+            handle.write(b"truncated")
+            raise ValueError("cannot save")
+        save = np.savez_compressed
+        np.savez_compressed = failingSave
+        try:
+            self.assertRaises(ValueError, basis_geometry.read_geometry, self.nexus)
+        finally:
+            np.savez_compressed = save
+        self.assertEqual(os.listdir(self.path("cache")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Benchmark the instrument generators and the building blocks they use.
+
+Every generator found by test_unchanged.findGeoms is run in its own copy of
+the repository, so inputs are fixed and outputs of one script cannot affect
+another. Caches are not copied, so every run starts from the inputs. The
+wall time, peak memory, and element count and size of every definition
+it writes are stored as json, which can be compared between commits with
+--compare.
+"""
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import geomcache
+from idfdiff import countElements
+from test_unchanged import findGeoms
+
+__version__ = "0.1.0"
+LOGLEVELS = ["INFO", "WARNING", "DEBUG"]
+# caches: test_unchanged's, the parsed surveys of sns_ncolumn and the
+# geometry basis_geometry extracts from the event files
+IGNORE = shutil.ignore_patterns(".git", "__pycache__", "*.pyc", ".pytest_cache",
+                                geomcache.CACHE_DIR, "*.cache.npz", "*_geometry.npz")
+
+
+def snapshot(source, destination):
+    """
+    Copy the repository to destination, which must not exist yet
+    """
+    shutil.copytree(source, destination, ignore=IGNORE)
+
+
+def listOutputs(directory):
+    """
+    Modification time of every definition file below directory
+    """
+    outputs = {}
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if name.endswith(".xml"):
+                filename = os.path.join(root, name)
+                outputs[filename] = os.stat(filename).st_mtime_ns
+    return outputs
+
+
+def runGenerator(source, script, timeout=None):
+    """
+    Run a generator script in a fresh copy of source. The script is run from
+    the root of the copy, like test_unchanged does.
+    :return: dictionary of the measurements
+    """
+    workdir = tempfile.mkdtemp(prefix="mantidgeom_bench_")
+    try:
+        tree = os.path.join(workdir, "tree")
+        snapshot(source, tree)
+        before = listOutputs(tree)
+        env = dict(os.environ, PYTHONPATH=tree)
+        env.pop("MANTIDGEOM_PROFILE", None)
+        with open(os.path.join(workdir, "log"), "w+") as log:
+            start = time.perf_counter()
+            proc = subprocess.Popen([sys.executable, script], cwd=tree, env=env,
+                                    stdout=log, stderr=subprocess.STDOUT,
+                                    stdin=subprocess.DEVNULL)
+            # reap the process with wait4 to get its resource usage
+            timed_out = False
+            while True:
+                options = 0 if timeout is None or timed_out else os.WNOHANG
+                pid, status, usage = os.wait4(proc.pid, options)
+                if pid:
+                    break
+                if time.perf_counter() - start > timeout:
+                    proc.kill()
+                    timed_out = True
+                time.sleep(0.01)
+            wall_time = time.perf_counter() - start
+            returncode = proc.returncode = os.waitstatus_to_exitcode(status)
+            if timed_out:
+                returncode = None
+            log.seek(0)
+            output = log.read()
+
+        result = dict(returncode=returncode, wall_time=wall_time,
+                      peak_rss_kb=usage.ru_maxrss,
+                      outputs={})
+        if returncode != 0:
+            result["log"] = output[-2000:]
+        after = listOutputs(tree)
+        for filename, mtime in sorted(after.items()):
+            if before.get(filename) == mtime:
+                continue
+            result["outputs"][os.path.relpath(filename, tree)] = dict(
+                bytes=os.path.getsize(filename), elements=countElements(filename))
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def benchmarkGenerators(source, scripts, repeat=1, timeout=None):
+    results = {}
+    for script in scripts:
+        logging.info("*****" + script + "*****")
+        runs = [runGenerator(source, script, timeout) for _ in range(repeat)]
+        # the fastest run is the least disturbed one
+        best = min(runs, key=lambda run: run["wall_time"])
+        best["wall_times"] = [run["wall_time"] for run in runs]
+        results[script] = best
+        logging.info(" {:.3f} s, {} kB, returned {}".format(
+            best["wall_time"], best["peak_rss_kb"], best["returncode"]))
+    return results
+
+
+def microbenchmarks(repeat=5):
+    """
+    Time the routines the generators spend most time in
+    :return: dictionary of the best time per call for every routine
+    """
+    from helper import MantidGeom
+    from rectangle import Rectangle, Vector, getEuler
+    from sns_ncolumn import readColumns, readFile
+
+    directory = tempfile.mkdtemp(prefix="mantidgeom_bench_")
+    try:
+        survey = os.path.join(directory, "survey.txt")
+        with open(survey, "w") as handle:
+            handle.write("bank x y z\n")
+            for i in range(10000):
+                handle.write("{} {} {} {}\n".format(i, .001 * i, -.002 * i, 3.))
+
+        corners = ((-0.1, -0.2, 1.0), (-0.1, 0.2, 1.1), (0.1, 0.2, 1.1), (0.1, -0.2, 1.0))
+        u_vec, v_vec = Vector(1., 0.1, 0.), Vector(0., 1., 0.2)
+        cases = [
+            ("rectangle.Rectangle", lambda: Rectangle(*corners), 1000),
+            ("rectangle.getEuler", lambda: getEuler(u_vec, v_vec, degrees=True), 1000),
+            ("sns_ncolumn.readFile", lambda: readFile(survey), 3),
+            ("sns_ncolumn.readColumns", lambda: readColumns(survey), 3),
+            ("sns_ncolumn.readColumns cached", lambda: readColumns(survey, cache=True), 3),
+            ("MantidGeom.addPixelatedTube",
+             lambda: MantidGeom("BENCH").addPixelatedTube("tube", 256, 1.), 100),
+        ]
+        results = {}
+        for name, function, number in cases:
+            times = timeit.repeat(function, number=number, repeat=repeat)
+            results[name] = dict(number=number, seconds_per_call=min(times) / number)
+            logging.info(" {}: {:.3e} s".format(name, results[name]["seconds_per_call"]))
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def gitRevision(directory):
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=directory,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compareResults(old, new, threshold=0.1):
+    """
+    Print the change of every measurement between two result files
+    :return: number of measurements that got worse by more than threshold
+    """
+    def rows():
+        for script in sorted(set(old["generators"]) | set(new["generators"])):
+            before = old["generators"].get(script, {})
+            after = new["generators"].get(script, {})
+            for key in ("wall_time", "peak_rss_kb"):
+                yield script, key, before.get(key), after.get(key)
+            outputs = set(before.get("outputs", {})) | set(after.get("outputs", {}))
+            for output in sorted(outputs):
+                for key in ("bytes", "elements"):
+                    yield (script + ":" + os.path.basename(output), key,
+                           before.get("outputs", {}).get(output, {}).get(key),
+                           after.get("outputs", {}).get(output, {}).get(key))
+        for name in sorted(set(old["micro"]) | set(new["micro"])):
+            yield (name, "seconds_per_call",
+                   old["micro"].get(name, {}).get("seconds_per_call"),
+                   new["micro"].get(name, {}).get("seconds_per_call"))
+
+    regressions = 0
+    print("{:<60}{:<18}{:>14}{:>14}{:>9}".format("benchmark", "measurement", "old", "new", "change"))
+    for name, key, before, after in rows():
+        if before is None or after is None:
+            change = "n/a"
+        elif before == 0:
+            change = "" if after == 0 else "new"
+        else:
+            ratio = after / before - 1.
+            change = "{:+.1%}".format(ratio)
+            if ratio > threshold:
+                regressions += 1
+                change += " !"
+        print("{:<60}{:<18}{:>14}{:>14}{:>9}".format(
+            name[-59:], key, "-" if before is None else "{:.6g}".format(before),
+            "-" if after is None else "{:.6g}".format(after), change))
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the instrument generators")
+    parser.add_argument("-l", "--loglevel", default="INFO",
+                        help="Specify the log level (" + ", ".join(LOGLEVELS) + "), default is INFO")
+    parser.add_argument("-v", "--version", action="store_true",
+                        help="Print the version information and exit")
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="json file to write the results to, default is benchmark.json")
+    parser.add_argument("--script", action="append",
+                        help="Script file to benchmark, can be repeated. Default is all generators")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Number of runs per generator, the fastest one is kept")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Seconds after which a generator is stopped")
+    parser.add_argument("--no-generators", dest="generators", action="store_false",
+                        help="Only run the microbenchmarks")
+    parser.add_argument("--no-micro", dest="micro", action="store_false",
+                        help="Skip the microbenchmarks")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two result files instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative increase reported as a regression by --compare")
+    options = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s:%(message)s',
+                        level=options.loglevel)
+
+    if options.version:
+        print(sys.argv[0] + " version " + __version__)
+        sys.exit(0)
+
+    if options.compare is not None:
+        results = []
+        for filename in options.compare:
+            with open(filename) as handle:
+                results.append(json.load(handle))
+        sys.exit(1 if compareResults(*results, threshold=options.threshold) else 0)
+
+    # generators are found and run relative to the repository root
+    directory = os.path.dirname(os.path.realpath(__file__))
+    os.chdir(directory)
+    if options.script is None:
+        scripts = sorted(os.path.normpath(script) for script in findGeoms())
+    else:
+        scripts = [os.path.relpath(os.path.abspath(script), directory)
+                   for script in options.script]
+
+    results = dict(version=__version__, revision=gitRevision(directory),
+                   python=platform.python_version(), generators={}, micro={})
+    if options.generators:
+        results["generators"] = benchmarkGenerators(directory, scripts, options.repeat,
+                                                    options.timeout)
+    if options.micro:
+        results["micro"] = microbenchmarks()
+
+    with open(options.output, "w") as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+    logging.info("wrote " + options.output)
@@ -66,7 +66,7 @@ pixel_idlist = 'flat_panel_ids'
 double_panel = add_double_flat_panel_component(double_panel, 'flat_panel_ids', det, iinfo['flat_array'])
 insert_location_from_logs(double_panel, log_key=['detector_trans_Readback', 'sample_detector_distance'],
                           coord_name=['x', 'z'], equation=['-0.001*value', 'value'])
-insert_side_by_side_view(double_panel, *iinfo['side_view_xy'])
+insert_side_by_side_view(double_panel, *iinfo['side_view_xy'], formatter=det.formatter)
 add_double_panel_idlist(det, iinfo, pixel_idlist)
 last_pixel_id = 8 * iinfo['number_eightpacks'] * iinfo['pixels_per_tube'] - 1
 last_bank_number = 2 * iinfo['number_eightpacks']
@@ -105,7 +105,7 @@ rot_y += 0.5 * panel_info['fourpack_slip'] / panel_info['bank_radius'] * 180. /
 det.addLocation(double_panel, 0., 0., 0, rot_y=f'{rot_y:.2f}')
 insert_location_from_logs(double_panel, log_key=['ww_rot_Readback', 'ww_rot_Readback'],
                           coord_name=['t-position', 'roty'], equation=[f'{rot_y:.2f}-value', f'{rot_y:.2f}-value'])
-insert_side_by_side_view(double_panel, *panel_info['side_view_xy'])
+insert_side_by_side_view(double_panel, *panel_info['side_view_xy'], formatter=det.formatter)
 add_double_panel_idlist(det, panel_info, pixel_idlist, start=1 + last_pixel_id)
 last_pixel_id += 8 * panel_info['number_eightpacks'] * panel_info['pixels_per_tube']
 last_bank_number += 2 * panel_info['number_eightpacks']
@@ -146,7 +146,7 @@ insert_location_from_logs(double_panel,
                           log_key=[panel_info['panel_translation_log_key'], panel_info['panel_translation_log_key']],
                           coord_name=['t-position', 'roty'],
                           equation=[f'{rot_y:.2f}+value', f'{rot_y:.2f}+value'])
-insert_side_by_side_view(double_panel, *panel_info['side_view_xy'])
+insert_side_by_side_view(double_panel, *panel_info['side_view_xy'], formatter=det.formatter)
 add_double_panel_idlist(det, panel_info, pixel_idlist, start=1 + last_pixel_id)
 #
 # Write to file
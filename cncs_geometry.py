@@ -1,4 +1,7 @@
 #!/usr/bin/python
+from helper import MantidGeom, generateVariants
+from sns_ncolumn import readFile
+from datetime import datetime, timedelta
 
 NUM_PIXELS_PER_TUBE = 128
 NUM_TUBES_PER_BANK = 8
@@ -16,34 +19,24 @@ TUBE_PRESSURE = ("tube_pressure", 6.0, "atm")
 TUBE_THICKNESS = ("tube_thickness", 0.0008, "metre")
 TUBE_TEMPERATURE = ("tube_temperature", 290.0, "K")
 
+INST_NAME = "CNCS"
+LABEL = "detectors"
+# Set header information
+COMMENT = "Created by Andrei Savici"
+# Time needs to be in UTC?
+VALID_FROM = "2025-08-07 10:00:00"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 def convert(value):
     return float(value) / CONVERT_TO_METERS
 
-if __name__ == "__main__":
-    import sys
-    from helper import MantidGeom
-    from sns_ncolumn import readFile
-
-
-
-    #For bad line endings use:    dos2unix -c Mac -n Distances2017A.txt  CNCS_geom_2017A.txt
-    try:
-        geom_input_file = sys.argv[1]
-    except IndexError:
-        geom_input_file = "SNS/CNCS/CNCS_geom_Pajerowski_2025A.txt"
-        
-    # Set header information
-    comment = "Created by Andrei Savici"
-    # Time needs to be in UTC?
-    valid_from = "2025-08-07 10:00:00"
-
-    # Get geometry information file
-    inst_name = "CNCS"
-    detinfo = readFile(geom_input_file)
-    num_dets = len(list(detinfo.values())[0])
-    xml_outfile = inst_name+"_Definition.xml"
- 
-    det = MantidGeom(inst_name, comment=comment, valid_from=valid_from)
+def makeShared():
+    """
+    Parts of the definition that do not depend on the geometry file,
+    serialized by MantidGeom.extractElements: the elements before the
+    banks, the types after them and the elements after the detector IDs
+    """
+    det = MantidGeom(INST_NAME)
     det.addSnsDefaults()
     det.addComment("SOURCE AND SAMPLE POSITION")
     det.addModerator(-36.262)
@@ -51,18 +44,7 @@ if __name__ == "__main__":
     det.addComment("MONITORS")
     det.addMonitors(names=["monitor1", "monitor2", "monitor3", "monitor4"],
                     distance=["-29.949", "-28.706", "-1.416", "3.7338"])
-
-    label = "detectors"
-    det.addComponent(label, label, blank_location=False)
-    doc_handle = det.makeTypeElement(label)
-    for i in range(num_dets):
-        detname = BANKFMT % (i+1)
-        roty = float(detinfo["BankAngle"][i]) + FLIPY
-        xpos = convert(detinfo["Bank_xpos"][i])
-        ypos = convert(detinfo["Bank_ypos"][i])
-        zpos = convert(detinfo["Bank_zpos"][i])
-        det.addComponent(detname, root=doc_handle, blank_location=False)
-        det.addDetector(xpos, ypos, zpos, ROTX, roty, ROTZ, detname, "eightpack")
+    head = det.extractElements()
 
     det.addComment("STANDARD 8-PACK")
     det.addNPack("eightpack", NUM_TUBES_PER_BANK, TUBE_WIDTH, AIR_GAP_WIDTH)
@@ -78,17 +60,110 @@ if __name__ == "__main__":
     det.addComment("MONITOR SHAPE")
     det.addComment("FIXME: Do something real here.")
     det.addDummyMonitor(0.01, 0.03)
-
-    det.addComment("DETECTOR IDs")
-    det.addDetectorIds(label, [0, (num_dets * PIXELS_PER_BANK) - 1 , None])
+    types = det.extractElements()
 
     det.addComment("MONITOR IDs")
     det.addMonitorIds(["-1", "-2", "-3", "-4"])
 
     det.addComment("DETECTOR PARAMETERS")
-    det.addDetectorParameters(label, TUBE_PRESSURE, TUBE_THICKNESS,
-                              TUBE_TEMPERATURE)    
-    
+    det.addDetectorParameters(LABEL, TUBE_PRESSURE, TUBE_THICKNESS,
+                              TUBE_TEMPERATURE)
+    tail = det.extractElements()
+    return head, types, tail
+
+def validRanges(names, valid_from, valid_to=None):
+    """
+    valid-from and valid-to of the definition of every geometry file, from
+    dictionaries keyed by the file names. Every file needs a valid-from. A
+    definition without a valid-to is valid until one second before the
+    next one starts, the last one until the default of MantidGeom.
+    """
+    valid_to = valid_to or {}
+    missing = [name for name in names if name not in valid_from]
+    if missing:
+        raise RuntimeError("No valid-from for " + ", ".join(missing))
+    starts = dict((name, datetime.strptime(valid_from[name], DATE_FORMAT)) for name in names)
+    ordered = sorted(names, key=lambda name: starts[name])
+    ranges = {}
+    for name, following in zip(ordered, ordered[1:] + [None]):
+        end = valid_to.get(name)
+        if end is None and following is not None:
+            if starts[following] == starts[name]:
+                raise RuntimeError("{} and {} have the same valid-from".format(name, following))
+            end = (starts[following] - timedelta(seconds=1)).strftime(DATE_FORMAT)
+        ranges[name] = (valid_from[name], end)
+    return ranges
+
+def writeGeometry(geom_input_file, xml_outfile, shared, valid_from=VALID_FROM, valid_to=None):
+    """
+    Write the definition of the banks in geom_input_file
+    """
+    head, types, tail = shared
+    detinfo = readFile(geom_input_file)
+    num_dets = len(list(detinfo.values())[0])
+
+    det = MantidGeom(INST_NAME, comment=COMMENT, valid_from=valid_from, valid_to=valid_to)
+    det.addElements(head)
+
+    det.addComponent(LABEL, LABEL, blank_location=False)
+    doc_handle = det.makeTypeElement(LABEL)
+    for i in range(num_dets):
+        detname = BANKFMT % (i+1)
+        roty = float(detinfo["BankAngle"][i]) + FLIPY
+        xpos = convert(detinfo["Bank_xpos"][i])
+        ypos = convert(detinfo["Bank_ypos"][i])
+        zpos = convert(detinfo["Bank_zpos"][i])
+        det.addComponent(detname, root=doc_handle, blank_location=False)
+        det.addDetector(xpos, ypos, zpos, ROTX, roty, ROTZ, detname, "eightpack")
+    det.addElements(types)
+
+    det.addComment("DETECTOR IDs")
+    det.addDetectorIds(LABEL, [0, (num_dets * PIXELS_PER_BANK) - 1 , None])
+    det.addElements(tail)
+
     #det.showGeom()
     det.writeGeom(xml_outfile)
 
+if __name__ == "__main__":
+    import argparse
+    import os
+    parser = argparse.ArgumentParser(description="Generate the CNCS instrument definition")
+    parser.add_argument("geometry", nargs="*",
+                        help="Geometry files, one definition is written for each. With several, "
+                        "CNCS_geom_<suffix>.txt gives CNCS_Definition_<suffix>.xml. Default is "
+                        "SNS/CNCS/CNCS_geom_Pajerowski_2025A.txt")
+    parser.add_argument("--valid-from", nargs=2, action="append", default=[],
+                        metavar=("GEOMETRY", "DATE"),
+                        help="valid-from of the definition of a geometry file, as "
+                        "'YYYY-MM-DD hh:mm:ss'. Required for every file when there are several")
+    parser.add_argument("--valid-to", nargs=2, action="append", default=[],
+                        metavar=("GEOMETRY", "DATE"),
+                        help="valid-to of the definition of a geometry file. Default is one second "
+                        "before the next definition starts")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of definitions written in parallel, default is the number of cpus")
+    options = parser.parse_args()
+
+    #For bad line endings use:    dos2unix -c Mac -n Distances2017A.txt  CNCS_geom_2017A.txt
+    valid_from = dict(options.valid_from)
+    names = list(options.geometry)
+    if not names:
+        names = ["SNS/CNCS/CNCS_geom_Pajerowski_2025A.txt"]
+    unknown = [name for name, _ in options.valid_from + options.valid_to if name not in names]
+    if unknown:
+        parser.error("not a geometry file to write: " + ", ".join(unknown))
+    if len(names) == 1:
+        valid_from.setdefault(names[0], VALID_FROM)
+        outfiles = [INST_NAME+"_Definition.xml"]
+    else:
+        outfiles = [INST_NAME + "_Definition_"
+                    + os.path.splitext(os.path.basename(name))[0].replace(INST_NAME + "_geom_", "")
+                    + ".xml" for name in names]
+    try:
+        ranges = validRanges(names, valid_from, dict(options.valid_to))
+    except (RuntimeError, ValueError) as e:
+        parser.error(str(e))
+
+    shared = makeShared()
+    generateVariants(writeGeometry, [(name, outfile, shared) + ranges[name] for name, outfile
+                                     in zip(names, outfiles)], options.jobs)
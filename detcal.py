@@ -0,0 +1,104 @@
+"""
+Reader of ISAW DetCal files, the calibration of MANDI and TOPAZ.
+
+All detector lines (flag 5) are read into one (N, 16) array in the units
+of the file, centimetres, and the panel sizes, centers and orientations of
+every bank are computed from it at once.
+"""
+import os
+
+import numpy as np
+
+from rectangle import getEulerArray
+
+# labels of the values on the detector lines, after the flag
+COLUMNS = ("DETNUM", "NROWS", "NCOLS", "WIDTH", "HEIGHT", "DEPTH", "DETD",
+           "CenterX", "CenterY", "CenterZ", "BaseX", "BaseY", "BaseZ", "UpX", "UpY", "UpZ")
+# labels of the values on the flag 7 line
+HEADER = ("L1", "T0_SHIFT")
+PIXELS_PER_BANK = 256 * 256
+
+
+class DetCal(object):
+    """
+    Class holding information for a whole ISAW detcal file
+    """
+    def __init__(self, filename):
+        if not os.path.exists(filename):
+            raise RuntimeError("File '%s' does not exist" % filename)
+
+        rows = []
+        self.header = None
+        with open(filename) as handle:
+            for line in handle:
+                if line.startswith('#') or not line.strip():
+                    continue  # comment line
+
+                flag = int(line[0])  # each line has a flag
+                values = line[1:].split()
+
+                if flag == 4 or flag == 6:
+                    pass  # label banks, label on l1/t0_shift
+                elif flag == 5:
+                    if len(values) != len(COLUMNS):
+                        raise RuntimeError('Expected {} values for a bank, found {}'
+                                           .format(len(COLUMNS), len(values)))
+                    rows.append(values)
+                elif flag == 7:
+                    self.header = dict(zip(HEADER, [float(value) for value in values]))
+                else:
+                    raise RuntimeError('Do not know how to deal with flag {}'.format(flag))
+
+        self.table = np.array(rows, dtype=float).reshape(len(rows), len(COLUMNS))
+
+    def __len__(self):
+        return len(self.table)
+
+    def column(self, label):
+        """
+        Values of a column for all banks, in the units of the file
+        """
+        return self.table[:, COLUMNS.index(label)]
+
+    def __columns(self, first, last):
+        return self.table[:, COLUMNS.index(first):COLUMNS.index(last) + 1]
+
+    l1 = property(lambda self: self.header["L1"] / 100.,
+                  doc="Distance from the moderator to the sample in metres")
+    t0 = property(lambda self: self.header["T0_SHIFT"])
+    det_num = property(lambda self: self.column("DETNUM").astype(int))
+    first_pixel = property(lambda self: PIXELS_PER_BANK * self.det_num)
+    nrows = property(lambda self: self.column("NROWS").astype(int))
+    ncols = property(lambda self: self.column("NCOLS").astype(int))
+    width = property(lambda self: self.column("WIDTH") / 100., doc="Panel widths in metres")
+    height = property(lambda self: self.column("HEIGHT") / 100., doc="Panel heights in metres")
+    center = property(lambda self: self.__columns("CenterX", "CenterZ") / 100.,
+                      doc="(N, 3) panel centers in metres")
+    base = property(lambda self: self.__columns("BaseX", "BaseZ"),
+                    doc="(N, 3) directions of the panel rows")
+    up = property(lambda self: self.__columns("UpX", "UpZ"),
+                  doc="(N, 3) directions of the panel columns")
+
+    def pixelSize(self):
+        """
+        Step and start of the pixels across the rows and the columns of
+        every panel, relative to its center, in metres
+        :return: deltaX, startX, deltaY, startY arrays
+        """
+        width, height = self.width, self.height
+        deltaX = width / self.nrows
+        deltaY = height / self.ncols
+        return deltaX, 0.5 * (deltaX - width), deltaY, 0.5 * (deltaY - height)
+
+    def eulerAngles(self, degrees=True):
+        """
+        (N, 3) phi, chi, omega of every panel, see rectangle.getEuler
+        """
+        return getEulerArray(self.base, self.up, degrees=degrees)
+
+    def rotations(self, degrees=True):
+        """
+        Rotations of every panel as (angle, axis) for rectangle.makeLocation
+        """
+        return [[(omega, [0, 1, 0]), (chi, [0, 0, 1]), (phi, [0, 1, 0])]
+                for phi, chi, omega in self.eulerAngles(degrees).tolist()]
@@ -0,0 +1,60 @@
+#!/bin/env python
+from detcal import DetCal
+from rectangle import Vector, getEuler
+import numpy as np
+from testutils import TempDirTestCase
+import unittest
+
+DETCAL = """# comment
+6         L1    T0_SHIFT
+7  3004.6507       -5.364
+4 DETNUM  NROWS  NCOLS   WIDTH   HEIGHT   DEPTH   DETD   CenterX   CenterY   CenterZ    BaseX    BaseY    BaseZ      UpX      UpY      UpZ
+5      1    256    256  15.8976  15.8208  0.2000  40.95   -2.1039  -37.4176   16.4951 -0.99712  0.07530 -0.00935  0.02234  0.40903  0.91225
+
+5      2    128    256  15.9232  15.8208  0.2000  43.70   15.3053  -37.1777   17.1363  1.00000  0.00000  0.00000  0.00000  1.00000  0.00000
+"""
+
+
+class TestDetCal(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.filename = self.write("test.DetCal", DETCAL)
+
+    def testRead(self):
+        detcal = DetCal(self.filename)
+        self.assertEqual(len(detcal), 2)
+        self.assertEqual(detcal.table.shape, (2, 16))
+        self.assertAlmostEqual(detcal.l1, 30.046507)
+        self.assertEqual(detcal.t0, -5.364)
+        self.assertEqual(detcal.det_num.tolist(), [1, 2])
+        self.assertEqual(detcal.first_pixel.tolist(), [65536, 131072])
+        self.assertEqual(detcal.column("DETD").tolist(), [40.95, 43.7])
+        np.testing.assert_allclose(detcal.center[1], [.153053, -.371777, .171363])
+
+        deltaX, startX, deltaY, startY = detcal.pixelSize()
+        width, height = 15.9232 / 100., 15.8208 / 100.
+        self.assertEqual(deltaX[1], width / 128)
+        self.assertEqual(startX[1], .5 * (width / 128 - width))
+        self.assertEqual(deltaY[1], height / 256)
+        self.assertEqual(startY[1], .5 * (height / 256 - height))
+
+    def testRotations(self):
+        detcal = DetCal(self.filename)
+        angles = detcal.eulerAngles()
+        self.assertEqual(angles.shape, (2, 3))
+        for (base, up), expected in zip(zip(detcal.base, detcal.up), angles.tolist()):
+            # the array functions may round the last bit differently
+            np.testing.assert_allclose(getEuler(Vector(base), Vector(up), degrees=True), expected,
+                                       rtol=1.e-12)
+        self.assertEqual(detcal.rotations()[1], [(0., [0, 1, 0]), (0., [0, 0, 1]), (0., [0, 1, 0])])
+
+    def testErrors(self):
+        self.assertRaises(RuntimeError, DetCal, self.path("missing.DetCal"))
+        self.write("test.DetCal", DETCAL + "5 3 256 256\n")
+        self.assertRaises(RuntimeError, DetCal, self.filename)
+        self.write("test.DetCal", DETCAL + "8 3\n")
+        self.assertRaises(RuntimeError, DetCal, self.filename)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,259 @@
+"""
+Content addressed cache of the generated geometries.
+
+The output of a generator is keyed by the hashes of its inputs: the script,
+the local modules it imports and the data files it names in string literals,
+such as the survey files in SNS/. A generator whose inputs are unchanged is
+not run again, its outputs are restored from the cache when they are
+missing or were modified. All paths are relative to the repository root,
+the directory the generators are run from.
+"""
+import ast
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+CACHE_DIR = ".unchanged_cache"
+# generated files are not inputs even when a script names them
+GENERATED = ["*_Definition*.xml", "*_Parameters*.xml"]
+# longest string literal considered as a file name
+MAX_PATH = 256
+
+
+def _hashFile(filename):
+    sha = hashlib.sha1()
+    with open(filename, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _statFile(filename):
+    """
+    Size and modification time of a file, in place of the hash of files
+    outside the repository, such as the event files under /SNS, which are
+    large and not changed in place
+    """
+    stat = os.stat(filename)
+    return "size %d mtime %d" % (stat.st_size, stat.st_mtime_ns)
+
+
+def _moduleFile(name, directories):
+    """
+    Python file of a module in one of directories, or None
+    """
+    parts = name.split(".")
+    for directory in directories:
+        base = os.path.join(directory, *parts)
+        for candidate in (base + ".py", os.path.join(base, "__init__.py")):
+            if os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def _parse(filename):
+    with open(filename, "rb") as handle:
+        source = handle.read()
+    try:
+        return ast.parse(source, filename)
+    except (SyntaxError, ValueError):
+        # e.g. python 2 scripts, the file itself is still an input
+        return None
+
+
+def _relative(filename):
+    return os.path.relpath(os.path.abspath(filename))
+
+
+def _isGenerated(filename):
+    name = os.path.basename(filename)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in GENERATED)
+
+
+def outputFiles(outfile):
+    """
+    Generated files of the instrument of outfile, the ones in its directory
+    and in the current one whose names start with the instrument, such as
+    BASIS_Definition_Si111.xml for BASIS_Definition.xml
+    :return: dictionary of the size and modification time of every file
+    """
+    prefix = os.path.basename(outfile).split("_")[0] + "_"
+    files = {}
+    for directory in set([os.curdir, os.path.normpath(os.path.dirname(outfile) or os.curdir)]):
+        for name in os.listdir(directory):
+            filename = os.path.join(directory, name)
+            if name.startswith(prefix) and _isGenerated(filename) and os.path.isfile(filename):
+                stat = os.stat(filename)
+                files[_relative(filename)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def writtenFiles(outfile, before):
+    """
+    Generated files of the instrument of outfile that are new or changed
+    since before, the outputFiles taken before the script ran
+    """
+    return sorted(filename for filename, stat in outputFiles(outfile).items()
+                  if before.get(filename) != stat)
+
+
+def findInputs(pyscript):
+    """
+    Files a generator depends on: the script, the local modules it imports,
+    recursively, and the existing files named by their string literals
+    :return: sorted list of paths relative to the current directory
+    """
+    root = os.path.abspath(os.curdir)
+    inputs = set()
+    todo = [os.path.abspath(pyscript)]
+    scriptdir = os.path.dirname(todo[0])
+    while todo:
+        filename = todo.pop()
+        if filename in inputs:
+            continue
+        inputs.add(filename)
+        tree = _parse(filename)
+        if tree is None:
+            continue
+        moduledir = os.path.dirname(filename)
+        directories = [moduledir, scriptdir, root]
+        for node in ast.walk(tree):
+            names = []
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    base = moduledir
+                    for _ in range(node.level - 1):
+                        base = os.path.dirname(base)
+                    search = [base]
+                else:
+                    search = directories
+                prefix = node.module + "." if node.module else ""
+                # imported names may be submodules
+                names = [prefix + alias.name for alias in node.names]
+                if node.module:
+                    names.append(node.module)
+                for name in names:
+                    module = _moduleFile(name, search)
+                    if module is not None:
+                        todo.append(os.path.abspath(module))
+                continue
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+                value = node.value
+                if 0 < len(value) <= MAX_PATH and "\n" not in value:
+                    for candidate in (os.path.join(root, value), os.path.join(scriptdir, value)):
+                        if os.path.isfile(candidate) and not _isGenerated(candidate):
+                            inputs.add(os.path.abspath(candidate))
+                            break
+            for name in names:
+                module = _moduleFile(name, directories)
+                if module is not None:
+                    todo.append(os.path.abspath(module))
+    return sorted(os.path.relpath(filename, root) for filename in inputs)
+
+
+class GeometryCache(object):
+    """
+    Inputs and outputs of the generators, kept in directory as a manifest
+    and the output files named by their hash
+    """
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.objects = os.path.join(directory, "objects")
+        self.manifest = os.path.join(directory, "manifest.json")
+        self.entries = {}
+        if os.path.exists(self.manifest):
+            with open(self.manifest) as handle:
+                self.entries = json.load(handle)
+        self.__hashes = {}
+
+    def hashFile(self, filename):
+        """
+        Hash of a file, computed once per cache object
+        """
+        if filename not in self.__hashes:
+            self.__hashes[filename] = _hashFile(filename)
+        return self.__hashes[filename]
+
+    def inputs(self, pyscript):
+        """
+        :return: dictionary of the hash of every input of pyscript, or of
+                 the size and modification time of the inputs outside the
+                 repository
+        """
+        inputs = {}
+        for filename in findInputs(pyscript):
+            if filename.startswith(os.pardir + os.sep):
+                inputs[filename] = _statFile(filename)
+            else:
+                inputs[filename] = self.hashFile(filename)
+        inputs["(python)"] = sys.version
+        return inputs
+
+    def check(self, pyscript):
+        """
+        Compare the inputs of pyscript with the cached ones and restore the
+        cached outputs if they are current.
+        :return: the reasons to run pyscript, empty if it is up to date, and
+                 the inputs to store once it has run
+        """
+        inputs = self.inputs(pyscript)
+        entry = self.entries.get(_relative(pyscript))
+        if entry is None:
+            return ["not cached"], inputs
+        reasons = []
+        for filename in sorted(set(inputs) | set(entry["inputs"])):
+            if filename not in entry["inputs"]:
+                reasons.append(filename + " added")
+            elif filename not in inputs:
+                reasons.append(filename + " removed")
+            elif inputs[filename] != entry["inputs"][filename]:
+                reasons.append(filename + " changed")
+        if reasons:
+            return reasons, inputs
+        for filename, sha in entry["outputs"].items():
+            if os.path.exists(filename) and self.hashFile(filename) == sha:
+                continue
+            cached = os.path.join(self.objects, sha)
+            if not os.path.exists(cached):
+                return [filename + " not in cache"], inputs
+            shutil.copyfile(cached, filename)
+            self.__hashes[filename] = sha
+        return [], inputs
+
+    def store(self, pyscript, inputs, outputs):
+        """
+        Record the inputs pyscript was run with and the outputs it wrote,
+        see writtenFiles
+        """
+        if not os.path.isdir(self.objects):
+            os.makedirs(self.objects)
+        hashes = {}
+        for filename in outputs:
+            if not os.path.exists(filename):
+                continue
+            filename = _relative(filename)
+            sha = hashes[filename] = self.__hashes[filename] = _hashFile(filename)
+            cached = os.path.join(self.objects, sha)
+            if not os.path.exists(cached):
+                shutil.copyfile(filename, cached)
+        self.entries[_relative(pyscript)] = dict(inputs=inputs, outputs=hashes)
+
+    def save(self):
+        """
+        Write the manifest and remove the outputs no entry refers to
+        """
+        if not os.path.isdir(self.objects):
+            os.makedirs(self.objects)
+        temporary = self.manifest + ".tmp"
+        with open(temporary, "w") as handle:
+            json.dump(self.entries, handle, indent=1, sort_keys=True)
+        os.replace(temporary, self.manifest)
+        used = set(sha for entry in self.entries.values() for sha in entry["outputs"].values())
+        for name in os.listdir(self.objects):
+            if name not in used:
+                os.remove(os.path.join(self.objects, name))
@@ -0,0 +1,88 @@
+#!/bin/env python
+from geomcache import GeometryCache, findInputs, outputFiles, writtenFiles
+import os
+import shutil
+import tempfile
+from testutils import TempDirTestCase
+import unittest
+
+SCRIPT = """import os
+from common import MantidGeom
+from SNS import utilities
+survey = "SNS/survey.txt"
+output = "TEST_Definition.xml"
+"""
+
+
+class TestGeometryCache(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.cwd = os.getcwd()
+        os.chdir(self.direc)
+        os.makedirs("SNS")
+        self.write("test_geometry.py", SCRIPT)
+        self.write("common.py", "import rectangle\n")
+        self.write("rectangle.py", "")
+        self.write("SNS/__init__.py", "")
+        self.write("SNS/utilities.py", "from . import helper\n")
+        self.write("SNS/helper.py", "")
+        self.write("SNS/survey.txt", "1 2 3\n")
+        self.write("TEST_Definition.xml", "<instrument/>\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        TempDirTestCase.tearDown(self)
+
+    def testFindInputs(self):
+        self.assertEqual(findInputs("test_geometry.py"),
+                         ["SNS/__init__.py", "SNS/helper.py", "SNS/survey.txt",
+                          "SNS/utilities.py", "common.py", "rectangle.py", "test_geometry.py"])
+
+    def testCheck(self):
+        cache = GeometryCache()
+        reasons, inputs = cache.check("test_geometry.py")
+        self.assertEqual(reasons, ["not cached"])
+        cache.store("./test_geometry.py", inputs, ["TEST_Definition.xml"])
+        cache.save()
+
+        # outputs are restored from the cache
+        os.remove("TEST_Definition.xml")
+        cache = GeometryCache()
+        self.assertEqual(cache.check(os.path.abspath("test_geometry.py"))[0], [])
+        with open("TEST_Definition.xml") as handle:
+            self.assertEqual(handle.read(), "<instrument/>\n")
+
+        self.write("rectangle.py", "x = 1\n")
+        self.assertEqual(GeometryCache().check("test_geometry.py")[0], ["rectangle.py changed"])
+
+
+    def testWrittenFiles(self):
+        before = outputFiles("TEST_Definition.xml")
+        self.assertEqual(sorted(before), ["TEST_Definition.xml"])
+        self.write("TEST_Definition_2020-01-01.xml", "<instrument/>\n")
+        self.write("TEST_Parameters.xml", "<parameter-file/>\n")
+        self.write("OTHER_Definition.xml", "<instrument/>\n")
+        self.assertEqual(writtenFiles("TEST_Definition.xml", before),
+                         ["TEST_Definition_2020-01-01.xml", "TEST_Parameters.xml"])
+
+    def testOutsideInputs(self):
+        # files outside the repository are keyed by size and modification time
+        outside = tempfile.mkdtemp()
+        try:
+            event = os.path.join(outside, "TEST_1_event.nxs")
+            self.write(event, "events")
+            self.write("test_geometry.py", SCRIPT + "nexus = %r\n" % event)
+            inputs = GeometryCache().inputs("test_geometry.py")
+            key = os.path.relpath(event)
+            self.assertTrue(inputs[key].startswith("size 6 mtime "))
+            cache = GeometryCache()
+            reasons, inputs = cache.check("test_geometry.py")
+            cache.store("test_geometry.py", inputs, ["TEST_Definition.xml"])
+            os.utime(event, (1, 1))
+            self.assertEqual(cache.check("test_geometry.py")[0], [key + " changed"])
+        finally:
+            shutil.rmtree(outside)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,11 +1,18 @@
 from __future__ import (print_function)
 
+import functools
+import hashlib
+import inspect
+import io
+import json
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stdout
 from datetime import datetime
 from lxml import etree as le  # python-lxml on rpm based systems
 import numpy as np
-from itertools import groupby
-from operator import itemgetter
 
 # Conversions from 2.7 to 3.x without modifying the code
 split = lambda s: s.split()  # replaces from string import split
@@ -17,10 +24,393 @@ XMLNS = "http://www.mantidproject.org/IDF/1.0"
 XSI = "http://www.w3.org/2001/XMLSchema-instance"
 SCHEMA_LOC = "http://www.mantidproject.org/IDF/1.0 http://schema.mantidproject.org/IDF/1.0/IDFSchema.xsd"
 nEA = np.empty(0)  # empty array
+_QUANTITIES = dict(x="length", y="length", z="length", r="length",
+                   t="angle", p="angle")  # quantity of each coordinate
+_XML_ESCAPES = (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'), ('"', '&quot;'))
+_SWITCHES = dict([(value, False) for value in ("", "0", "false", "no", "off")] +
+                 [(value, True) for value in ("1", "true", "yes", "on")])
+
+
+def _attribute_strings(values):
+    """
+    Format the entries of an array as escaped xml attribute values, matching
+    what str() gives for every single entry
+    """
+    strings = np.asarray(values).ravel().astype(str)
+    for char, escaped in _XML_ESCAPES:
+        if strings.size and np.char.find(strings, char).max() >= 0:
+            strings = np.char.replace(strings, char, escaped)
+    return strings.tolist()
+
+
+class NumberFormatter:
+    """
+    Turns the numbers written to the geometry into strings. The number of
+    decimals is set per quantity: length, angle or energy. A quantity left
+    at None keeps the format of each call site, which is str() unless the
+    call site asks for a number of decimals.
+    """
+    QUANTITIES = ("length", "angle", "energy")
+
+    def __init__(self, length=None, angle=None, energy=None):
+        self.precision = dict(length=length, angle=angle, energy=energy)
+
+    def __decimals(self, quantity, decimals):
+        if quantity not in self.precision:
+            raise ValueError("Unknown quantity '{}', use one of {}".format(
+                quantity, ", ".join(self.QUANTITIES)))
+        precision = self.precision[quantity]
+        return decimals if precision is None else precision
+
+    def format(self, value, quantity="length", decimals=None):
+        """
+        Format a single number. Values that are not numbers are returned
+        as str() gives them.
+        :param decimals: number of decimals when the quantity has no precision
+        """
+        decimals = self.__decimals(quantity, decimals)
+        if decimals is None:
+            return str(value)
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return str(value)
+        return "{:.{}f}".format(number, decimals)
+
+    def formatArray(self, values, quantity="length", decimals=None):
+        """
+        Format all the numbers of an array at once. Gives the same strings as
+        format() for every entry, as a flat list.
+        """
+        decimals = self.__decimals(quantity, decimals)
+        values = np.asarray(values).ravel()
+        if decimals is None:
+            return values.astype(str).tolist()
+        try:
+            numbers = values.astype(float)
+        except (TypeError, ValueError):
+            return [self.format(value, quantity, decimals) for value in values.tolist()]
+        return np.char.mod("%.{}f".format(decimals), numbers).tolist()
+
+    def length(self, value, decimals=None):
+        return self.format(value, "length", decimals)
+
+    def angle(self, value, decimals=None):
+        return self.format(value, "angle", decimals)
+
+    def energy(self, value, decimals=None):
+        return self.format(value, "energy", decimals)
+
+
+def makeIdRanges(ids, strided=True):
+    """
+    Compact a sequence of detector IDs into runs, in the format taken by
+    MantidGeom.addDetectorIds: [start1, end1, step1, start2, end2, step2, ...]
+    The order of the IDs is kept. Runs with a step of one, and single IDs,
+    get a step of None.
+    :param ids: array-like of integer IDs
+    :param strided: also find runs with a constant step other than one
+    """
+    ids = np.asarray(ids, dtype=np.int64).ravel()
+    if ids.size == 0:
+        return []
+    steps = np.diff(ids)
+    allowed = (steps != 0) if strided else (steps == 1)
+    # last step index of the stretch of equal steps starting at each index
+    breaks = np.flatnonzero((steps[1:] != steps[:-1]) | ~allowed[1:])
+    stretch_end = np.append(breaks, steps.size - 1)
+    stretch_end = np.repeat(stretch_end, np.diff(np.append(-1, stretch_end)))
+
+    idlist = list()
+    start = 0
+    while start < ids.size:
+        if start == ids.size - 1 or not allowed[start]:
+            idlist += [int(ids[start]), int(ids[start]), None]
+            start += 1
+            continue
+        end = stretch_end[start] + 1
+        step = int(steps[start])
+        idlist += [int(ids[start]), int(ids[end]), None if step == 1 else step]
+        start = end + 1
+    return idlist
+
+
+def _profileSetting(value):
+    """
+    Profile option given by the MANTIDGEOM_PROFILE environment variable:
+    True for the table, False for none, or the name of the json file
+    """
+    switch = _SWITCHES.get(value.strip().lower())
+    if switch is not None:
+        return switch
+    if os.sep in value or (os.altsep and os.altsep in value) or value.endswith(".json"):
+        return value
+    raise RuntimeError("MANTIDGEOM_PROFILE='{}' is neither on/off (1, true, yes, on, 0, false, "
+                       "no, off) nor a path ending with .json or containing a separator"
+                       .format(value))
+
+
+def _runVariant(function, variant):
+    """
+    Call function(*variant) and return its result and what it printed
+    """
+    output = io.StringIO()
+    with redirect_stdout(output):
+        result = function(*variant)
+    return result, output.getvalue()
+
+
+def generateVariants(function, variants, jobs=None):
+    """
+    Call function(*variant) for every variant in a pool of jobs worker
+    processes, e.g. to write a family of definitions that differ in a few
+    banks. The function and the arguments are sent to the workers, so they
+    must be picklable, see MantidGeom.extractElements. What the workers
+    print is printed here, in the order of the variants. With jobs=1 the
+    variants are run one after the other in this process.
+    :return: the results in the order of the variants
+    """
+    variants = list(variants)
+    if jobs == 1 or len(variants) < 2:
+        return [function(*variant) for variant in variants]
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_runVariant, function, variant) for variant in variants]
+        for future in futures:
+            result, output = future.result()
+            sys.stdout.write(output)
+            results.append(result)
+    return results
+
+
+def _typeKey(element):
+    """
+    Canonical form of a type subtree that ignores the name of the type and
+    comments, used to find structurally identical types
+    """
+    parts = list()
+    for event, node in le.iterwalk(element, events=("start", "end")):
+        if not isinstance(node.tag, str):
+            continue
+        if event == "end":
+            parts.append("/")
+            continue
+        attrib = sorted(node.attrib.items())
+        if node is element:
+            attrib = [item for item in attrib if item[0] != "name"]
+        parts.append(repr((node.tag, attrib, (node.text or "").strip())))
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _typeReferences(root):
+    """
+    Elements of the tree that refer to a type by name
+    """
+    for node in root.iter("component", "type"):
+        if "type" in node.attrib:
+            yield node
+
+
+class _PixelBlock:
+    """
+    Pixels of a type kept as a structured array until they are written. The
+    fields are the pixel name, the real position (x, y, z or r, t, p), the
+    neutronic position (the same names prefixed with n) and the energy, each
+    with the dtype it was given in.
+    """
+
+    def __init__(self, pixels, symbols, nsymbols=None, efixed=False):
+        self.pixels = pixels
+        self.symbols = symbols
+        self.nsymbols = nsymbols
+        self.efixed = efixed
+
+    @property
+    def size(self):
+        """Number of elements the pixels are written as"""
+        return len(self.pixels) * (5 if self.efixed else 3)
+
+    def elements(self, fmt):
+        """
+        Create the pixel components with a single parse
+        :param fmt: NumberFormatter of the coordinates and energies
+        """
+        # The template fills in the attributes in the same order
+        # le.SubElement would
+        columns = [_attribute_strings(self.pixels["name"])]
+        template = '<component type="pixel"><location name="%s"'
+        template += ''.join(' {}="%s"'.format(symbol) for symbol in self.symbols) + '>'
+        columns += [fmt.formatArray(self.pixels[symbol], _QUANTITIES[symbol])
+                    for symbol in self.symbols]
+        if self.nsymbols is not None:
+            template += '<neutronic' + ''.join(' {}="%s"'.format(symbol) for symbol in self.nsymbols) + '/>'
+            columns += [fmt.formatArray(self.pixels["n" + symbol], _QUANTITIES[symbol])
+                        for symbol in self.nsymbols]
+        else:
+            template += '<facing x="0.0" y="0.0" z="0.0"/>'
+        template += '</location>'
+        if self.efixed:
+            template += '<parameter name="EFixed"><value val="%s"/></parameter>'
+            columns.append(fmt.formatArray(self.pixels["energy"], "energy"))
+        template += '</component>'
+
+        pixels = ''.join(map(template.__mod__, zip(*columns)))
+        return list(le.fromstring('<type>' + pixels + '</type>'))
+
+
+class _IdBlock:
+    """
+    Detector IDs of an idlist kept as a structured array of ranges with the
+    fields start, end and step until they are written. A step of 0 writes no
+    step attribute. With single_as_val, ranges of a single ID are written as
+    val instead of start and end.
+    """
+
+    def __init__(self, ranges, single_as_val=False):
+        self.ranges = ranges
+        self.single_as_val = single_as_val
+
+    @property
+    def size(self):
+        """Number of elements the IDs are written as"""
+        return len(self.ranges)
+
+    @classmethod
+    def fromIdList(cls, idlist, single_as_val=False):
+        """
+        :param idlist: [start1, end1, step1, start2, end2, step2, ...] with
+         None for no step, as returned by makeIdRanges
+        """
+        ranges = np.zeros(len(idlist) // 3, dtype=[("start", np.int64),
+                                                   ("end", np.int64),
+                                                   ("step", np.int64)])
+        ranges["start"] = idlist[0::3]
+        ranges["end"] = idlist[1::3]
+        ranges["step"] = [0 if step is None else step for step in idlist[2::3]]
+        return cls(ranges, single_as_val)
+
+    def elements(self):
+        starts = _attribute_strings(self.ranges["start"])
+        ends = _attribute_strings(self.ranges["end"])
+        steps = _attribute_strings(self.ranges["step"])
+        single = (self.ranges["start"] == self.ranges["end"]) & self.single_as_val
+        ids = list()
+        for start, end, step, val, stepped in zip(starts, ends, steps, single.tolist(),
+                                                 (self.ranges["step"] != 0).tolist()):
+            if val:
+                ids.append('<id val="%s"/>' % start)
+            elif stepped:
+                ids.append('<id start="%s" step="%s" end="%s"/>' % (start, step, end))
+            else:
+                ids.append('<id start="%s" end="%s"/>' % (start, end))
+        return list(le.fromstring('<idlist>' + ''.join(ids) + '</idlist>'))
+
+
+class _Profiler:
+    """
+    Call count, wall time, number of elements created and bytes written for
+    every public method of a MantidGeom and every profiled section. Times and
+    elements include nested calls. Bytes are those of the top-level elements
+    a method created.
+    """
+
+    def __init__(self, output):
+        self.output = output  # True for a table, else a json filename
+        self.stats = dict()
+        self.owner = dict()  # top-level element -> method that created it
+
+    def entry(self, name):
+        return self.stats.setdefault(name, dict(calls=0, time=0., elements=0, bytes=0))
+
+    def record(self, name, seconds, elements):
+        entry = self.entry(name)
+        entry["calls"] += 1
+        entry["time"] += seconds
+        entry["elements"] += elements
+
+    def written(self, element, size, release=False):
+        owner = self.owner.pop(element, None) if release else self.owner.get(element)
+        self.entry("(other)" if owner is None else owner)["bytes"] += size
+
+    def framed(self, writer):
+        self.entry("(other)")["bytes"] += writer.frame_size
+
+    def report(self, instname):
+        if self.output is True:
+            print("{:<36}{:>8}{:>12}{:>12}{:>12}".format(
+                "profile of " + instname, "calls", "time [s]", "elements", "bytes"))
+            for name, entry in sorted(self.stats.items(),
+                                      key=lambda item: -item[1]["time"]):
+                print("{:<36}{calls:>8}{time:>12.4f}{elements:>12}{bytes:>12}".format(
+                    name, **entry))
+        else:
+            print(f'writing {self.output}')
+            with open(self.output, "w") as fh:
+                json.dump(dict(instrument=instname, methods=self.stats), fh, indent=2)
+
+
+class _StreamWriter:
+    """
+    Incremental writer for the top-level elements of an instrument. The
+    concatenated output is byte-for-byte what
+    le.tostring(root, pretty_print=True, xml_declaration=True) produces for
+    the whole document, but only one block of elements is serialized at a time.
+    """
+    _PLACEHOLDER = "placeholder"
+
+    def __init__(self, root, handle):
+        self._handle = handle
+        # empty copy of the root element that frames every block
+        self._shell = le.Element(root.tag, attrib=dict(root.attrib),
+                                 nsmap=root.nsmap)
+        self._shell.append(le.Comment(self._PLACEHOLDER))
+        head, tail = self._serialize().split(
+            ("  <!--%s-->\n" % self._PLACEHOLDER).encode("utf-8"))
+        del self._shell[:]
+        self._head_len = len(head)
+        self._tail = tail
+        self.frame_size = len(head) + len(tail)  # bytes outside the children
+        self._handle.write(head.decode("utf-8"))
+
+    def _serialize(self):
+        return le.tostring(self._shell, pretty_print=True,
+                           xml_declaration=True)
+
+    def write(self, elements):
+        """
+        Write the elements as children of the instrument. The elements are
+        moved out of their current parent and returned.
+        """
+        elements = list(elements)
+        if not elements:
+            return elements
+        self._shell.extend(elements)
+        text = self._serialize()[self._head_len:-len(self._tail)]
+        del self._shell[:]
+        self._handle.write(text.decode("utf-8"))
+        self.size = len(text)
+        return elements
+
+    def close(self):
+        self._handle.write(self._tail.decode("utf-8"))
+
 
 class MantidGeom:
 
-    def __init__(self, instname, comment=None, valid_from=None, valid_to=None):
+    def __init__(self, instname, comment=None, valid_from=None, valid_to=None,
+                 dedup_types=False, formatter=None, profile=None):
+        """
+        :param dedup_types: merge structurally identical types when the
+         geometry is written, see deduplicateTypes()
+        :param formatter: NumberFormatter for the coordinates, angles and
+         energies. The default keeps the format of every add* method
+        :param profile: record calls, time, elements and bytes per public
+         method and report them when the geometry is written. True prints a
+         table, a filename dumps json. If None, the MANTIDGEOM_PROFILE
+         environment variable is used: 1, true, yes or on for the table, 0,
+         false, no, off or empty for none, and a path for json if it ends
+         with .json or contains a separator
+        """
         from datetime import datetime
         if valid_to is None:
             valid_to = str(datetime(2100, 1, 31, 23, 59, 59))
@@ -28,6 +418,16 @@ class MantidGeom:
         if valid_from is None:
             valid_from = last_modified
         self.__instname = instname
+        self.__stream = None
+        self.__dedup_types = dedup_types
+        self.__fmt = NumberFormatter() if formatter is None else formatter
+        self.__pending = dict()  # element -> contents not created yet
+        self.__materialized = set()  # (tag, name) of the pending elements already created
+        if profile is None:
+            profile = _profileSetting(os.environ.get("MANTIDGEOM_PROFILE", ""))
+        self.__profiler = _Profiler(profile) if profile else None
+        self.__type_names = dict()  # canonical type -> name of the type kept
+        self.__written_refs = set()  # type names referenced in streamed output
         self.__root = le.Element("instrument",
                                  attrib={"name": instname,
                                     "valid-from": valid_from,
@@ -44,27 +444,255 @@ class MantidGeom:
             else:
                 self.__root.append(le.Comment(comment))
 
+        if self.__profiler is not None:
+            for name, function in inspect.getmembers(type(self), inspect.isfunction):
+                if name.startswith("_") or name in ("writeGeom", "streamGeom",
+                                                    "profileSection"):
+                    continue
+                setattr(self, name, self.__profiled(name, getattr(self, name)))
+
     def writeGeom(self, filename=None):
         """
         Write the XML geometry to the given filename
         If the filename isn't provided, it will be <instname>_Definition_<iso8601date>.xml
         """
+        if self.__stream is not None:
+            raise RuntimeError("Geometry is being streamed, the file is written when streamGeom() exits")
+        filename = self.__outputFilename(filename)
+        if self.__dedup_types:
+            self.deduplicateTypes()
+
+        print(f'writing {filename}')
+        with self.profileSection("writeGeom"), open(filename, "w") as fh:
+            writer = _StreamWriter(self.__root, fh)
+            # serialize one top-level block at a time and put it back
+            for child in list(self.__root):
+                block = self.__pending.get(child)
+                if block is not None:
+                    child.extend(self.__blockElements(block))
+                self.__root.extend(writer.write([child]))
+                if block is not None:
+                    del child[:]  # keep the compact form
+                if self.__profiler is not None:
+                    self.__profiler.written(child, writer.size)
+            writer.close()
+        if self.__profiler is not None:
+            self.__profiler.framed(writer)
+            self.__profiler.report(self.__instname)
+
+    @contextmanager
+    def streamGeom(self, filename=None):
+        """
+        Write the XML geometry incrementally to the given filename. Every call
+        to flush() inside the with-block writes out the top-level elements
+        created so far and releases them from memory. The remaining elements
+        are written when the block exits. The file is identical to the one
+        produced by writeGeom, and is only created if the block completes.
+
+        with instr.streamGeom(xml_outfile):
+            for bank in banks:
+                instr.addDetectorPixels(bank, ...)
+                instr.flush()
+        """
+        if self.__stream is not None:
+            raise RuntimeError("Geometry is already being streamed")
+        filename = self.__outputFilename(filename)
+
+        print(f'writing {filename}')
+        # write next to the file and rename it once complete, so an
+        # exception in the with-block does not leave a truncated file
+        temporary = "%s.%d.tmp" % (filename, os.getpid())
+        written = False
+        try:
+            with open(temporary, "w") as fh:
+                self.__stream = _StreamWriter(self.__root, fh)
+                yield self
+                self.flush()
+                self.__stream.close()
+                if self.__profiler is not None:
+                    self.__profiler.framed(self.__stream)
+            os.replace(temporary, filename)
+            written = True
+        finally:
+            self.__stream = None
+            if not written and os.path.exists(temporary):
+                os.remove(temporary)
+        if self.__profiler is not None:
+            self.__profiler.report(self.__instname)
+
+    def flush(self):
+        """
+        Write the top-level elements created so far to the file opened by
+        streamGeom. They are removed from the geometry, so elements returned by
+        earlier calls must not be modified afterwards.
+        """
+        if self.__stream is None:
+            raise RuntimeError("flush() can only be called inside streamGeom()")
+        self.__materialize()
+        if self.__dedup_types:
+            self.deduplicateTypes()
+            self.__written_refs.update(node.get("type")
+                                       for node in _typeReferences(self.__root))
+        if self.__profiler is None:
+            self.__stream.write(self.__root)
+            return
+        for child in list(self.__root):
+            self.__stream.write([child])
+            self.__profiler.written(child, self.__stream.size, release=True)
+
+    def deduplicateTypes(self):
+        """
+        Remove the types that are structurally identical to an earlier one,
+        i.e. equal apart from their name, and point their references to the
+        type that is kept. Components that took their name from the removed
+        type get it as an explicit name attribute. Types that only become
+        identical once their own references are merged are found as well.
+        Inside streamGeom, types already referenced in the written part of
+        the file are kept.
+        :return: dictionary of the removed type names to the ones kept
+        """
+        self.__materialize()
+        renamed = dict()
+        while True:
+            kept = dict(self.__type_names)
+            aliases = dict()
+            for element in list(self.__root.iterchildren("type")):
+                name = element.get("name")
+                first = kept.setdefault(_typeKey(element), name)
+                if first != name and name not in self.__written_refs:
+                    aliases[name] = first
+                    self.__root.remove(element)
+            if not aliases:
+                self.__type_names = kept
+                return renamed
+
+            for node in _typeReferences(self.__root):
+                old_name = node.get("type")
+                if old_name not in aliases:
+                    continue
+                node.set("type", aliases[old_name])
+                if node.tag == "component" and "name" not in node.attrib:
+                    locations = [child for child in node
+                                 if child.tag in ("location", "locations")]
+                    if not locations or any("name" not in location.attrib
+                                            for location in locations):
+                        node.set("name", old_name)
+            for old_name, new_name in renamed.items():
+                renamed[old_name] = aliases.get(new_name, new_name)
+            renamed.update(aliases)
+
+    def __countElements(self, element):
+        count = sum(1 for _ in element.iter(le.Element))
+        block = self.__pending.get(element)
+        return count if block is None else count + block.size
+
+    @contextmanager
+    def profileSection(self, name, *elements):
+        """
+        Record the time spent in a block of code, e.g. reading the survey in a
+        generator, and the elements it creates, in the profile of the
+        geometry. Does nothing if profiling is off.
+        :param elements: elements that are modified in the block besides
+         the top-level ones
+        """
+        if self.__profiler is None:
+            yield
+            return
+        before = sum(self.__countElements(element) for element in elements)
+        num_children = len(self.__root)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            created = sum(self.__countElements(element) for element in elements) - before
+            for child in self.__root[num_children:]:
+                created += self.__countElements(child)
+                self.__profiler.owner.setdefault(child, name)
+            self.__profiler.record(name, seconds, created)
+
+    def __profiled(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            elements = [arg for arg in list(args) + list(kwargs.values())
+                        if isinstance(arg, le._Element)]
+            with self.profileSection(name, *elements):
+                return method(*args, **kwargs)
+        return wrapper
+
+    def __blockElements(self, block):
+        if isinstance(block, _PixelBlock):
+            return block.elements(self.__fmt)
+        return block.elements()
+
+    def __materialize(self):
+        """
+        Create the xml elements of all the pixels and IDs held as arrays
+        """
+        for element, block in self.__pending.items():
+            element.extend(self.__blockElements(block))
+            self.__materialized.add((element.tag, element.get("name", element.get("idname"))))
+        self.__pending.clear()
+
+    def __findPending(self, tag, attribute, name):
+        for element, block in self.__pending.items():
+            if element.tag == tag and element.get(attribute) == name:
+                return block
+        if (tag, name) in self.__materialized:
+            raise RuntimeError("The arrays of {} '{}' are no longer kept, its xml elements were "
+                               "created when the geometry was flushed or root was accessed"
+                               .format(tag, name))
+        raise KeyError("No {} '{}' held as arrays".format(tag, name))
+
+    def getPixels(self, name):
+        """
+        Structured array of the pixels of a type added with addDetectorPixels,
+        with the fields described in addDetectorPixels. The array is the one
+        written out, so changing it changes the geometry. The arrays are only
+        kept until the xml elements are created, i.e. until the geometry is
+        flushed or root is accessed, after which RuntimeError is raised.
+        """
+        return self.__findPending("type", "name", name).pixels
+
+    def getIdRanges(self, idname):
+        """
+        Structured array of the detector ID ranges, fields start, end and
+        step, of an idlist held as arrays. See getPixels().
+        """
+        return self.__findPending("idlist", "idname", idname).ranges
+
+    def extractElements(self):
+        """
+        Remove the top-level elements created so far from the geometry and
+        return them serialized. addElements appends them to another geometry,
+        also in another process, so the parts that several definitions share
+        only need to be built once.
+        """
+        self.__materialize()
+        container = le.Element("elements")
+        container.extend(list(self.__root))
+        return le.tostring(container)
+
+    def addElements(self, elements):
+        """
+        Append the top-level elements returned by extractElements
+        """
+        self.__root.extend(list(le.fromstring(elements)))
+
+    def __outputFilename(self, filename):
+        """
+        If the filename isn't provided, it will be <instname>_Definition_<iso8601date>.xml
+        """
         if not filename:
             today = datetime.now().isoformat().split('T')[0]
             filename = '{}_Definition_{}.xml'.format(self.__instname, today)
-
-        print(f'writing {filename}')
-        fh = open(filename, "w")
-        to_write = le.tostring(self.__root, pretty_print=True, xml_declaration=True)
-        if sys.version_info.major > 2:
-            to_write = to_write.decode("utf-8")  # conversion from bytes to str
-        fh.write(to_write)
-        fh.close()
+        return filename
 
     def showGeom(self):
         """
         Print the XML geometry to the screeen
         """
+        self.__materialize()
         print(le.tostring(self.__root, pretty_print=True,
                              xml_declaration=True))
 
@@ -114,7 +742,7 @@ class MantidGeom:
           distance = float(distance)
           if distance > 0:
             distance *= -1.0
-          le.SubElement(source, "location", z=str(distance))
+          le.SubElement(source, "location", z=self.__fmt.length(distance))
         except:
           pos_loc = le.SubElement(source, "location")
           processed=split(str(distance))
@@ -139,7 +767,7 @@ class MantidGeom:
           distance = float(distance)
           if distance > 0:
             distance *= -1.0
-          le.SubElement(source, "location", z=str(distance))
+          le.SubElement(source, "location", z=self.__fmt.length(distance))
         except:
           pos_loc = le.SubElement(source, "location")
           processed=split(str(distance))
@@ -155,13 +783,13 @@ class MantidGeom:
                       **{"name":"moderator", "is":"Source"})
         cuboid = le.SubElement(type_element, "cuboid", id="shape")
         le.SubElement(cuboid, "left-front-bottom-point",
-                      x=str(-width/2), y=str(-height/2),z=str(-depth/2))
+                      x=self.__fmt.length(-width/2), y=self.__fmt.length(-height/2),z=self.__fmt.length(-depth/2))
         le.SubElement(cuboid, "left-front-top-point",
-                      x=str(-width/2), y=str(height/2),z=str(-depth/2))
+                      x=self.__fmt.length(-width/2), y=self.__fmt.length(height/2),z=self.__fmt.length(-depth/2))
         le.SubElement(cuboid, "left-back-bottom-point",
-                      x=str(-width/2), y=str(-height/2),z=str(depth/2))
+                      x=self.__fmt.length(-width/2), y=self.__fmt.length(-height/2),z=self.__fmt.length(depth/2))
         le.SubElement(cuboid, "right-front-bottom-point",
-                      x=str(width/2), y=str(-height/2),z=str(-depth/2))
+                      x=self.__fmt.length(width/2), y=self.__fmt.length(-height/2),z=self.__fmt.length(-depth/2))
         le.SubElement(type_element, "algebra", val="shape")
 
     def addSamplePosition(self, location=None, coord_type="cartesian"):
@@ -175,11 +803,11 @@ class MantidGeom:
             le.SubElement(source, "location", x="0.0", y="0.0", z="0.0")
         else:
             if coord_type == "cartesian":
-                le.SubElement(source, "location", x=str(location[0]),
-                              y=str(location[1]), z=str(location[2]))
+                le.SubElement(source, "location", x=self.__fmt.length(location[0]),
+                              y=self.__fmt.length(location[1]), z=self.__fmt.length(location[2]))
             elif coord_type == "spherical":
-                le.SubElement(source, "location", r=str(location[0]),
-                              t=str(location[1]), p=str(location[2]))
+                le.SubElement(source, "location", r=self.__fmt.length(location[0]),
+                              t=self.__fmt.angle(location[1]), p=self.__fmt.angle(location[2]))
 
         le.SubElement(self.__root, "type",
                       **{"name":"sample-position", "is":"SamplePos"})
@@ -206,48 +834,42 @@ class MantidGeom:
         :param nz: array of cartesian Z-coordinates in neutronic space
         :param names: list of pixel names
         :param energy: energies for each pixel
+        The pixels are kept as a structured array, see getPixels(), until
+        the geometry is written or root is accessed.
         """
         type_element = le.SubElement(self.__root, "type", name=name)
 
-        def triad_factory(symbols, components):
-            """
-            Generates lambda functions to produce **kwargs for le.SubElement
-            :param symbols: triad of argument keywords for le.SubElement
-            :param components: lists of neutronic positions
-            :return: lambda object
-            """
-            return lambda i, j: dict(zip(symbols,
-                                       [str(comp[i][j]) for comp in components]))
-
-        # Find polar or cartesian coordinates. Create dictionary with lambda
+        # Find polar or cartesian coordinates
         if r.any():
-            first_comp = r
-            triad = triad_factory(['r', 't', 'p'], [r, theta, phi])
+            symbols, components = ('r', 't', 'p'), (r, theta, phi)
         else:
-            first_comp = x
-            triad = triad_factory(['x', 'y', 'z'], [x, y, z])
+            symbols, components = ('x', 'y', 'z'), (x, y, z)
         # Same for neutronic positions
+        neutronic = nr.any() or nx.any()
         if nr.any():
-            first_ncomp = nr
-            ntriad = triad_factory(['r', 't', 'p'], [nr, ntheta, nphi])
+            nsymbols, ncomponents = ('r', 't', 'p'), (nr, ntheta, nphi)
         else:
-            first_ncomp = nx
-            ntriad = triad_factory(['x', 'y', 'z'], [nx, ny, nz])
-
-        # Create the pixels
-        for i in range(len(first_comp)):
-            for j in range(len(first_comp[i])):
-                if not(np.isnan(first_comp[i][j]) or np.isnan(first_ncomp[i][j])):
-                    basecomponent = le.SubElement(type_element, "component", type="pixel")
-                    location_element = le.SubElement(basecomponent, "location",
-                                                     name=str(names[i][j]), **triad(i,j))
-                    if nr.any() or nx.any():
-                        le.SubElement(location_element, "neutronic", **ntriad(i,j))
-                    else:
-                        le.SubElement(location_element, "facing", x="0.0", y="0.0", z="0.0")
-                    if output_efixed:
-                        efixed_comp = le.SubElement(basecomponent, "parameter", name="EFixed")
-                        le.SubElement(efixed_comp, "value", val=str(energy[i][j]))
+            nsymbols, ncomponents = ('x', 'y', 'z'), (nx, ny, nz)
+
+        # Skip the pixels with unphysical (nan) positions
+        valid = ~np.isnan(np.asarray(components[0], dtype=float))
+        if neutronic:
+            valid &= ~np.isnan(np.asarray(ncomponents[0], dtype=float))
+
+        # Keep the pixels as a structured array until they are written
+        fields = [("name", names)] + list(zip(symbols, components))
+        if neutronic:
+            fields += [("n" + symbol, comp) for symbol, comp in zip(nsymbols, ncomponents)]
+        if output_efixed:
+            fields.append(("energy", energy))
+        columns = [np.asarray(values)[valid] for _, values in fields]
+        pixels = np.empty(valid.sum(), dtype=[(field, column.dtype) for (field, _), column
+                                              in zip(fields, columns)])
+        for (field, _), column in zip(fields, columns):
+            pixels[field] = column
+        self.__pending[type_element] = _PixelBlock(pixels, symbols,
+                                                   nsymbols if neutronic else None,
+                                                   output_efixed)
 
     def addDetectorPixelsIdList(self, name, r=[], names=[], elg="single_list"):
         """
@@ -256,26 +878,29 @@ class MantidGeom:
         :param r: (list of list) distances from sample
         :param names: (list of list) pixel ID's
         :param elg: element grouping, 'single_list' creates one element per pixel,
-         'multiple_ranges' creates one element for every range of physical pixels
+         'multiple_ranges' creates one element for every range of physical pixels,
+         'compact' also collapses strided ranges and writes single pixels as val
         """
         if elg=="single_list":
             component = le.SubElement(self.__root, "idlist",
                                       idname=name)
-            for i in range(len(r)):
-                for j in range(len(r[i])):
-                    # nan indicates unphysical pixel
-                    if (str(r[i][j]) != "nan"):
-                        le.SubElement(component, "id", val=str(names[i][j]))
+            # nan indicates unphysical pixel
+            pxids = np.asarray(names)[~np.isnan(np.asarray(r, dtype=float))]
+            ranges = np.zeros(len(pxids), dtype=[("start", pxids.dtype),
+                                                 ("end", pxids.dtype),
+                                                 ("step", np.int64)])
+            ranges["start"] = ranges["end"] = pxids
+            self.__pending[component] = _IdBlock(ranges, single_as_val=True)
         elif elg=="multiple_ranges":
             # find ID's of pixels with physical distances
             pxids = names.flatten()[np.where(~np.isnan(r.flatten()))[0]]
-            # Split pxids into continous chunks of pixel ID's
-            idlist = list()
-            for k, g in groupby(enumerate(pxids), key=lambda p: p[0] - p[1]):
-                chunk = list(map(itemgetter(1), g))
-                idlist += [chunk[0], chunk[-1], None]
             # Create one element for every continous chunks
-            self.addDetectorIds(name, idlist)
+            component = le.SubElement(self.__root, "idlist", idname=name)
+            self.__pending[component] = _IdBlock.fromIdList(
+                makeIdRanges(pxids, strided=False))
+        elif elg=="compact":
+            pxids = names.flatten()[np.where(~np.isnan(r.flatten()))[0]]
+            self.addDetectorIdRanges(name, pxids)
         else:
             raise NotImplementedError("invalid element grouping scheme")
 
@@ -297,7 +922,7 @@ class MantidGeom:
         for i in range(len(distance)):
             try:
                 zi=float(distance[i]) # check if float
-                zi=str(zi) # convert it to a string for lxml
+                zi=self.__fmt.length(zi) # convert it to a string for lxml
                 location = le.SubElement(basecomponent, "location", z=zi, name=names[i])
                 if neutronic:
                     le.SubElement(location, "neutronic", z=zi)
@@ -428,8 +1053,10 @@ class MantidGeom:
         Add a rectangular detector in a type element for the XML definition.
         """
         type_element = le.SubElement(self.__root, "type",
-                                     xstart=str(xstart), xstep=str(xstep), xpixels=str(xpixels),
-                                     ystart=str(ystart), ystep=str(ystep), ypixels=str(ypixels),
+                                     xstart=self.__fmt.length(xstart), xstep=self.__fmt.length(xstep),
+                                     xpixels=str(xpixels),
+                                     ystart=self.__fmt.length(ystart), ystep=self.__fmt.length(ystep),
+                                     ypixels=str(ypixels),
                                      **{"name": name, "is": "rectangular_detector", "type": type})
 
     def addSingleDetector(self, root, x, y, z, rot_x, rot_y, rot_z, name=None,
@@ -451,25 +1078,26 @@ class MantidGeom:
         """
         Add a location element to a specific parent node given by root.
         """
+        length = self.__fmt.length
         if name is not None:
-            pos_loc = le.SubElement(root, "location", x=str(x), y=str(y), z=str(z), name=name)
+            pos_loc = le.SubElement(root, "location", x=length(x), y=length(y), z=length(z), name=name)
         else:
-            pos_loc = le.SubElement(root, "location", x=str(x), y=str(y), z=str(z))
+            pos_loc = le.SubElement(root, "location", x=length(x), y=length(y), z=length(z))
 
         if rot_y is not None:
-            r1 = le.SubElement(pos_loc, "rot", **{"val":str(rot_y), "axis-x":"0",
+            r1 = le.SubElement(pos_loc, "rot", **{"val":self.__fmt.angle(rot_y), "axis-x":"0",
                                                   "axis-y":"1", "axis-z":"0"})
         else:
             r1 = pos_loc
 
         if rot_x is not None:
-            r2 = le.SubElement(r1, "rot", **{"val":str(rot_x), "axis-x":"1",
+            r2 = le.SubElement(r1, "rot", **{"val":self.__fmt.angle(rot_x), "axis-x":"1",
                                              "axis-y":"0", "axis-z":"0"})
         else:
             r2 = r1
 
         if rot_z is not None:
-            r3 = le.SubElement(r2, "rot", **{"val":str(rot_z), "axis-x":"0",
+            r3 = le.SubElement(r2, "rot", **{"val":self.__fmt.angle(rot_z), "axis-x":"0",
                                              "axis-y":"0", "axis-z":"1"})
         else:
             r3 = r2
@@ -478,7 +1106,7 @@ class MantidGeom:
             le.SubElement(pos_loc, "facing", x="0.0", y="0.0", z="0.0")
 
         if neutronic:
-            le.SubElement(pos_loc, "neutronic", x=str(nx), y=str(ny), z=str(nz))
+            le.SubElement(pos_loc, "neutronic", x=length(nx), y=length(ny), z=length(nz))
 
         return r3
 
@@ -596,10 +1224,10 @@ class MantidGeom:
         for i in range(num_tubes):
             tube_name = "tube%d" % (i + 1)
             x = pack_start + (i * effective_tube_width)
-            location_element = le.SubElement(component, "location", name=tube_name, x='{:.5f}'.format(x))
+            location_element = le.SubElement(component, "location", name=tube_name, x=self.__fmt.length(x, 5))
             if (neutronic):
                 if (neutronicIsPhysical):
-                    le.SubElement(location_element, "neutronic", x='{:.5f}'.format(x))
+                    le.SubElement(location_element, "neutronic", x=self.__fmt.length(x, 5))
                 else:
                     le.SubElement(location_element, "neutronic", x="0.0")
 
@@ -636,7 +1264,7 @@ class MantidGeom:
             z = pack_start_z + separation * i
             x = pack_start_x + slip * i
             le.SubElement(component, 'location', name=pack_name,
-                          x=str(x), z=str(z))
+                          x=self.__fmt.length(x), z=self.__fmt.length(z))
         if neutronic is True:
             raise NotImplementedError('Not implemented for neutronic'
                                       'posisitons')
@@ -680,10 +1308,10 @@ class MantidGeom:
         component = le.SubElement(type_assembly, 'component', type=sub_type)
         theta_angles = dtheta * (0.5 + np.arange(num_sub)) - \
                        num_sub * dtheta / 2 + theta_0
-        rot = [f'{v:.4f}' for v in theta_angles]
+        rot = self.__fmt.formatArray(theta_angles, "angle", 4)
         rot_axis = {'axis-x': '0', 'axis-y': '1', 'axis-z': '0'}
         for i in range(num_sub):
-            kwargs = dict(name=f'{sub_name}{first_index+i}', r=str(radius),
+            kwargs = dict(name=f'{sub_name}{first_index+i}', r=self.__fmt.length(radius),
                           t=rot[i], rot=rot[i])
             kwargs.update(rot_axis)
             le.SubElement(component, 'location', **kwargs)
@@ -709,7 +1337,9 @@ class MantidGeom:
             x = pack_start + (i * effective_tube_width) # Mantid
             #x = -(pack_start + (i * effective_tube_width)) # Flipped
             angle = x/radius/2
-            location_element = le.SubElement(component, "location", name=tube_name, x=str(-x*np.cos(angle)), z=str(-x*np.sin(angle)))
+            location_element = le.SubElement(component, "location", name=tube_name,
+                                             x=self.__fmt.length(-x*np.cos(angle)),
+                                             z=self.__fmt.length(-x*np.sin(angle)))
 
     def addPixelatedTube(self, name, num_pixels, tube_height,
                          type_name="pixel", neutronic=False, neutronicIsPhysical=False):
@@ -734,10 +1364,10 @@ class MantidGeom:
         for i in range(num_pixels):
             pixel_name = "pixel%d" % (i + 1)
             y = tube_start + (i * pixel_width)
-            location_element = le.SubElement(component, "location", name=pixel_name, y='{:.5f}'.format(y))
+            location_element = le.SubElement(component, "location", name=pixel_name, y=self.__fmt.length(y, 5))
             if (neutronic):
                 if (neutronicIsPhysical):
-                    le.SubElement(location_element, "neutronic", y=str(y))
+                    le.SubElement(location_element, "neutronic", y=self.__fmt.length(y))
                 else:
                     le.SubElement(location_element, "neutronic", y="0.0")
 
@@ -751,13 +1381,13 @@ class MantidGeom:
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id=algebra)
         le.SubElement(cylinder, "centre-of-bottom-base",
-                      r=str(center_bottom_base[0]),
-                      t=str(center_bottom_base[1]),
-                      p=str(center_bottom_base[2]))
-        le.SubElement(cylinder, "axis", x='{:.5f}'.format(axis[0]), y='{:.5f}'.format(axis[1]),
-                      z='{:.5f}'.format(axis[2]))
-        le.SubElement(cylinder, "radius", val='{:.5f}'.format(pixel_radius))
-        le.SubElement(cylinder, "height", val='{:.5f}'.format(pixel_height))
+                      r=self.__fmt.length(center_bottom_base[0]),
+                      t=self.__fmt.angle(center_bottom_base[1]),
+                      p=self.__fmt.angle(center_bottom_base[2]))
+        le.SubElement(cylinder, "axis", x=self.__fmt.length(axis[0], 5),
+                      y=self.__fmt.length(axis[1], 5), z=self.__fmt.length(axis[2], 5))
+        le.SubElement(cylinder, "radius", val=self.__fmt.length(pixel_radius, 5))
+        le.SubElement(cylinder, "height", val=self.__fmt.length(pixel_height, 5))
         le.SubElement(type_element, "algebra", val=algebra)
 
         return
@@ -771,12 +1401,14 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id=algebra)
-        center_bottom_base = {k:str(v) for k, v in center_bottom_base.items()}
-        axis = {k:str(v) for k, v in axis.items()}
+        center_bottom_base = {k:self.__fmt.format(v, "angle" if k in ("t", "p") else "length")
+                              for k, v in center_bottom_base.items()}
+        axis = {k:self.__fmt.format(v, "angle" if k in ("t", "p") else "length")
+                for k, v in axis.items()}
         le.SubElement(cylinder, "centre-of-bottom-base", **center_bottom_base)
         le.SubElement(cylinder, "axis", **axis)
-        le.SubElement(cylinder, "radius", val=str(pixel_radius))
-        le.SubElement(cylinder, "height", val=str(pixel_height))
+        le.SubElement(cylinder, "radius", val=self.__fmt.length(pixel_radius))
+        le.SubElement(cylinder, "height", val=self.__fmt.length(pixel_height))
         le.SubElement(type_element, "algebra", val=algebra)
 
         return
@@ -792,14 +1424,14 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cuboid = le.SubElement(type_element, "cuboid", id=shape_id)
-        le.SubElement(cuboid, "left-front-bottom-point", x=str(lfb_pt[0]),
-                      y=str(lfb_pt[1]), z=str(lfb_pt[2]))
-        le.SubElement(cuboid, "left-front-top-point", x=str(lft_pt[0]),
-                      y=str(lft_pt[1]), z=str(lft_pt[2]))
-        le.SubElement(cuboid, "left-back-bottom-point", x=str(lbb_pt[0]),
-                      y=str(lbb_pt[1]), z=str(lbb_pt[2]))
-        le.SubElement(cuboid, "right-front-bottom-point", x=str(rfb_pt[0]),
-                      y=str(rfb_pt[1]), z=str(rfb_pt[2]))
+        le.SubElement(cuboid, "left-front-bottom-point", x=self.__fmt.length(lfb_pt[0]),
+                      y=self.__fmt.length(lfb_pt[1]), z=self.__fmt.length(lfb_pt[2]))
+        le.SubElement(cuboid, "left-front-top-point", x=self.__fmt.length(lft_pt[0]),
+                      y=self.__fmt.length(lft_pt[1]), z=self.__fmt.length(lft_pt[2]))
+        le.SubElement(cuboid, "left-back-bottom-point", x=self.__fmt.length(lbb_pt[0]),
+                      y=self.__fmt.length(lbb_pt[1]), z=self.__fmt.length(lbb_pt[2]))
+        le.SubElement(cuboid, "right-front-bottom-point", x=self.__fmt.length(rfb_pt[0]),
+                      y=self.__fmt.length(rfb_pt[1]), z=self.__fmt.length(rfb_pt[2]))
         le.SubElement(type_element, "algebra", val=shape_id)
 
     def addDummyMonitor(self, radius, height):
@@ -812,8 +1444,8 @@ class MantidGeom:
         le.SubElement(cylinder, "centre-of-bottom-base", p="0.0", r="0.0",
                       t="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder, "radius", val=str(radius))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.__fmt.length(radius))
+        le.SubElement(cylinder, "height", val=self.__fmt.length(height))
 
         le.SubElement(type_element, "algebra", val="cyl-approx")
 
@@ -821,13 +1453,14 @@ class MantidGeom:
         """
         Add a cuboid monitor
         """
+        length = self.__fmt.length
         type_element = le.SubElement(self.__root, "type", **{"name":"monitor",
                                                              "is":"monitor"})
         cuboid = le.SubElement(type_element, "cuboid", id="shape")
-        le.SubElement(cuboid, "left-front-bottom-point", x=str(-width/2), y=str(-height/2),z=str(-depth/2))
-        le.SubElement(cuboid, "left-front-top-point", x=str(-width/2), y=str(height/2),z=str(-depth/2))
-        le.SubElement(cuboid, "left-back-bottom-point", x=str(-width/2), y=str(-height/2),z=str(depth/2))
-        le.SubElement(cuboid, "right-front-bottom-point", x=str(width/2), y=str(-height/2),z=str(-depth/2))
+        le.SubElement(cuboid, "left-front-bottom-point", x=length(-width/2), y=length(-height/2),z=length(-depth/2))
+        le.SubElement(cuboid, "left-front-top-point", x=length(-width/2), y=length(height/2),z=length(-depth/2))
+        le.SubElement(cuboid, "left-back-bottom-point", x=length(-width/2), y=length(-height/2),z=length(depth/2))
+        le.SubElement(cuboid, "right-front-bottom-point", x=length(width/2), y=length(-height/2),z=length(-depth/2))
         le.SubElement(type_element, "algebra", val="shape")
 
     def addDetectorIds(self, idname, idlist):
@@ -851,6 +1484,16 @@ class MantidGeom:
                               step=str(idlist[(i*3)+2]),
                               end=str(idlist[(i*3)+1]))
 
+    def addDetectorIdRanges(self, idname, ids, strided=True):
+        """
+        Add the detector IDs from an arbitrary list of IDs. Runs of IDs with a
+        constant step are collapsed into start/end/step elements, single IDs
+        are written as val.
+        """
+        id_element = le.SubElement(self.__root, "idlist", idname=idname)
+        self.__pending[id_element] = _IdBlock.fromIdList(
+            makeIdRanges(ids, strided=strided), single_as_val=True)
+
     def addMonitorIds(self, ids=[]):
         """
         Add the monitor IDs.
@@ -897,7 +1540,7 @@ class MantidGeom:
         """
         component = le.SubElement(self.__root, "component", type = component_name)
         distance = float(distance)
-        le.SubElement(component, "location", z=str(distance))
+        le.SubElement(component, "location", z=self.__fmt.length(distance))
         for arg in args:
             log = le.SubElement(component, "parameter", name=arg[0])
             if len(arg) == 2:
@@ -913,7 +1556,7 @@ class MantidGeom:
         """
         component = le.SubElement(self.__root, "component", type = component_name)
         distance = float(distance)
-        le.SubElement(component, "location", z=str(distance))
+        le.SubElement(component, "location", z=self.__fmt.length(distance))
         le.SubElement(self.__root, "type",
                       **{"name":component_name, "is":is_type})
 
@@ -927,20 +1570,20 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id="body")
-        le.SubElement(cylinder, "centre-of-bottom-base",x=str(center[0]),
-                      y=str(center[1]),z="0.0")
+        le.SubElement(cylinder, "centre-of-bottom-base",x=self.__fmt.length(center[0]),
+                      y=self.__fmt.length(center[1]),z="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder, "radius", val=str(radius))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.__fmt.length(radius))
+        le.SubElement(cylinder, "height", val=self.__fmt.length(height))
         cuboid = le.SubElement(type_element, "cuboid", id="hole")
         le.SubElement(cuboid, "left-front-bottom-point",
-                      x=str(hole[0]),y=str(-hole[1]),z="0.0")
+                      x=self.__fmt.length(hole[0]),y=self.__fmt.length(-hole[1]),z="0.0")
         le.SubElement(cuboid, "left-front-top-point",
-                      x=str(hole[0]),y=str(-hole[1]),z=str(height))
+                      x=self.__fmt.length(hole[0]),y=self.__fmt.length(-hole[1]),z=self.__fmt.length(height))
         le.SubElement(cuboid, "left-back-bottom-point",
-                      x=str(-hole[0]),y=str(-hole[1]),z="0.0")
+                      x=self.__fmt.length(-hole[0]),y=self.__fmt.length(-hole[1]),z="0.0")
         le.SubElement(cuboid, "right-front-bottom-point",
-                      x=str(hole[0]),y=str(hole[1]),z="0.0")
+                      x=self.__fmt.length(hole[0]),y=self.__fmt.length(hole[1]),z="0.0")
         le.SubElement(type_element, "algebra", val="body (# hole)")
 
 
@@ -951,49 +1594,51 @@ class MantidGeom:
         Add a double disk chopper. The chopper center and hole dimensions
         is x, y relative to beam center.
         """
+        length = self.__fmt.length
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder1 = le.SubElement(type_element, "cylinder", id="body1")
-        le.SubElement(cylinder1, "centre-of-bottom-base",x=str(center[0]),
-                      y=str(center[1]),z="0.0")
+        le.SubElement(cylinder1, "centre-of-bottom-base",x=length(center[0]),
+                      y=length(center[1]),z="0.0")
         le.SubElement(cylinder1, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder1, "radius", val=str(radius))
-        le.SubElement(cylinder1, "height", val=str(height))
+        le.SubElement(cylinder1, "radius", val=length(radius))
+        le.SubElement(cylinder1, "height", val=length(height))
         cuboid = le.SubElement(type_element, "cuboid", id="hole")
         le.SubElement(cuboid, "left-front-bottom-point",
-                      x=str(hole[0]),y=str(-hole[1]),z="0.0")
+                      x=length(hole[0]),y=length(-hole[1]),z="0.0")
         le.SubElement(cuboid, "left-front-top-point",
-                      x=str(hole[0]),y=str(-hole[1]),z=str(height*2+separation))
+                      x=length(hole[0]),y=length(-hole[1]),z=length(height*2+separation))
         le.SubElement(cuboid, "left-back-bottom-point",
-                      x=str(-hole[0]),y=str(-hole[1]),z="0.0")
+                      x=length(-hole[0]),y=length(-hole[1]),z="0.0")
         le.SubElement(cuboid, "right-front-bottom-point",
-                      x=str(hole[0]),y=str(hole[1]),z="0.0")
+                      x=length(hole[0]),y=length(hole[1]),z="0.0")
         cylinder2 = le.SubElement(type_element, "cylinder", id="body2")
-        le.SubElement(cylinder2, "centre-of-bottom-base",x=str(-center[0]),
-                      y=str(-center[1]),z=str(height+separation))
+        le.SubElement(cylinder2, "centre-of-bottom-base",x=length(-center[0]),
+                      y=length(-center[1]),z=length(height+separation))
         le.SubElement(cylinder2, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder2, "radius", val=str(radius))
-        le.SubElement(cylinder2, "height", val=str(height))
+        le.SubElement(cylinder2, "radius", val=length(radius))
+        le.SubElement(cylinder2, "height", val=length(height))
         le.SubElement(type_element, "algebra", val="(body1 : body2) (#hole)")
 
     def addFermiChopper(self, name, radius=0.05, height=0.065,width=0.061,is_type="chopper"):
         """
          Add a Fermi chopper
         """
+        length = self.__fmt.length
         y0=-height/2.0
         x0=-width/2.0
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id="body")
-        le.SubElement(cylinder, "centre-of-bottom-base",x="0.0",y=str(y0),z="0.0")
+        le.SubElement(cylinder, "centre-of-bottom-base",x="0.0",y=length(y0),z="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="1.0", z="0.0")
-        le.SubElement(cylinder, "radius", val=str(radius))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=length(radius))
+        le.SubElement(cylinder, "height", val=length(height))
         cuboid = le.SubElement(type_element, "cuboid", id="hole")
-        le.SubElement(cuboid, "left-front-bottom-point", x=str(x0),y=str(y0),z=str(-radius))
-        le.SubElement(cuboid, "left-front-top-point", x=str(x0),y=str(-y0),z=str(-radius))
-        le.SubElement(cuboid, "left-back-bottom-point", x=str(-x0),y=str(y0),z=str(-radius))
-        le.SubElement(cuboid, "right-front-bottom-point",x=str(x0),y=str(y0),z=str(radius))
+        le.SubElement(cuboid, "left-front-bottom-point", x=length(x0),y=length(y0),z=length(-radius))
+        le.SubElement(cuboid, "left-front-top-point", x=length(x0),y=length(-y0),z=length(-radius))
+        le.SubElement(cuboid, "left-back-bottom-point", x=length(-x0),y=length(y0),z=length(-radius))
+        le.SubElement(cuboid, "right-front-bottom-point",x=length(x0),y=length(y0),z=length(radius))
         le.SubElement(type_element, "algebra", val="body (# hole)")
 
     def addVerticalAxisT0Chopper(self, name, radius=0.175, height=0.090,width_out=0.095,width_in=0.085,is_type="chopper"):
@@ -1007,44 +1652,44 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id="body")
-        le.SubElement(cylinder, "centre-of-bottom-base",x="0.0",y=str(y0),z="0.0")
+        le.SubElement(cylinder, "centre-of-bottom-base",x="0.0",y=self.__fmt.length(y0),z="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="1.0", z="0.0")
-        le.SubElement(cylinder, "radius", val=str(radius))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.__fmt.length(radius))
+        le.SubElement(cylinder, "height", val=self.__fmt.length(height))
         hex_1 = le.SubElement(type_element, "hexahedron", id="hole1")
         le.SubElement(hex_1, "left-front-bottom-point",
-                      x=str(x0_o),y=str(y0),z=str(-radius))
+                      x=self.__fmt.length(x0_o),y=self.__fmt.length(y0),z=self.__fmt.length(-radius))
         le.SubElement(hex_1, "left-front-top-point",
-                     x=str(x0_o),y=str(-y0),z=str(-radius))
+                     x=self.__fmt.length(x0_o),y=self.__fmt.length(-y0),z=self.__fmt.length(-radius))
         le.SubElement(hex_1, "left-back-bottom-point",
-                      x=str(-x0_o),y=str(y0),z=str(-radius))
+                      x=self.__fmt.length(-x0_o),y=self.__fmt.length(y0),z=self.__fmt.length(-radius))
         le.SubElement(hex_1, "left-back-top-point",
-                      x=str(-x0_o),y=str(-y0),z=str(-radius))
+                      x=self.__fmt.length(-x0_o),y=self.__fmt.length(-y0),z=self.__fmt.length(-radius))
         le.SubElement(hex_1, "right-front-bottom-point",
-                      x=str(x0_i),y=str(y0),z=str(0))
+                      x=self.__fmt.length(x0_i),y=self.__fmt.length(y0),z=self.__fmt.length(0))
         le.SubElement(hex_1, "right-front-top-point",
-                      x=str(x0_i),y=str(-y0),z=str(0))
+                      x=self.__fmt.length(x0_i),y=self.__fmt.length(-y0),z=self.__fmt.length(0))
         le.SubElement(hex_1, "right-back-bottom-point",
-                      x=str(-x0_i),y=str(y0),z=str(0))
+                      x=self.__fmt.length(-x0_i),y=self.__fmt.length(y0),z=self.__fmt.length(0))
         le.SubElement(hex_1, "right-back-top-point",
-                      x=str(-x0_i),y=str(-y0),z=str(0))
+                      x=self.__fmt.length(-x0_i),y=self.__fmt.length(-y0),z=self.__fmt.length(0))
         hex_2 = le.SubElement(type_element, "hexahedron", id="hole2")
         le.SubElement(hex_2, "right-front-bottom-point",
-                     x=str(x0_o),y=str(y0),z=str(radius))
+                     x=self.__fmt.length(x0_o),y=self.__fmt.length(y0),z=self.__fmt.length(radius))
         le.SubElement(hex_2, "right-front-top-point",
-                      x=str(x0_o),y=str(-y0),z=str(radius))
+                      x=self.__fmt.length(x0_o),y=self.__fmt.length(-y0),z=self.__fmt.length(radius))
         le.SubElement(hex_2, "right-back-bottom-point",
-                      x=str(-x0_o),y=str(y0),z=str(radius))
+                      x=self.__fmt.length(-x0_o),y=self.__fmt.length(y0),z=self.__fmt.length(radius))
         le.SubElement(hex_2, "right-back-top-point",
-                      x=str(-x0_o),y=str(-y0),z=str(radius))
+                      x=self.__fmt.length(-x0_o),y=self.__fmt.length(-y0),z=self.__fmt.length(radius))
         le.SubElement(hex_2, "left-front-bottom-point",
-                      x=str(x0_i),y=str(y0),z=str(0))
+                      x=self.__fmt.length(x0_i),y=self.__fmt.length(y0),z=self.__fmt.length(0))
         le.SubElement(hex_2, "left-front-top-point",
-                      x=str(x0_i),y=str(-y0),z=str(0))
+                      x=self.__fmt.length(x0_i),y=self.__fmt.length(-y0),z=self.__fmt.length(0))
         le.SubElement(hex_2, "left-back-bottom-point",
-                      x=str(-x0_i),y=str(y0),z=str(0))
+                      x=self.__fmt.length(-x0_i),y=self.__fmt.length(y0),z=self.__fmt.length(0))
         le.SubElement(hex_2, "left-back-top-point",
-                      x=str(-x0_i),y=str(-y0),z=str(0))
+                      x=self.__fmt.length(-x0_i),y=self.__fmt.length(-y0),z=self.__fmt.length(0))
         le.SubElement(type_element, "algebra", val="body (# (hole1 : hole2))")
 
     def addCorrelationChopper(self, name, center=(-0.28, 0.0),
@@ -1058,11 +1703,11 @@ class MantidGeom:
         type_element = le.SubElement(self.__root, "type",
                                      **{"name":name, "is":is_type})
         cylinder = le.SubElement(type_element, "cylinder", id="body")
-        le.SubElement(cylinder, "centre-of-bottom-base",x=str(center[0]),
-                      y=str(center[1]),z="0.0")
+        le.SubElement(cylinder, "centre-of-bottom-base",x=self.__fmt.length(center[0]),
+                      y=self.__fmt.length(center[1]),z="0.0")
         le.SubElement(cylinder, "axis", x="0.0", y="0.0", z="1.0")
-        le.SubElement(cylinder, "radius", val=str(radius*0.85))
-        le.SubElement(cylinder, "height", val=str(height))
+        le.SubElement(cylinder, "radius", val=self.__fmt.length(radius*0.85))
+        le.SubElement(cylinder, "height", val=self.__fmt.length(height))
         sequence=map(float,sequence.split())
         n=len(sequence)
         s=sum(sequence)
@@ -1078,42 +1723,52 @@ class MantidGeom:
             yy1=math.cos(angle_start)*radius
             yy2=math.cos(angle_end)*radius
             le.SubElement(hexahedrons[i], "left-back-bottom-point",
-                          x=str(xx1+center[0]),
-                          y=str(yy1+center[1]),
+                          x=self.__fmt.length(xx1+center[0]),
+                          y=self.__fmt.length(yy1+center[1]),
                           z="0.0")
             le.SubElement(hexahedrons[i], "left-front-bottom-point",
-                          x=str(xx1+center[0]),
-                          y=str(yy1+center[1]),
-                          z=str(height))
+                          x=self.__fmt.length(xx1+center[0]),
+                          y=self.__fmt.length(yy1+center[1]),
+                          z=self.__fmt.length(height))
             le.SubElement(hexahedrons[i], "right-front-bottom-point",
-                          x=str(xx2+center[0]),
-                          y=str(yy2+center[1]),
-                          z=str(height))
+                          x=self.__fmt.length(xx2+center[0]),
+                          y=self.__fmt.length(yy2+center[1]),
+                          z=self.__fmt.length(height))
             le.SubElement(hexahedrons[i], "right-back-bottom-point",
-                          x=str(xx2+center[0]),
-                          y=str(yy2+center[1]),
+                          x=self.__fmt.length(xx2+center[0]),
+                          y=self.__fmt.length(yy2+center[1]),
                           z="0.0")
             le.SubElement(hexahedrons[i], "left-back-top-point",
-                          x=str(xx1*0.8+center[0]),
-                          y=str(yy1*0.8+center[1]),
+                          x=self.__fmt.length(xx1*0.8+center[0]),
+                          y=self.__fmt.length(yy1*0.8+center[1]),
                           z="0.0")
             le.SubElement(hexahedrons[i], "left-front-top-point",
-                          x=str(xx1*0.8+center[0]),
-                          y=str(yy1*0.8+center[1]),
-                          z=str(height))
+                          x=self.__fmt.length(xx1*0.8+center[0]),
+                          y=self.__fmt.length(yy1*0.8+center[1]),
+                          z=self.__fmt.length(height))
             le.SubElement(hexahedrons[i], "right-front-top-point",
-                          x=str(xx2*0.8+center[0]),
-                          y=str(yy2*0.8+center[1]),
-                          z=str(height))
+                          x=self.__fmt.length(xx2*0.8+center[0]),
+                          y=self.__fmt.length(yy2*0.8+center[1]),
+                          z=self.__fmt.length(height))
             le.SubElement(hexahedrons[i], "right-back-top-point",
-                          x=str(xx2*0.8+center[0]),
-                          y=str(yy2*0.8+center[1]),
+                          x=self.__fmt.length(xx2*0.8+center[0]),
+                          y=self.__fmt.length(yy2*0.8+center[1]),
                           z="0.0")
         le.SubElement(type_element, "algebra", val="body : "+hole_list[:-3])
 
     def getRoot(self):
+        self.__materialize()
         return self.__root
 
     @property
     def root(self):
+        """
+        The instrument element. The pixels and IDs held as arrays are turned
+        into xml elements first, so the whole tree can be inspected or edited.
+        """
+        self.__materialize()
         return self.__root
+
+    @property
+    def formatter(self):
+        return self.__fmt
@@ -0,0 +1,343 @@
+#!/bin/env python
+from helper import MantidGeom, NumberFormatter, _profileSetting, generateVariants, makeIdRanges
+from contextlib import redirect_stdout
+from lxml import etree as le
+import io
+import json
+import os
+from testutils import TempDirTestCase
+import unittest
+import numpy as np
+
+
+def makeGeom():
+    instr = MantidGeom("TEST", comment=["first", "second"],
+                       valid_from="2020-01-01 00:00:00")
+    instr.addSnsDefaults()
+    instr.addComment("SOURCE AND SAMPLE POSITION")
+    instr.addModerator(-10.)
+    instr.addSamplePosition()
+    instr.addMonitors(distance=[-1.5], names=["monitor1"])
+    instr.addComment("multi\nline comment")
+    instr.addPixelatedTube("tube", 8, 1.)
+    instr.addDetectorIds("bank1", [0, 7, None])
+    instr.addMonitorIds([-1])
+    return instr
+
+
+def writeVariant(filename, shared, pixels):
+    instr = MantidGeom("TEST", comment=["first", "second"],
+                       valid_from="2020-01-01 00:00:00")
+    instr.addElements(shared)
+    instr.addDetectorIds("bank1", [0, pixels - 1, None])
+    instr.writeGeom(filename)
+    return pixels
+
+
+class TestWriteGeom(TempDirTestCase):
+    def read(self, filename):
+        with open(self.path(filename)) as handle:
+            return handle.read()
+
+    def testWriteGeom(self):
+        instr = makeGeom()
+        expected = le.tostring(instr.root, pretty_print=True,
+                               xml_declaration=True).decode("utf-8")
+        instr.writeGeom(self.path("write.xml"))
+        self.assertEqual(self.read("write.xml"), expected)
+        # writing leaves the geometry untouched
+        instr.writeGeom(self.path("again.xml"))
+        self.assertEqual(self.read("again.xml"), expected)
+
+    def testStreamGeom(self):
+        instr = makeGeom()
+        instr.writeGeom(self.path("write.xml"))
+
+        with instr.streamGeom(self.path("stream.xml")):
+            instr.flush()
+            self.assertEqual(len(instr.root), 0)
+            instr.addComment("after flush")
+            instr.addPixelatedTube("tube2", 4, .5)
+        self.assertEqual(len(instr.root), 0)
+
+        reference = makeGeom()
+        reference.root.attrib.update(instr.root.attrib)  # same last-modified
+        reference.addComment("after flush")
+        reference.addPixelatedTube("tube2", 4, .5)
+        expected = le.tostring(reference.root, pretty_print=True,
+                               xml_declaration=True).decode("utf-8")
+        self.assertEqual(self.read("stream.xml"), expected)
+
+    def testStreamGeomError(self):
+        instr = makeGeom()
+        with self.assertRaises(ValueError):
+            with instr.streamGeom(self.path("stream.xml")):
+                instr.flush()
+                raise ValueError("bank failed")
+        self.assertEqual(os.listdir(self.direc), [])
+        # the geometry can be streamed again
+        with instr.streamGeom(self.path("stream.xml")):
+            instr.addComment("after error")
+        self.assertIn("after error", self.read("stream.xml"))
+        self.assertEqual(os.listdir(self.direc), ["stream.xml"])
+
+    def testSharedElements(self):
+        reference = makeGeom()
+        shared = MantidGeom("TEST")
+        shared.addSnsDefaults()
+        shared.addComment("SOURCE AND SAMPLE POSITION")
+        shared.addModerator(-10.)
+        shared.addSamplePosition()
+        shared.addMonitors(distance=[-1.5], names=["monitor1"])
+        shared.addComment("multi\nline comment")
+        head = shared.extractElements()
+        self.assertEqual(len(shared.root), 0)
+        shared.addPixelatedTube("tube", 8, 1.)
+        tube = shared.extractElements()
+
+        instr = MantidGeom("TEST", comment=["first", "second"],
+                           valid_from="2020-01-01 00:00:00")
+        instr.addElements(head)
+        instr.addElements(tube)
+        instr.addDetectorIds("bank1", [0, 7, None])
+        instr.addMonitorIds([-1])
+        reference.root.attrib.update(instr.root.attrib)  # same last-modified
+        self.assertEqual(le.tostring(instr.root), le.tostring(reference.root))
+
+    def testGenerateVariants(self):
+        instr = MantidGeom("TEST")
+        instr.addPixelatedTube("tube", 8, 1.)
+        shared = instr.extractElements()
+        for jobs in (1, 2):
+            filenames = [self.path("variant%d_%d.xml" % (jobs, pixels))
+                         for pixels in (8, 16)]
+            output = io.StringIO()
+            with redirect_stdout(output):
+                results = generateVariants(writeVariant, [(filenames[0], shared, 8),
+                                                          (filenames[1], shared, 16)], jobs)
+            self.assertEqual(results, [8, 16])
+            # the messages of the workers are not mixed
+            self.assertEqual(output.getvalue(), "".join("writing {}\n".format(filename)
+                                                        for filename in filenames))
+            for filename, pixels in zip(filenames, (8, 16)):
+                root = le.parse(filename).getroot()
+                self.assertEqual(root.find("{*}type").get("name"), "tube")
+                self.assertEqual(root.find("{*}idlist/{*}id").get("end"), str(pixels - 1))
+
+    def testFlushOutsideStream(self):
+        instr = makeGeom()
+        self.assertRaises(RuntimeError, instr.flush)
+
+
+class TestProfile(TempDirTestCase):
+    def testProfile(self):
+        report = self.path("profile.json")
+        filename = self.path("profiled.xml")
+        instr = MantidGeom("TEST", profile=report)
+        instr.addSnsDefaults()
+        with instr.profileSection("survey"):
+            instr.addPixelatedTube("tube", 8, 1.)
+        component = instr.makeDetectorElement("tube", root=instr.root)
+        instr.addLocation(component, 0., 1., 2.)
+        instr.writeGeom(filename)
+
+        with open(report) as handle:
+            stats = json.load(handle)["methods"]
+        self.assertEqual(stats["addPixelatedTube"]["elements"], 11)
+        self.assertEqual(stats["survey"]["elements"], 11)
+        self.assertEqual(stats["survey"]["bytes"], 0)  # owned by the method
+        self.assertEqual(stats["addLocation"]["calls"], 1)
+        self.assertEqual(stats["addLocation"]["elements"], 1)
+        self.assertEqual(sum(entry["bytes"] for entry in stats.values()),
+                         os.path.getsize(filename))
+
+    def testProfileSetting(self):
+        for value in ("1", "True", "yes", " ON"):
+            self.assertIs(_profileSetting(value), True)
+        for value in ("", "0", "false", "No", "off"):
+            self.assertIs(_profileSetting(value), False)
+        for value in ("profile.json", os.path.join("reports", "profile")):
+            self.assertEqual(_profileSetting(value), value)
+        self.assertRaises(RuntimeError, _profileSetting, "y")
+
+
+class TestDetectorPixels(TempDirTestCase):
+    def testAddDetectorPixels(self):
+        x = np.array([[0.1, np.nan], [0.3, 1./3]])
+        nx = np.array([[1.5, 2.5], [np.nan, 4.5]])
+        instr = MantidGeom("TEST")
+        instr.addDetectorPixels("bank", x=x, y=x + 1, z=x + 2,
+                                names=[[0, 1], [2, "a&b"]],
+                                nx=nx, ny=nx, nz=nx,
+                                energy=[[2.08, 2.08], [2.08, 2.09]],
+                                output_efixed=True)
+        reference = le.SubElement(MantidGeom("TEST").root, "type", name="bank")
+        for (i, j), name in [((0, 0), "0"), ((1, 1), "a&b")]:
+            component = le.SubElement(reference, "component", type="pixel")
+            location = le.SubElement(component, "location", name=name,
+                                     x=str(x[i, j]), y=str(x[i, j] + 1),
+                                     z=str(x[i, j] + 2))
+            le.SubElement(location, "neutronic", x=str(nx[i, j]),
+                          y=str(nx[i, j]), z=str(nx[i, j]))
+            efixed = le.SubElement(component, "parameter", name="EFixed")
+            le.SubElement(efixed, "value", val=str([2.08, 2.09][i]))
+        self.assertEqual(le.tostring(instr.root[0]), le.tostring(reference))
+
+    def testFacing(self):
+        instr = MantidGeom("TEST")
+        instr.addDetectorPixels("bank", r=np.array([[1.]]),
+                                theta=np.array([[2.]]), phi=np.array([[3.]]),
+                                names=[[5]], output_efixed=False)
+        self.assertEqual(le.tostring(instr.root[0]).split(b'>', 1)[1],
+                         b'<component type="pixel">'
+                         b'<location name="5" r="1.0" t="2.0" p="3.0">'
+                         b'<facing x="0.0" y="0.0" z="0.0"/></location>'
+                         b'</component></type>')
+
+
+    def testGetPixels(self):
+        instr = MantidGeom("TEST")
+        instr.addDetectorPixels("bank", x=np.array([[1., np.nan, 3.]]),
+                                y=np.zeros((1, 3)), z=np.zeros((1, 3)),
+                                nx=np.ones((1, 3)), ny=np.ones((1, 3)),
+                                nz=np.ones((1, 3)), names=[[4, 5, 6]],
+                                energy=np.full((1, 3), 2.08, dtype=np.float32))
+        pixels = instr.getPixels("bank")
+        self.assertEqual(pixels.dtype.names,
+                         ("name", "x", "y", "z", "nx", "ny", "nz", "energy"))
+        self.assertEqual(pixels["name"].tolist(), [4, 6])
+        self.assertEqual(pixels["energy"].dtype, np.float32)
+        pixels["x"] *= 2  # transform before writing
+
+        for filename in ("first.xml", "second.xml"):
+            instr.writeGeom(self.path(filename))
+            written = le.parse(self.path(filename)).getroot()
+            locations = written.findall("{*}type/{*}component/{*}location")
+            self.assertEqual([loc.get("x") for loc in locations], ["2.0", "6.0"])
+            # writing keeps the pixels as arrays
+            self.assertEqual(len(instr.getPixels("bank")), 2)
+
+        self.assertEqual(len(instr.root[0]), 2)
+        self.assertRaisesRegex(RuntimeError, "no longer kept", instr.getPixels, "bank")
+        self.assertRaises(KeyError, instr.getPixels, "other")
+
+
+class TestIdRanges(unittest.TestCase):
+    def testMakeIdRanges(self):
+        ids = [1, 2, 3, 5, 7, 9, 9, 20, 10, 0]
+        self.assertEqual(makeIdRanges(ids),
+                         [1, 3, None, 5, 9, 2, 9, 20, 11, 10, 0, -10])
+        self.assertEqual(makeIdRanges(np.array(ids), strided=False),
+                         [1, 3, None, 5, 5, None, 7, 7, None, 9, 9, None,
+                          9, 9, None, 20, 20, None, 10, 10, None, 0, 0, None])
+        self.assertEqual(makeIdRanges([4]), [4, 4, None])
+        self.assertEqual(makeIdRanges([]), [])
+
+    def testAddDetectorIdRanges(self):
+        instr = MantidGeom("TEST")
+        instr.addDetectorIdRanges("bank1", np.array([[0, 1, 2], [7, 16, 25], [40, 40, 40]]))
+        self.assertEqual(instr.getIdRanges("bank1")["step"].tolist(), [0, 9, 0, 0, 0])
+        ids = [dict(element.attrib) for element in instr.root[0]]
+        self.assertRaises(RuntimeError, instr.getIdRanges, "bank1")
+        self.assertEqual(ids, [{"start": "0", "end": "2"},
+                               {"start": "7", "step": "9", "end": "25"},
+                               {"val": "40"}, {"val": "40"}, {"val": "40"}])
+
+    def testAddDetectorPixelsIdList(self):
+        r = np.array([[1., np.nan, 1.], [1., 1., 1.]])
+        names = np.arange(6).reshape(2, 3)
+        instr = MantidGeom("TEST")
+        instr.addDetectorPixelsIdList("single", r=r, names=names)
+        instr.addDetectorPixelsIdList("ranges", r=r, names=names,
+                                      elg="multiple_ranges")
+        single, ranges = instr.root
+        self.assertEqual([dict(id.attrib) for id in single],
+                         [{"val": str(i)} for i in (0, 2, 3, 4, 5)])
+        self.assertEqual([dict(id.attrib) for id in ranges],
+                         [{"start": "0", "end": "0"}, {"start": "2", "end": "5"}])
+
+
+class TestDeduplicateTypes(TempDirTestCase):
+    def makeBanks(self, instr):
+        for i in (1, 2, 3):
+            component = le.SubElement(instr.root, "component", type="bank%d" % i)
+            le.SubElement(component, "location", name="bank%d" % i, x=str(i))
+            bank = le.SubElement(instr.root, "type", name="bank%d" % i)
+            le.SubElement(bank, "component", type="panel%d" % i)
+        for i in (1, 2, 3):
+            panel = le.SubElement(instr.root, "type", name="panel%d" % i)
+            le.SubElement(panel, "cuboid", id="shape", x=str(min(i, 2)))
+
+    def testDeduplicateTypes(self):
+        instr = MantidGeom("TEST")
+        self.makeBanks(instr)
+        self.assertEqual(instr.deduplicateTypes(),
+                         {"panel3": "panel2"})
+        self.assertEqual([t.get("name") for t in instr.root.iterchildren("type")],
+                         ["bank1", "bank2", "bank3", "panel1", "panel2"])
+        # the unnamed component keeps the name of the removed type
+        renamed = instr.root.find("type[@name='bank3']/component")
+        self.assertEqual(dict(renamed.attrib), {"type": "panel2", "name": "panel3"})
+        self.assertEqual(instr.deduplicateTypes(), {})
+
+    def testMergeNamedComponents(self):
+        instr = MantidGeom("TEST")
+        for i in (1, 2):
+            bank = le.SubElement(instr.root, "type", name="bank%d" % i)
+            panel = le.SubElement(bank, "component", type="panel%d" % i)
+            le.SubElement(panel, "location", name="panel")
+        for i in (1, 2):
+            le.SubElement(instr.root, "type", name="panel%d" % i)
+        self.assertEqual(instr.deduplicateTypes(),
+                         {"panel2": "panel1", "bank2": "bank1"})
+
+    def testStreamGeom(self):
+        filename = self.path("dedup.xml")
+        instr = MantidGeom("TEST", dedup_types=True)
+        with instr.streamGeom(filename):
+            self.makeBanks(instr)
+            instr.flush()
+            le.SubElement(instr.root, "component", type="panel4")
+            panel = le.SubElement(instr.root, "type", name="panel4")
+            le.SubElement(panel, "cuboid", id="shape", x="1")
+        types = le.parse(filename).getroot().findall("{*}type")
+        self.assertEqual(len(types), 5)
+        self.assertEqual(le.parse(filename).getroot()[-1].attrib,
+                         {"type": "panel1", "name": "panel4"})
+
+
+class TestNumberFormatter(unittest.TestCase):
+    def testDefault(self):
+        fmt = NumberFormatter()
+        self.assertEqual(fmt.length(0.1), "0.1")
+        self.assertEqual(fmt.length(-1./3, 5), "-0.33333")
+        self.assertEqual(fmt.angle(np.float32(1.1)), str(np.float32(1.1)))
+        self.assertRaises(ValueError, fmt.format, 1., "mass")
+
+    def testPrecision(self):
+        fmt = NumberFormatter(length=3, angle=1)
+        self.assertEqual(fmt.length(1./3), "0.333")
+        self.assertEqual(fmt.length(1./3, 5), "0.333")
+        self.assertEqual(fmt.angle("90"), "90.0")
+        # values that are not numbers are passed through
+        self.assertEqual(fmt.length("1/3"), "1/3")
+        self.assertEqual(fmt.length(None), "None")
+        self.assertEqual(fmt.formatArray(["1/3", "0.5"]), ["1/3", "0.500"])
+        self.assertEqual(fmt.energy(2.08), "2.08")
+
+    def testFormatArray(self):
+        values = np.array([[0.1, -1./3], [1e-7, 123456.789]])
+        for fmt in (NumberFormatter(), NumberFormatter(length=4)):
+            for decimals in (None, 2):
+                self.assertEqual(fmt.formatArray(values, "length", decimals),
+                                 [fmt.length(v, decimals) for v in values.ravel()])
+
+    def testMantidGeom(self):
+        instr = MantidGeom("TEST", formatter=NumberFormatter(length=2, angle=1))
+        instr.addSamplePosition(location=(1./3, 2./3, 1.), coord_type="spherical")
+        self.assertEqual(dict(instr.root[0][0].attrib),
+                         {"r": "0.33", "t": "0.7", "p": "1.0"})
+
+
+if __name__ == "__main__":
+    unittest.main(module="helper_test", verbosity=2)
@@ -0,0 +1,273 @@
+"""
+Semantic comparison of instrument definition files.
+
+Both files are walked with iterparse in lockstep and elements are cleared
+once read, so memory stays bounded whatever the size of the files. Nodes are
+compared by tag, attributes, text and comments, ignoring attribute order,
+whitespace and the last-modified attribute, with a tolerance for numbers.
+Differences are reported by XPath. After an inserted or removed subtree the
+walk resynchronizes on the next node both files have in common.
+"""
+from collections import deque, namedtuple
+import math
+import re
+
+from lxml import etree as le
+
+TOLERANCE = 1e-9
+IGNORE_ATTRIBUTES = ("last-modified",)
+# number of nodes searched ahead to resynchronize after a difference
+WINDOW = 64
+
+# everything but the path identifies a node, see same()
+Node = namedtuple("Node", ["path", "kind", "depth", "tag", "attrib", "text"])
+Difference = namedtuple("Difference", ["kind", "path", "old", "new"])
+
+_SEPARATORS = re.compile(r"[\s,]+")
+
+
+def walk(filename, ignore=IGNORE_ATTRIBUTES):
+    """
+    Generate the nodes of an xml file in document order: every element when
+    it starts, its text when it ends, and the comments
+    """
+    stack = [("", {})]
+    localnames = {}
+
+    def childPath(name):
+        parent, counts = stack[-1]
+        count = counts[name] = counts.get(name, 0) + 1
+        return parent + "/" + name + "[" + str(count) + "]"
+
+    for event, element in le.iterparse(filename, events=("start", "end", "comment"),
+                                       huge_tree=True):
+        if event == "start":
+            tag = element.tag
+            name = localnames.get(tag)
+            if name is None:
+                name = localnames[tag] = le.QName(tag).localname
+            path = childPath(name)
+            stack.append((path, {}))
+            attrib = dict(element.attrib)
+            for key in ignore:
+                attrib.pop(key, None)
+            yield Node(path, "element", len(stack) - 1, tag, attrib, None)
+        elif event == "end":
+            path = stack.pop()[0]
+            text = element.text
+            if text is not None:
+                text = text.strip()
+                if text:
+                    yield Node(path + "/text()", "text", len(stack) + 1, element.tag, {}, text)
+            # drop what has been compared
+            element.clear()
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+        else:
+            path = childPath("comment()")
+            yield Node(path, "comment", len(stack), None, {}, (element.text or "").strip())
+
+
+def countElements(filename):
+    """
+    Number of elements of an xml file, without building the tree. None if
+    the file is not well-formed, e.g. left truncated by a failing script.
+    """
+    count = 0
+    try:
+        for _, element in le.iterparse(filename, events=("end",)):
+            count += 1
+            element.clear()
+    except le.XMLSyntaxError:
+        return None
+    return count
+
+
+def rootAttributes(filename):
+    """
+    Attributes of the root element, without reading the rest of the file
+    """
+    for _, element in le.iterparse(filename, events=("start",)):
+        return dict(element.attrib)
+    return {}
+
+
+def sameValue(old, new, tolerance=TOLERANCE):
+    """
+    Whether two attribute values or texts are equal, comparing the numbers
+    of whitespace or comma separated lists within tolerance
+    """
+    if old == new:
+        return True
+    if old is None or new is None:
+        return False
+    oldTokens = _SEPARATORS.split(old.strip())
+    newTokens = _SEPARATORS.split(new.strip())
+    if len(oldTokens) != len(newTokens):
+        return False
+    for oldToken, newToken in zip(oldTokens, newTokens):
+        if oldToken == newToken:
+            continue
+        try:
+            if not math.isclose(float(oldToken), float(newToken),
+                                rel_tol=tolerance, abs_tol=tolerance):
+                return False
+        except ValueError:
+            return False
+    return True
+
+
+def aligned(old, new):
+    """
+    Whether two nodes have the same place in the structure
+    """
+    return old.kind == new.kind and old.depth == new.depth and old.tag == new.tag
+
+
+def same(old, new, tolerance=TOLERANCE):
+    if old[1:] == new[1:]:
+        return True
+    if not aligned(old, new) or set(old.attrib) != set(new.attrib):
+        return False
+    for key, value in old.attrib.items():
+        if not sameValue(value, new.attrib[key], tolerance):
+            return False
+    return sameValue(old.text, new.text, tolerance)
+
+
+def describe(node):
+    """
+    Short text of a node for reports
+    """
+    if node.kind == "element":
+        attrib = "".join(' {}="{}"'.format(key, value) for key, value in sorted(node.attrib.items()))
+        return "<{}{}>".format(le.QName(node.tag).localname, attrib)
+    if node.kind == "comment":
+        return "<!--{}-->".format(node.text)
+    return node.text
+
+
+def formatDifference(difference):
+    if difference.kind == "removed":
+        return "-{} {}".format(difference.path, difference.old)
+    if difference.kind == "added":
+        return "+{} {}".format(difference.path, difference.new)
+    return "~{} {!r} -> {!r}".format(difference.path, difference.old, difference.new)
+
+
+class _Lookahead(object):
+    """
+    Iterator over nodes that can peek at the next ones
+    """
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.buffer = deque()
+
+    def peek(self, index=0):
+        if index < len(self.buffer):
+            return self.buffer[index]
+        while len(self.buffer) <= index:
+            try:
+                self.buffer.append(next(self.nodes))
+            except StopIteration:
+                return None
+        return self.buffer[index]
+
+    def pop(self):
+        self.peek()
+        return self.buffer.popleft()
+
+    def find(self, node, window, tolerance):
+        """
+        Offset of the first node after the current one equal to node
+        """
+        for offset in range(1, window + 1):
+            candidate = self.peek(offset)
+            if candidate is None:
+                return None
+            if same(candidate, node, tolerance):
+                return offset
+        return None
+
+    def skip(self, count):
+        """
+        Drop count nodes, generating the roots of the dropped subtrees
+        """
+        depth = None
+        for _ in range(count):
+            node = self.pop()
+            if depth is None or node.depth <= depth:
+                depth = node.depth
+                yield node
+
+    def skipSubtree(self):
+        node = self.pop()
+        while self.peek() is not None and self.peek().depth > node.depth:
+            self.pop()
+        return node
+
+
+def _changes(old, new, tolerance):
+    if old.kind == "element":
+        for key in sorted(set(old.attrib) | set(new.attrib)):
+            oldValue, newValue = old.attrib.get(key), new.attrib.get(key)
+            if not sameValue(oldValue, newValue, tolerance):
+                yield Difference("changed", old.path + "/@" + key, oldValue, newValue)
+    else:
+        yield Difference("changed", old.path, old.text, new.text)
+
+
+def compare(golden, outfile, tolerance=TOLERANCE, window=WINDOW, ignore=IGNORE_ATTRIBUTES):
+    """
+    Generate the differences between two xml files. Removed nodes are
+    reported with their path in golden, added and changed ones with their
+    path in outfile. Raises lxml.etree.XMLSyntaxError if a file is not
+    well-formed.
+    """
+    old = _Lookahead(walk(golden, ignore))
+    new = _Lookahead(walk(outfile, ignore))
+    while True:
+        oldNode, newNode = old.peek(), new.peek()
+        if oldNode is None and newNode is None:
+            return
+        if oldNode is None:
+            node = new.skipSubtree()
+            yield Difference("added", node.path, None, describe(node))
+            continue
+        if newNode is None:
+            node = old.skipSubtree()
+            yield Difference("removed", node.path, describe(node), None)
+            continue
+        if same(oldNode, newNode, tolerance):
+            old.pop()
+            new.pop()
+            continue
+
+        if aligned(oldNode, newNode):
+            # a changed node is followed by matching ones
+            oldNext, newNext = old.peek(1), new.peek(1)
+            if (oldNext is None and newNext is None) or \
+                    (oldNext is not None and newNext is not None and
+                     same(oldNext, newNext, tolerance)):
+                for difference in _changes(old.pop(), new.pop(), tolerance):
+                    yield difference
+                continue
+
+        removed = old.find(newNode, window, tolerance)
+        added = new.find(oldNode, window, tolerance)
+        if added is not None and (removed is None or added <= removed):
+            for node in new.skip(added):
+                yield Difference("added", node.path, None, describe(node))
+        elif removed is not None:
+            for node in old.skip(removed):
+                yield Difference("removed", node.path, describe(node), None)
+        elif aligned(oldNode, newNode):
+            for difference in _changes(old.pop(), new.pop(), tolerance):
+                yield difference
+        else:
+            node = old.skipSubtree()
+            yield Difference("removed", node.path, describe(node), None)
+            node = new.skipSubtree()
+            yield Difference("added", node.path, None, describe(node))
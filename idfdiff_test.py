@@ -0,0 +1,72 @@
+#!/bin/env python
+from idfdiff import compare, formatDifference, rootAttributes, sameValue
+from lxml import etree as le
+from testutils import TempDirTestCase
+import unittest
+
+HEADER = '<instrument xmlns="http://www.mantidproject.org/IDF/1.0" name="TEST" ' \
+         'last-modified="{}">\n'
+LOCATIONS = ['  <location x="{}" name="pixel{}"/>\n'.format(0.1 * i, i) for i in range(6)]
+
+
+class TestCompare(TempDirTestCase):
+    def writeIdf(self, name, lines, modified="2020-01-01"):
+        return self.write(name, HEADER.format(modified) + "  <!-- pixels -->\n" +
+                          '  <type name="bank">\n' + "".join(lines) + "  </type>\n</instrument>\n")
+
+    def compare(self, lines, **kwargs):
+        golden = self.writeIdf("golden.xml", LOCATIONS)
+        outfile = self.writeIdf("new.xml", lines, modified="2021-02-03")
+        return [formatDifference(difference) for difference in compare(golden, outfile, **kwargs)]
+
+    def testIdentical(self):
+        self.assertEqual(self.compare(LOCATIONS), [])
+        self.assertEqual(rootAttributes(self.writeIdf("golden.xml", []))["last-modified"],
+                         "2020-01-01")
+
+    def testFormatting(self):
+        # attribute order, quotes, whitespace and rounding are not differences
+        lines = list(LOCATIONS)
+        lines[3] = "  <location   name='pixel3'\n x=\"0.30000000000000004\" />\n"
+        self.assertEqual(self.compare(lines), [])
+
+    def testChanged(self):
+        lines = list(LOCATIONS)
+        lines[2] = '  <location x="0.25" name="pixel2" y="1"/>\n'
+        self.assertEqual(self.compare(lines),
+                         ["~/instrument[1]/type[1]/location[3]/@x '0.2' -> '0.25'",
+                          "~/instrument[1]/type[1]/location[3]/@y None -> '1'"])
+        self.assertEqual(self.compare(lines, tolerance=.1),
+                         ["~/instrument[1]/type[1]/location[3]/@y None -> '1'"])
+
+    def testRemoved(self):
+        lines = LOCATIONS[:2] + LOCATIONS[3:]
+        self.assertEqual(self.compare(lines),
+                         ['-/instrument[1]/type[1]/location[3] <location name="pixel2" x="0.2">'])
+
+    def testAdded(self):
+        subtree = ['  <component type="tube">\n', '    <location x="5"/>\n', '  </component>\n']
+        lines = LOCATIONS[:4] + subtree + LOCATIONS[4:]
+        self.assertEqual(self.compare(lines),
+                         ['+/instrument[1]/type[1]/component[1] <component type="tube">'])
+
+    def testTruncated(self):
+        golden = self.writeIdf("golden.xml", LOCATIONS)
+        outfile = self.write("new.xml", HEADER.format("2021") + "  <type ")
+        with self.assertRaises(le.XMLSyntaxError):
+            list(compare(golden, outfile))
+
+
+class TestSameValue(unittest.TestCase):
+    def testValues(self):
+        self.assertTrue(sameValue("1", "1.0"))
+        self.assertTrue(sameValue("0.1, 0.2", "0.1,0.20000000001"))
+        self.assertFalse(sameValue("0.1 0.2", "0.1"))
+        self.assertFalse(sameValue("1", "1.1"))
+        self.assertTrue(sameValue("1", "1.1", tolerance=.2))
+        self.assertFalse(sameValue("bank", "bank1"))
+        self.assertFalse(sameValue(None, "1"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -3,11 +3,10 @@
 # liberally ported from
 # https://flathead.ornl.gov/trac/TranslationService/browser/calibration/geometry/NOM.py
 from helper import INCH_TO_METRE, DEG_TO_RAD, MantidGeom
-from rectangle import Rectangle, Vector
+from rectangle import CORNER_ORDERS, Rectangle, Vector
 from lxml import etree as le # python-lxml on rpm based systems
 from math import cos, sin, radians, pi
-import numpy as np
-from sns_ncolumn import readFile
+from sns_ncolumn import readColumns
 
 # All of the tubes are 40" long with a 2mm gap between tubes
 TUBE_LENGTH = 40. * INCH_TO_METRE # 1m long matches better in bank4
@@ -22,6 +21,12 @@ UL = 0*128+127 # UPPER LEFT CORNER
 LR = 7*128+0   # LOWER RIGHT CORNER
 UR = 7*128+127 # UPPER RIGHT CORNER
 
+# orders of the corners of a bank in rectangle.CORNER_ORDERS
+KEEP = 0
+FLIPY = 2
+FLIPX = 4
+BACKWARDS = 6
+
 def makeIds(numBanks, offset, size):
     ids = []
     for i in range(numBanks):
@@ -44,8 +49,9 @@ def getCornersSpecial(banknum):
     corners = [tube0 + 0, tube0 + 58, tube15 + 58, tube15 + 0]
     return corners
 
-def getRectangle(bank_num, positions, corners, tolerance_len=0.006):
+def getRectangle(bank_num, positions, corners, tolerance_len=0.006, order=KEEP):
     # TODO for some reason tolerance is bigger than the default
+    corners = [corners[i] for i in CORNER_ORDERS[order]]
     try:
         one = positions[corners[0]]
         two = positions[corners[1]]
@@ -66,16 +72,18 @@ def getRectangle(bank_num, positions, corners, tolerance_len=0.006):
         raise e
 
 def readEngineeringPositions(filename):
-    positions = readFile(filename, hasLabels=False)
+    # the file has a line for every pixel
+    positions = readColumns(filename, hasLabels=False, mapped=True, cache=True,
+                            dtypes={0: int, 1: int, 5: float, 6: float, 7: float})
 
-    tube = np.fromiter(map(int, positions[0]), dtype=int)
-    pixel = np.fromiter(map(int, positions[1]), dtype=int)
+    tube = positions[0]
+    pixel = positions[1]
     id = tube*128+pixel
 
-    x = -1. * np.fromiter(map(float, positions[6]), dtype=float)
+    x = -1. * positions[6]
     x[x == -0.] = 0.
-    y = np.fromiter(map(float, positions[5]), dtype=float)
-    z = np.fromiter(map(float, positions[7]), dtype=float)
+    y = positions[5]
+    z = positions[7]
 
     positions = {}
     for i, x_i,y_i,z_i in zip(id, x,y,z):
@@ -85,13 +93,14 @@ def readEngineeringPositions(filename):
 
 def readSurveyPositions(filename):
     # label1, label2, z, x, y
-    positions = readFile(filename, hasLabels=False, headerLines=1)
+    positions = readColumns(filename, hasLabels=False, headerLines=1, cache=True,
+                            dtypes={0: str, 1: float, 2: float, 3: float})
 
     labels = positions[0]
     # NOTE: label2 column is empty on latest survey, so these indices are shifted back one
-    x = np.fromiter(map(float, positions[2]), dtype=float)
-    y = np.fromiter(map(float, positions[3]), dtype=float)
-    z = np.fromiter(map(float, positions[1]), dtype=float)
+    x = positions[2]
+    y = positions[3]
+    z = positions[1]
 
     ids = []
 
@@ -197,8 +206,7 @@ if __name__ == "__main__":
         bank = "bank%d" % bank_num
         corners = getCorners(bank_num)
         # appears to be backwards!!!!!!!!!!!!!!!!
-        corners = [corners[1], corners[0], corners[3], corners[2]]
-        rect = getRectangle(bank_num, positions, corners)
+        rect = getRectangle(bank_num, positions, corners, order=BACKWARDS)
        	det = instr.makeDetectorElement('pack', root=group)
        	rect.makeLocation(instr, det, bank)
 
@@ -238,9 +246,7 @@ if __name__ == "__main__":
         else:
             corners = getCorners(bank_num)
 
-        # flipy
-        corners = [corners[2], corners[3], corners[0], corners[1]]
-        rect = getRectangle(bank_num, positions, corners)
+        rect = getRectangle(bank_num, positions, corners, order=FLIPY)
 
         if bank_num in special:
        	    det = instr.makeDetectorElement('packhalfshort', root=group)
@@ -267,16 +273,8 @@ if __name__ == "__main__":
             corners = getCorners(shuffled.get(bank_num, bank_num))
 
         # corners are mixed up
-        if bank_num == 91:
-            # flipx
-            corners = [corners[3], corners[2], corners[1], corners[0]]
-        elif bank_num == 90:
-            # flipy
-            corners = [corners[2], corners[3], corners[0], corners[1]]
-        else:
-            corners = [corners[2], corners[3], corners[0], corners[1]]
-
-        rect = getRectangle(bank_num, positions, corners)
+        order = FLIPX if bank_num == 91 else FLIPY
+        rect = getRectangle(bank_num, positions, corners, order=order)
 
         if bank_num in special:
        	    det = instr.makeDetectorElement('packhalfshort', root=group)
@@ -5,7 +5,7 @@ from rectangle import Rectangle, Vector, getEuler, makeLocation
 from lxml import etree as le # python-lxml on rpm based systems
 from math import cos, sin, radians, pi
 import numpy as np
-from sns_ncolumn import readFile
+from sns_ncolumn import readColumns
 
 # size of the panels from original pixel sizes
 x_extent = 154*.005
@@ -18,15 +18,42 @@ y_num2 = 7
 # primary flight path - negative b/c it is upstream
 L1 = -60.0
 
+class CornersFile:
+    """
+    Survey of the four corners of every bank, with one point per line
+    labelled <bank>_<corner>, e.g. B2_1, and its Z, X and Y
+    """
+    def __init__(self, filename, L1=L1):
+        positions = readColumns(filename, cache=True)
+        self.__corners = {}
+        for label, x, y, z in zip(positions['Point_ID'], positions['X'],
+                                  positions['Y'], positions['Z'] + L1):
+            bank, corner = label.rsplit('_', 1)
+            if bank not in self.__corners:
+                self.__corners[bank] = np.full((4, 3), np.nan)
+            self.__corners[bank][int(corner)-1] = (x, y, z)
+
+    def banks(self):
+        return sorted(self.__corners.keys())
+
+    def corners(self, bank):
+        """
+        (4, 3) corners of a bank in the order of their labels, NaN for the
+        ones that were not surveyed
+        """
+        return self.__corners[bank].copy()
+
+    def rectangle(self, bank, tolerance):
+        return Rectangle(*self.__corners[bank], tolerance_len=tolerance)
+
 def readPositionsRight(filename):
-    positions = readFile(filename)
+    positions = readColumns(filename, cache=True)
     del positions['Position']
     del positions['DetectorNum']
 
-    x = np.array(map(float, positions['X']))
-    y = np.array(map(float, positions['Elevation']))
-    z = np.array(map(float, positions['Z'])) - 60.
-    positions['bank'] = np.array(map(int, positions['bank']))
+    x = positions['X']
+    y = positions['Elevation']
+    z = positions['Z'] - 60.
 
     positions['position'] = []
     for x_i,y_i,z_i in zip(x,y,z):
@@ -60,10 +87,10 @@ def readPositionsRight(filename):
     return banks
 
 def readPositionsLeft(filename):
-    positions = readFile(filename)
-    x = np.array(map(float, positions['X']))
-    y = np.array(map(float, positions['Elevation']))
-    z = np.array(map(float, positions['Z']))
+    positions = readColumns(filename, cache=True)
+    x = positions['X']
+    y = positions['Elevation']
+    z = positions['Z']
     positions['position'] = []
     for x_i,y_i,z_i in zip(x,y,z):
         positions['position'].append(Vector(x_i, y_i, z_i))
@@ -19,43 +19,72 @@ except ImportError:
 
 TOLERANCE = .0001
 
-class Vector:
+class Vector(object):
     """
     This class encapsulates the concept of a vector in 3D space from
-    geometry
+    geometry. The components are kept as plain floats, numpy is only
+    used to convert other inputs.
     """
+    __slots__ = ("_x", "_y", "_z")
 
     LENGTH = 3
 
     def __init__(self, *values):
-        self.data = np.array(values, dtype=np.float).flatten()
-
-        # check the length
-        if self.data.size != Vector.LENGTH:
-            msg = "Expected %d values, found %d" % (Vector.LENGTH, self.data.size)
-            raise RuntimeError(msg)
+        if len(values) == 1:
+            values = values[0]
+            if isinstance(values, Vector):
+                self._x, self._y, self._z = values._x, values._y, values._z
+                return
+        try:
+            x, y, z = values
+            x, y, z = float(x), float(y), float(z)
+        except (TypeError, ValueError):
+            data = np.array(values, dtype=float).flatten()
+
+            # check the length
+            if data.size != Vector.LENGTH:
+                msg = "Expected %d values, found %d" % (Vector.LENGTH, data.size)
+                raise RuntimeError(msg)
+            x, y, z = (float(value) for value in data)
 
         # sanity check the numbers
-        if np.any(np.isnan(self.data)):
+        if math.isnan(x) or math.isnan(y) or math.isnan(z):
             raise RuntimeError("Encountered NaN")
+        self._x, self._y, self._z = x, y, z
 
-    x = property(lambda self: self.data[0])
-    y = property(lambda self: self.data[1])
-    z = property(lambda self: self.data[2])
-    length = property(lambda self: np.sqrt(self.dot(self)))
+    x = property(lambda self: self._x)
+    y = property(lambda self: self._y)
+    z = property(lambda self: self._z)
 
+    def __getData(self):
+        data = np.array((self._x, self._y, self._z))
+        data.flags.writeable = False  # a copy, changing it would not change the vector
+        return data
+
+    def __setData(self, values):
+        self._x, self._y, self._z = Vector(values)
+
+    data = property(__getData, __setData,
+                    doc="Read-only copy of the components as a numpy array. Assign all of "
+                    "them at once to change the vector")
 
     def cross(self, other):
         """
         Calculate the cross product of this with another vector.
         """
-        return Vector(np.cross(self.data, Vector(other).data))
+        if not isinstance(other, Vector):
+            other = Vector(other)
+        return Vector(self._y*other._z - self._z*other._y,
+                      self._z*other._x - self._x*other._z,
+                      self._x*other._y - self._y*other._x)
 
     def dot(self, other):
         """
         Calculate the dot product of this with another vector.
         """
-        return np.dot(self.data, Vector(other).data)
+        if not isinstance(other, Vector):
+            other = Vector(other)
+        return self._x*other._x + self._y*other._y + self._z*other._z
 
     def normalize(self):
         """
@@ -68,11 +97,10 @@ class Vector:
         if abs(length) < TOLERANCE:
             raise RuntimeError("Zero vector of zero length")
 
-        # divide the elements by the length
-        self.data /= length
-
-        # set near zeros to zero
-        self.data[np.abs(self.data) < TOLERANCE] = 0.
+        # divide the elements by the length and set near zeros to zero
+        values = [value / length for value in self]
+        self._x, self._y, self._z = [0. if abs(value) < TOLERANCE else value
+                                     for value in values]
 
         return self
 
@@ -84,37 +112,48 @@ class Vector:
             return False
 
         for unit_vec in (UNIT_X, UNIT_Y, UNIT_Z):
-            if np.allclose(self.data, unit_vec, atol=TOLERANCE):
+            # same as np.allclose(self.data, unit_vec, atol=TOLERANCE)
+            if all(abs(value - unit) <= TOLERANCE + 1.e-5 * abs(unit)
+                   for value, unit in zip(self, unit_vec)):
                 if resetValues:
-                    self.data = unit_vec
+                    self._x, self._y, self._z = unit_vec._x, unit_vec._y, unit_vec._z
                 return True
 
         return False
 
     def __getitem__(self, key):
-        return self.data[key]
+        return (self._x, self._y, self._z)[key]
+
+    def __iter__(self):
+        return iter((self._x, self._y, self._z))
+
+    def __array__(self, dtype=None):
+        return np.array((self._x, self._y, self._z), dtype=dtype)
 
     def __eq__(self, other):
-        try:
-            return np.alltrue(self.data == other.data)
-        except AttributeError:
+        if not isinstance(other, Vector):
             other = Vector(other)
-            return self == other
+        return self._x == other._x and self._y == other._y and self._z == other._z
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
 
     def __add__(self, other):
-        return Vector(self.data + other.data)
+        return Vector(self._x + other[0], self._y + other[1], self._z + other[2])
 
     def __sub__(self, other):
-        return Vector(self.data - other.data)
+        return Vector(self._x - other[0], self._y - other[1], self._z - other[2])
 
     def __div__(self, other):
-        return Vector(self.data / other) # only allow divide by a scalar
+        return Vector(self._x / other, self._y / other, self._z / other) # only allow divide by a scalar
 
     def __truediv__(self, other):
-        return Vector(self.data / other) # only allow divide by a scalar
+        return Vector(self._x / other, self._y / other, self._z / other) # only allow divide by a scalar
 
     def __mul__(self, other):
-        return Vector(self.data * other) # only allow multiply by a scalar
+        return Vector(self._x * other, self._y * other, self._z * other) # only allow multiply by a scalar
 
     def __rmul__(self, other):
         return self * other
@@ -123,7 +162,7 @@ class Vector:
         return self.data.__repr__()
 
     def __len__(self):
-        return self.data.size
+        return Vector.LENGTH
 
     length = property(lambda self: math.sqrt(self.dot(self)))
 
@@ -316,6 +355,186 @@ def getZYZ(rotation):
 
     return angles
 
+def getAngleArray(y, x):
+    """
+    getAngle of arrays of sines and cosines, only positive angles
+    """
+    angle = np.arctan2(y, x)
+    return np.where(angle < 0., angle + 2.*np.pi, angle)
+
+def _stack(values, shape, name):
+    values = np.asarray(values, dtype=float)
+    if values.ndim != len(shape) + 1 or values.shape[1:] != shape:
+        raise RuntimeError("Expected %s of shape (N, %s), found %s"
+                           % (name, ", ".join(str(i) for i in shape), values.shape))
+    return values
+
+def _dotArray(first, second):
+    """
+    Dot product of each pair of rows, summed in the order of Vector.dot
+    """
+    return first[:, 0]*second[:, 0] + first[:, 1]*second[:, 1] + first[:, 2]*second[:, 2]
+
+def _lengthArray(vectors):
+    return np.sqrt(_dotArray(vectors, vectors))
+
+def _normalizeArray(vectors):
+    """
+    Vector.normalize of each row
+    :return: the normalized vectors and the mask of the ones of zero length
+    """
+    length = _lengthArray(vectors)
+    zero = np.abs(length) < TOLERANCE
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = vectors / length[:, np.newaxis]
+    result[np.abs(result) < TOLERANCE] = 0.
+
+    # cardinal vectors are set to their exact value
+    nearUnit = np.abs(length - 1.) <= TOLERANCE
+    cardinal = np.zeros(len(vectors), dtype=bool)
+    for unit_vec in (UNIT_X, UNIT_Y, UNIT_Z):
+        close = nearUnit & ~cardinal & np.all(np.abs(vectors - unit_vec.data)
+                                              <= TOLERANCE + 1.e-5 * np.abs(unit_vec.data), axis=1)
+        result[close] = unit_vec.data
+        cardinal |= close
+    return result, zero & ~cardinal
+
+def getEulerArray(uVecs, vVecs, **kwargs):
+    """
+    getEuler of each pair of rows of two (N, 3) arrays
+    :return: (N, 3) array of phi, chi, omega
+    """
+    degrees = kwargs.get("degrees", False)
+
+    uVecs = _stack(uVecs, (Vector.LENGTH,), "u-vectors")
+    vVecs = _stack(vVecs, (Vector.LENGTH,), "v-vectors")
+    if len(uVecs) != len(vVecs):
+        raise RuntimeError("Found %d u-vectors and %d v-vectors" % (len(uVecs), len(vVecs)))
+
+    def normalize(vectors):
+        vectors, zero = _normalizeArray(vectors)
+        if np.any(zero):
+            raise RuntimeError("Zero vector of zero length (index %d)" % np.flatnonzero(zero)[0])
+        return vectors
+
+    # orthonormal basis as in getEuler
+    uVecs = normalize(uVecs)
+    nVecs = normalize(np.cross(uVecs, vVecs))
+    vVecs = normalize(np.cross(nVecs, uVecs))
+
+    for name, first, second in (("u dot v", uVecs, vVecs), ("u dot n", uVecs, nVecs),
+                                ("v dot n", vVecs, nVecs)):
+        dotProd = np.abs(_dotArray(first, second))
+        if np.any(dotProd > TOLERANCE):
+            raise RuntimeError('{} is too large: {} > {}'.format(name, dotProd.max(), TOLERANCE))
+
+    angles = np.empty((len(uVecs), 3), dtype=float)
+    angles[:, 0] = np.arctan2(nVecs[:, 1], uVecs[:, 1])
+    angles[:, 1] = np.arccos(vVecs[:, 1])
+    angles[:, 2] = np.arctan2(vVecs[:, 2], -1. * vVecs[:, 0])
+
+    # chi rotation is 0, just rotate about z-axis
+    up = vVecs[:, 1] == 1.
+    angles[up, 0] = np.arctan2(nVecs[up, 0], nVecs[up, 2])
+    angles[up, 1:] = 0.
+
+    # chi rotation is 180 degrees
+    down = vVecs[:, 1] == -1.
+    phi = -1. * np.arctan2(nVecs[down, 0], nVecs[down, 2])
+    phi[phi == -1. * np.pi] = np.pi
+    angles[down, 0] = phi
+    angles[down, 1] = np.pi
+    angles[down, 2] = 0.
+
+    if degrees:
+        angles = np.degrees(angles)
+    angles[angles == 0.] = 0.
+    return angles
+
+def generateRotationArray(axis, angles, radians=True):
+    """
+    Rotations about the same axis by each of the angles, as generateRotation
+    :return: (N, 3, 3) array
+    """
+    angles = np.asarray(angles, dtype=float)
+    if not radians:
+        angles = np.radians(angles)
+    axis = Vector(axis)
+
+    sqr_a = axis.x*axis.x
+    sqr_b = axis.y*axis.y
+    sqr_c = axis.z*axis.z
+    len2  = sqr_a+sqr_b+sqr_c
+
+    k2    = np.cos(angles)
+    k1    = (1.0-k2)/len2
+    k3    = np.sin(angles)/math.sqrt(len2)
+    k1ab  = k1*axis.x*axis.y
+    k1ac  = k1*axis.x*axis.z
+    k1bc  = k1*axis.y*axis.z
+    k3a   = k3*axis.x
+    k3b   = k3*axis.y
+    k3c   = k3*axis.z
+
+    rotation = np.empty((len(angles), 3, 3), dtype=float)
+    rotation[:, 0, 0] = k1*sqr_a+k2
+    rotation[:, 0, 1] = k1ab-k3c
+    rotation[:, 0, 2] = k1ac+k3b
+    rotation[:, 1, 0] = k1ab+k3c
+    rotation[:, 1, 1] = k1*sqr_b+k2
+    rotation[:, 1, 2] = k1bc-k3a
+    rotation[:, 2, 0] = k1ac-k3b
+    rotation[:, 2, 1] = k1bc+k3a
+    rotation[:, 2, 2] = k1*sqr_c+k2
+    rotation[np.abs(rotation) < 1.e-15] = 0.
+    return rotation
+
+def calcEulerArray(rotations, convention):
+    """
+    calcEuler of each of the (N, 3, 3) rotations
+    :return: (N, 3) array
+    """
+    R = _stack(rotations, (3, 3), "rotations")
+    angles = np.zeros((len(R), 3), dtype=float)
+    XYZ=np.array([[1,0,0],[0,1,0],[0,0,1]], dtype=float) # identity matrix
+    #decode the convention: code X=0, Y=1, Z=2
+    convention=convention.upper().translate(maketrans("XYZ","012"))
+    first,second,last=int(convention[0]),int(convention[1]),int(convention[2])
+    tb = 1 if (first+second+last==3) else 0
+    par12 = 1 if ((last-second)%3 ==1) else -1
+    par01 = 1 if ((second-first)%3 ==1) else -1
+    s3=(1-tb-tb*par12)*R[:,(last+tb*par12)%3,(last-par12)%3]
+    c3=(tb-(1-tb)*par12)*R[:,(last+tb*par12)%3,(last+par12)%3]
+    angles[:,2]=getAngleArray(s3,c3)
+    R1R2=np.matmul(R, generateRotationArray(XYZ[last],-1.*angles[:,2]))
+    s1=par01*R1R2[:,(first-par01)%3,(first+par01)%3]
+    c1=R1R2[:,second,second]
+    s2=par01*R1R2[:,first,3-first-second]
+    c2=R1R2[:,first,first]
+    angles[:,1]=getAngleArray(s2,c2)
+    angles[:,0]=getAngleArray(s1,c1)
+    angles[abs(angles) < 1.e-5] = 0.
+    return angles
+
+def _foldEulerArray(angles):
+    # if the middle rotation is missing, just set
+    # everything to the first rotation
+    missing = angles[:,1] == 0.
+    angles[missing, 2] += angles[missing, 0]
+    angles[missing, 0] = 0.
+
+    # make sure that everything has angle <= 2pi
+    angles = angles % (2. * np.pi)
+    angles[np.abs(angles) < 1.e-15] = 0.
+
+    return angles
+
+def getYZYArray(rotations):
+    return _foldEulerArray(calcEulerArray(rotations, 'YZY'))
+
+def getZYZArray(rotations):
+    return _foldEulerArray(calcEulerArray(rotations, 'ZYZ'))
+
 def makeLocation(instr, det, name, center, rotations, tol_ang=TOLERANCE):
     """
     Make a location appropriate for an instrument component.
@@ -503,3 +722,237 @@ class Rectangle:
         rotations.reverse() # may need this
 
         makeLocation(instr, det, name, self.__center, rotations, self._tol_ang)
+
+
+class RectangleArray:
+    """
+    Rectangles of many banks at once. The corners are an (N, 4, 3) array
+    with the points of every bank in the order Rectangle takes them. The
+    checks of Rectangle are done for all banks and their failures are
+    reported per bank in failures and valid instead of raising.
+    """
+    CHECKS = ("finite", "order", "left_right", "top_bottom", "corners", "right_angle",
+              "orientation")
+
+    def __init__(self, corners, tolerance_len=TOLERANCE, tolerance_ang=TOLERANCE):
+        corners = np.array(corners, dtype=float)
+        if corners.ndim != 3 or corners.shape[1:] != (Rectangle.NPOINTS, Vector.LENGTH):
+            raise RuntimeError("Expected corners of shape (N, %d, %d), found %s"
+                               % (Rectangle.NPOINTS, Vector.LENGTH, corners.shape))
+        self._tol_len = tolerance_len
+        self._tol_ang = tolerance_ang
+        self.__corners = corners
+        p1, p2, p3, p4 = (corners[:, i] for i in range(Rectangle.NPOINTS))
+
+        failures = {}
+        failures["finite"] = ~np.all(np.isfinite(corners), axis=(1, 2))
+        d1 = _dotArray(p1 - p2, p1 - p2)
+        d2 = _dotArray(p1 - p3, p1 - p3)
+        d3 = _dotArray(p1 - p4, p1 - p4)
+        failures["order"] = (d1 > d2) | (d3 > d2)
+
+        left = p2-p1
+        right = p4-p3
+        failures["left_right"] = np.abs(_lengthArray(left) - _lengthArray(right)) > tolerance_len
+        top = p2-p3
+        bottom = p4-p1
+        failures["top_bottom"] = np.abs(_lengthArray(top) - _lengthArray(bottom)) > tolerance_len
+        failures["corners"] = np.any(np.abs(left + right) > tolerance_len, axis=1)
+        dotProd = _dotArray(left, bottom)
+        failures["right_angle"] = np.abs(dotProd) > tolerance_len
+
+        self.__center = (p1 + p2 + p3 + p4) / float(Rectangle.NPOINTS)
+
+        # orientation as in Rectangle
+        xvec =  .5*(p4 + p3) - self.__center
+        yvec = -.5*(p1 + p4) + self.__center
+        zvec = np.cross(xvec, yvec)
+        xvec, xzero = _normalizeArray(xvec)
+        yvec, yzero = _normalizeArray(yvec)
+        zvec, zzero = _normalizeArray(zvec)
+        failures["orientation"] = xzero | yzero | zzero
+        self.__orient = np.stack([xvec, yvec, zvec], axis=1)
+
+        self.failures = failures
+        self.valid = ~np.any([failures[name] for name in RectangleArray.CHECKS], axis=0)
+
+        with np.errstate(invalid="ignore"):
+            self.__zyz = np.degrees(getZYZArray(self.__orient))
+            self.__yzy = -1.*np.degrees(getYZYArray(self.__orient))
+
+    def __len__(self):
+        return len(self.__corners)
+
+    def failedChecks(self, index):
+        """
+        Names of the checks bank index fails
+        """
+        return [name for name in RectangleArray.CHECKS if self.failures[name][index]]
+
+    def rectangle(self, index):
+        """
+        Rectangle of bank index, which raises if the bank is invalid
+        """
+        return Rectangle(*self.__corners[index], tolerance_len=self._tol_len,
+                         tolerance_ang=self._tol_ang)
+
+    def euler_rotations(self, index, convention="zyz"):
+        """
+        Rotations of bank index as (angle in degrees, axis), like
+        Rectangle.euler_rot and Rectangle.euler_rot_yzy
+        """
+        if convention.lower() == "zyz":
+            axes = ((0., 0., 1.), (0., 1., 0.), (0., 0., 1.))
+            angles = self.__zyz[index]
+        elif convention.lower() == "yzy":
+            axes = ((0., 1., 0.), (0., 0., 1.), (0., 1., 0.))
+            angles = self.__yzy[index]
+        else:
+            raise RuntimeError("Do not understand convention '%s'" % convention)
+        return tuple([angle, axis] for angle, axis in zip(angles, axes))
+
+    width = property(lambda self: _lengthArray(self.__corners[:, 3] - self.__corners[:, 0]),
+                     doc="Width of the rectangles")
+    height = property(lambda self: _lengthArray(self.__corners[:, 1] - self.__corners[:, 0]),
+                      doc="Height of the rectangles")
+    center = property(lambda self: self.__center.copy(),
+                      doc="(N, 3) centers of the rectangles")
+    orientation = property(lambda self: self.__orient.copy(),
+                           doc="(N, 3, 3) orientations as sets of three basis vectors")
+    euler_rot = property(lambda self: self.__zyz.copy(),
+                         doc="(N, 3) ZYZ Euler angles in degrees, see Rectangle.euler_rot")
+    euler_rot_yzy = property(lambda self: self.__yzy.copy(),
+                             doc="(N, 3) YZY Euler angles in degrees, see Rectangle.euler_rot_yzy")
+    points = property(lambda self: self.__corners.copy(),
+                      doc="The (N, 4, 3) corners supplied in the constructor")
+
+    def makeLocation(self, instr, det, name, index, technique="orientation"):
+        """
+        Rectangle.makeLocation for bank index
+        @param instr The root instrument that does most of the work.
+        @param det   The detector component.
+        @param name  The name of the bank.
+        """
+        if not HAS_LXML:
+            raise RuntimeError("lxml is not loaded")
+
+        technique = technique.upper()
+        if technique == "ORIENTATION":
+            rotations = list(self.euler_rotations(index, "yzy"))
+        elif technique == "UV":
+            points = self.__corners[index]
+            rotations = list(getEuler(Vector(points[3]-points[0]), Vector(points[1]-points[0]),
+                                      degrees=True))
+            rotations[0] = [rotations[0], (0., 1., 0.)]
+            rotations[1] = [rotations[1], (0., 0., 1.)]
+            rotations[2] = [rotations[2], (0., 1., 0.)]
+        else:
+            raise RuntimeError("Do not understand technique '%s'" % technique)
+
+        rotations.reverse() # may need this
+
+        makeLocation(instr, det, name, self.__center[index], rotations, self._tol_ang)
+
+# position of the corners of Rectangle as fractions of its width and height
+CORNER_LAYOUT = ((0., 0.), (0., 1.), (1., 1.), (1., 0.))
+
+def fitRectangles(points, layout=CORNER_LAYOUT, iterations=50, tolerance=1.e-12):
+    """
+    Least-squares fit of rigid rectangles to the surveyed points of many
+    banks at once. Every point has a known place in its bank, given in
+    layout as fractions (s, t) of the width, from p1 to p4, and height,
+    from p1 to p2. Points that were not surveyed are NaN and ignored, a
+    bank needs three of them that are not on a line.
+    @param points (N, M, 3) positions of the M points of N banks
+    @param layout (M, 2) or (N, M, 2) places of the points, the corners
+                  of Rectangle by default
+    @return  RectangleArray of the fitted corners and the (N, M) distances
+             of the points to the fitted rectangles
+    """
+    points = np.array(points, dtype=float)
+    if points.ndim != 3 or points.shape[2] != Vector.LENGTH:
+        raise RuntimeError("Expected points of shape (N, M, %d), found %s"
+                           % (Vector.LENGTH, points.shape))
+    layout = np.asarray(layout, dtype=float)
+    if layout.shape[-2:] != (points.shape[1], 2):
+        raise RuntimeError("Expected a layout of shape (%d, 2), found %s"
+                           % (points.shape[1], layout.shape))
+    layout = np.broadcast_to(layout, points.shape[:2] + (2,))
+
+    # center the points and their places on the ones that were surveyed
+    surveyed = np.all(np.isfinite(points), axis=2)[:, :, np.newaxis]
+    count = np.maximum(surveyed.sum(axis=1), 1)
+    pointMean = np.where(surveyed, points, 0.).sum(axis=1) / count
+    placeMean = np.where(surveyed, layout, 0.).sum(axis=1) / count
+    pc = np.where(surveyed, points - pointMean[:, np.newaxis], 0.)
+    qc = np.where(surveyed, layout - placeMean[:, np.newaxis], 0.)
+    qq = (qc * qc).sum(axis=1)
+
+    # start from the sizes of the affine fit, then alternate between the
+    # orientation, an orthogonal Procrustes problem, and the sizes, which
+    # are independent for orthogonal axes
+    planar = np.linalg.matrix_rank(qc) == 2
+    spread = np.einsum("nmi,nmj->nij", qc, qc)
+    spread[~planar] = np.identity(2)
+    affine = np.matmul(np.einsum("nmi,nmj->nij", pc, qc), np.linalg.inv(spread))
+    sizes = np.sqrt((affine * affine).sum(axis=1))
+    axes = None
+    for _ in range(iterations):
+        cross = np.einsum("nmi,nmj->nij", pc, qc * sizes[:, np.newaxis])
+        u, _, vt = np.linalg.svd(cross, full_matrices=False)
+        previous, axes = axes, np.matmul(u, vt)
+        sizes = np.einsum("nmi,nij,nmj->nj", pc, axes, qc) / np.where(qq > 0., qq, 1.)
+        if previous is not None and np.all(np.abs(axes - previous) <= tolerance):
+            break
+
+    # banks that cannot be fitted are reported as not finite
+    scaled = axes * sizes[:, np.newaxis]
+    scaled[~planar] = np.nan
+    center = pointMean + np.matmul(scaled, .5 - placeMean[:, :, np.newaxis])[:, :, 0]
+
+    def place(fractions):
+        return center[:, np.newaxis] + np.matmul(np.asarray(fractions) - .5, scaled.transpose(0, 2, 1))
+
+    residuals = _lengthArray((points - place(layout)).reshape(-1, Vector.LENGTH))
+    corners = place(np.broadcast_to(CORNER_LAYOUT, (len(points),) + np.shape(CORNER_LAYOUT)))
+    return RectangleArray(corners), residuals.reshape(points.shape[:2])
+
+# orders of the corners of a rectangle that keep them around its edge
+CORNER_ORDERS = ((0, 1, 2, 3), (1, 2, 3, 0), (2, 3, 0, 1), (3, 0, 1, 2), # keep order
+                 (3, 2, 1, 0), (2, 1, 0, 3), (1, 0, 3, 2), (0, 3, 2, 1)) # reverse order
+
+def bestCornerOrders(reference, corners, orders=CORNER_ORDERS, tolerance_len=TOLERANCE):
+    """
+    Find for every bank the order of its corners closest to the reference
+    corners. All orders of all banks are compared at once. Orders for
+    which the corners do not pass the checks of RectangleArray are not
+    considered, nor banks whose reference corners do not.
+    @param reference (N, 4, 3) corners to compare to
+    @param corners   (N, 4, 3) corners to reorder
+    @return  the (N,) index in orders of the best order, -1 if there is
+             none, the (N,) sum of the distances between the corners in
+             that order and the reference ones, and the (N, len(orders))
+             sums for every order, infinite for the invalid ones
+    """
+    reference = np.array(reference, dtype=float)
+    corners = np.array(corners, dtype=float)
+    shape = (Rectangle.NPOINTS, Vector.LENGTH)
+    if reference.ndim != 3 or reference.shape[1:] != shape or corners.shape != reference.shape:
+        raise RuntimeError("Expected corners of shape (N, %d, %d), found %s and %s"
+                           % (shape + (reference.shape, corners.shape)))
+    orders = np.asarray(orders, dtype=int)
+
+    # (N, orders, corners, xyz) candidates
+    candidates = corners[:, orders]
+    distances = np.sqrt(((candidates - reference[:, np.newaxis])**2).sum(axis=3)).sum(axis=2)
+
+    valid = RectangleArray(candidates.reshape((-1,) + shape), tolerance_len).valid
+    valid = valid.reshape(distances.shape) & RectangleArray(reference, tolerance_len).valid[:, np.newaxis]
+    distances[~valid] = np.inf
+
+    best = np.argmin(distances, axis=1)
+    bestDistance = distances[np.arange(len(best)), best]
+    missing = ~np.isfinite(bestDistance)
+    best[missing] = -1
+    bestDistance[missing] = np.nan
+    return best, bestDistance, distances
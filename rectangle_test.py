@@ -1,6 +1,8 @@
 #!/bin/env python
-from rectangle import Rectangle, calcEuler, checkRotation, generateRotation, \
-    getAngle, getYZY, getZYZ
+from rectangle import (CORNER_ORDERS, Rectangle, RectangleArray, bestCornerOrders, calcEuler,
+                       calcEulerArray, checkRotation, fitRectangles, generateRotation,
+                       generateRotationArray, getAngle, getEuler, getEulerArray, getYZY, getYZYArray,
+                       getZYZ, getZYZArray)
 from rectangle import Vector, UNIT_X, UNIT_Y, UNIT_Z
 import math
 import numpy as np
@@ -17,6 +19,13 @@ def assertAllClose(obs, exp, atol):
     # getting here means something didn't match
     raise AssertionError(str(obs) + ' != ' + str(exp))
 
+# the array functions use the numpy ufuncs, which may round the last bit
+# differently from the math module the scalar functions use
+ROUNDING = 1.e-12
+
+def assertUlpClose(obs, exp):
+    np.testing.assert_allclose(obs, exp, rtol=ROUNDING, atol=ROUNDING)
+
 class TestRectangle(unittest.TestCase):
     def checkCenter(self, rectangle, center):
         assertAllClose(rectangle.center, center, 0.)
@@ -63,6 +72,124 @@ class TestRectangle(unittest.TestCase):
         #                             (0.0, 0.0, -1.0)))
         #self.checkRotation(rect, 90., 180., 0.)
 
+class TestRectangleArray(unittest.TestCase):
+    CORNERS = [((0,0,0), (1,0,0), (1,1,0), (0,1,0)),
+               ((0,1,0), (1,1,0), (1,0,0), (0,0,0)),
+               ((-.1,-.2,1.), (-.1,.2,1.1), (.1,.2,1.1), (.1,-.2,1.)),
+               ((1,0,2), (1,.5,2), (1.2,.5,1.6), (1.2,0,1.6))]
+
+    def testMatchesRectangle(self):
+        rects = RectangleArray(self.CORNERS)
+        self.assertEqual(len(rects), 4)
+        self.assertTrue(np.all(rects.valid))
+        for i, corners in enumerate(self.CORNERS):
+            rect = Rectangle(*corners)
+            assertAllClose(rects.center[i], rect.center.data, 0.)
+            assertAllClose(rects.orientation[i], rect.orientation, 0.)
+            assertAllClose(rects.euler_rot[i], [rot[0] for rot in rect.euler_rot], 0.)
+            assertAllClose(rects.euler_rot_yzy[i], [rot[0] for rot in rect.euler_rot_yzy], 0.)
+            self.assertEqual([rot[1] for rot in rects.euler_rotations(i, "yzy")],
+                             [rot[1] for rot in rect.euler_rot_yzy])
+            assertAllClose(rects.width[i], rect.width, 0.)
+            assertAllClose(rects.height[i], rect.height, 0.)
+
+    def testFailures(self):
+        corners = np.array(self.CORNERS, dtype=float)
+        corners[0, [1, 3]] = corners[0, [3, 1]]  # points out of order
+        corners[2, 2, 0] += .01                  # not a rectangle
+        corners[3, 0, 1] = np.nan
+        rects = RectangleArray(corners)
+        self.assertEqual(rects.valid.tolist(), [True, True, False, False])
+        self.assertEqual(rects.failedChecks(1), [])
+        self.assertEqual(rects.failedChecks(2), ["left_right", "top_bottom", "corners"])
+        self.assertTrue(rects.failures["finite"][3])
+        # points swapped along the diagonal are still in order
+        self.assertEqual(rects.failedChecks(0), [])
+        self.assertRaises(RuntimeError, rects.rectangle, 2)
+
+        corners[1, [1, 2]] = corners[1, [2, 1]]
+        self.assertEqual(RectangleArray(corners).failedChecks(1),
+                         ["order", "corners", "right_angle", "orientation"])
+
+    def testShape(self):
+        self.assertRaises(RuntimeError, RectangleArray, np.zeros((2, 3, 3)))
+
+class TestFitRectangles(unittest.TestCase):
+    LAYOUT = ((0., 0.), (0., 1.), (1., 1.), (1., 0.), (.5, .5), (.25, 1.), (1., .4))
+
+    def makePoints(self, center, xvec, yvec, width, height):
+        return [np.add(center, (s - .5) * width * np.asarray(xvec)
+                       + (t - .5) * height * np.asarray(yvec)) for s, t in self.LAYOUT]
+
+    def testCorners(self):
+        corners = TestRectangleArray.CORNERS
+        rects, residuals = fitRectangles(corners)
+        exact = RectangleArray(corners)
+        self.assertTrue(np.all(rects.valid))
+        assertAllClose(residuals, np.zeros((4, 4)), 1.e-12)
+        assertAllClose(rects.center, exact.center, 1.e-12)
+        assertAllClose(rects.orientation, exact.orientation, 1.e-12)
+        assertAllClose(rects.euler_rot, exact.euler_rot, 1.e-9)
+
+    def testRedundantPoints(self):
+        xvec, yvec = (.6, 0., .8), (0., 1., 0.)
+        points = np.array([self.makePoints((1., .2, 3.), xvec, yvec, .8, .4),
+                           self.makePoints((-2., 0., 1.), UNIT_Z, UNIT_Y, .5, 1.)])
+        noise = np.random.RandomState(42).normal(scale=.001, size=points.shape)
+        rects, residuals = fitRectangles(points + noise, self.LAYOUT)
+        self.assertTrue(np.all(rects.valid))
+        self.assertEqual(residuals.shape, (2, 7))
+        self.assertTrue(np.all(residuals < .005))
+        assertAllClose(rects.center, [(1., .2, 3.), (-2., 0., 1.)], .002)
+        assertAllClose(rects.width, [.8, .5], .002)
+        assertAllClose(rects.height, [.4, 1.], .002)
+        assertAllClose(rects.orientation[0], [xvec, yvec, np.cross(xvec, yvec)], .005)
+
+        # a bad point shows in the residuals instead of failing the checks
+        points[0, 4, 2] += .05
+        rects, residuals = fitRectangles(points, self.LAYOUT)
+        self.assertTrue(np.all(rects.valid))
+        self.assertEqual(np.argmax(residuals[0]), 4)
+
+    def testMissingPoints(self):
+        points = np.array([self.makePoints((0., 0., 2.), UNIT_X, UNIT_Y, 1., .5)] * 3)
+        points[0, :4] = np.nan           # only the middle points
+        points[1, [0, 1, 3, 4, 6]] = np.nan  # two points left
+        points[2, [1, 3, 5, 6]] = np.nan  # points on a line
+        rects, residuals = fitRectangles(points, self.LAYOUT)
+        self.assertEqual(rects.valid.tolist(), [True, False, False])
+        self.assertEqual(rects.failedChecks(1), ["finite"])
+        assertAllClose(rects.center[0], (0., 0., 2.), 1.e-12)
+        assertAllClose(rects.points[0], self.makePoints((0., 0., 2.), UNIT_X, UNIT_Y, 1., .5)[:4],
+                       1.e-12)
+        self.assertTrue(np.all(np.isnan(residuals[0, :4])))
+
+    def testShape(self):
+        self.assertRaises(RuntimeError, fitRectangles, np.zeros((2, 4, 2)))
+        self.assertRaises(RuntimeError, fitRectangles, np.zeros((2, 5, 3)))
+
+class TestBestCornerOrders(unittest.TestCase):
+    def testOrders(self):
+        reference = np.array(TestRectangleArray.CORNERS, dtype=float)
+        corners = reference.copy()
+        corners[1] = reference[1][[3, 2, 1, 0]]
+        corners[2] = reference[2][[1, 2, 3, 0]] + .001
+        corners[3, 0, 0] += .1  # not a rectangle in any order
+        best, diff, diffs = bestCornerOrders(reference, corners)
+        self.assertEqual(diffs.shape, (4, len(CORNER_ORDERS)))
+        self.assertEqual(best.tolist(), [0, 4, 3, -1])
+        self.assertEqual([CORNER_ORDERS[i] for i in best[:3]],
+                         [(0, 1, 2, 3), (3, 2, 1, 0), (3, 0, 1, 2)])
+        assertAllClose(diff[:3], [0., 0., 4. * math.sqrt(3.) * .001], 1.e-12)
+        self.assertTrue(np.isnan(diff[3]))
+        self.assertTrue(np.all(np.isinf(diffs[3])))
+
+        # the tolerance of the checks applies to every order
+        best, diff, diffs = bestCornerOrders(reference, corners, tolerance_len=.2)
+        self.assertEqual(best[3], 0)
+
+        self.assertRaises(RuntimeError, bestCornerOrders, reference, corners[:2])
+
 class TestGetAngle(unittest.TestCase):
     def check(self, y, x, angle):
         self.assertEqual(math.degrees(getAngle(y,x)), angle)
@@ -125,6 +252,44 @@ class TestOrientation(unittest.TestCase):
 
         # https://en.wikipedia.org/wiki/Rotation_matrix
 
+    def testArrays(self):
+        angles = np.linspace(0., 2.*np.pi, 13)
+        rotations = []
+        for axis in UNIT_X, UNIT_Y, UNIT_Z, Vector(1., 2., 3.):
+            obs = generateRotationArray(axis, angles)
+            self.assertEqual(obs.shape, (13, 3, 3))
+            for angle, rotation in zip(angles, obs):
+                assertUlpClose(rotation, generateRotation(axis, angle))
+            rotations.extend(obs)
+        rotations = np.array(rotations)
+
+        for convention in ('YZY', 'ZYZ', 'XYZ'):
+            obs = calcEulerArray(rotations, convention)
+            for rotation, angles in zip(rotations, obs):
+                assertUlpClose(angles, calcEuler(rotation, convention))
+        for function, expected in ((getYZYArray, getYZY), (getZYZArray, getZYZ)):
+            obs = function(rotations)
+            for rotation, angles in zip(rotations, obs):
+                assertUlpClose(angles, expected(rotation))
+
+        self.assertEqual(getZYZArray(np.zeros((0, 3, 3))).shape, (0, 3))
+        self.assertRaises(RuntimeError, getZYZArray, IDENTITY)
+
+class TestGetEuler(unittest.TestCase):
+    def testArray(self):
+        uVecs = [(1., 0., 0.), (0., 0., 1.), (1., .1, 0.), (.3, -.4, .5), (-1., .2, 0.)]
+        vVecs = [(0., 1., 0.), (0., -1., 0.), (0., 1., .2), (.1, .9, -.2), (0., -1., .3)]
+        for degrees in (False, True):
+            obs = getEulerArray(uVecs, vVecs, degrees=degrees)
+            self.assertEqual(obs.shape, (5, 3))
+            for uVec, vVec, angles in zip(uVecs, vVecs, obs):
+                assertUlpClose(angles, getEuler(Vector(uVec), Vector(vVec), degrees=degrees))
+        assertAllClose(getEulerArray(uVecs[:2], vVecs[:2], degrees=True),
+                       [[0., 0., 0.], [-90., 180., 0.]], 0.)
+
+        self.assertRaises(RuntimeError, getEulerArray, uVecs, vVecs[:2])
+        self.assertRaises(RuntimeError, getEulerArray, [(0., 0., 0.)], [(0., 1., 0.)])
+
 class TestVector(unittest.TestCase):
     def testCross(self):
         self.assertEqual(UNIT_X.cross(UNIT_Y), UNIT_Z)
@@ -197,6 +362,34 @@ class TestVector(unittest.TestCase):
         self.assertEqual(a.y,  0.)
         self.assertEqual(a.z,  0.)
 
+    def testVectorInputs(self):
+        self.assertEqual(Vector(np.array([[1., 2., 3.]])), (1., 2., 3.))
+        self.assertRaises(RuntimeError, Vector, 1., 2.)
+        self.assertRaises(RuntimeError, Vector, 1., np.nan, 2.)
+
+        # copies do not share their components
+        a = Vector(UNIT_X)
+        a.normalize()
+        a.data = (0., 2., 0.)
+        self.assertEqual(a.normalize(), UNIT_Y)
+        self.assertEqual(UNIT_X, (1., 0., 0.))
+        self.assertTrue(isinstance(a.data, np.ndarray))
+        assertAllClose(np.array(a), [0., 1., 0.], 0.)
+        self.assertRaises(AttributeError, setattr, a, "w", 1.)
+        # data is a copy, it cannot be changed in place
+        self.assertRaises(ValueError, a.data.__setitem__, 0, 3.)
+
+    def testNumpyResults(self):
+        # the products match the numpy ones of the arrays Vector used to
+        # hold. The order np.dot adds the terms in depends on the BLAS build,
+        # so the dot products may differ in the last bit.
+        random = np.random.RandomState(16)
+        for first, second in random.normal(size=(1000, 2, 3)):
+            a, b = Vector(first), Vector(second)
+            assertUlpClose(a.dot(b), np.dot(first, second))
+            self.assertEqual(a.cross(b), np.cross(first, second))
+            assertUlpClose(a.length, np.sqrt(np.dot(first, first)))
+
 def suite():
     suite_rect  = unittest.TestLoader().loadTestsFromTestCase(TestRectangle)
     suite_angle = unittest.TestLoader().loadTestsFromTestCase(TestGetAngle)
@@ -1,5 +1,19 @@
 #!/usr/bin/env python
+import hashlib
+import itertools
+import json
+import mmap
 import os
+import re
+import tempfile
+import zipfile
+
+import numpy as np
+
+# change when the columns returned by readColumns change, to drop old caches
+CACHE_VERSION = 1
+# lines parsed at a time from memory mapped files
+CHUNK_LINES = 1 << 14
 
 
 def readFile(filename, hasLabels=True, headerLines=0, delimiter=r'\s+'):
@@ -15,7 +29,6 @@ def readFile(filename, hasLabels=True, headerLines=0, delimiter=r'\s+'):
     with open(filename, "r") as datafile:
         lines = []
         numcol = None
-        import re
         splitter = re.compile(delimiter)
         for linenum, line in enumerate(datafile):
             if linenum < headerLines:
@@ -50,6 +63,190 @@ def readFile(filename, hasLabels=True, headerLines=0, delimiter=r'\s+'):
     return result
 
 
+def _typedColumn(values, dtype=None):
+    """
+    Convert a column of byte strings to the first of int, float and str
+    that all values are, or to dtype
+    """
+    if dtype is not None:
+        if np.dtype(dtype).kind == 'U':
+            return np.char.decode(values, 'utf-8')
+        return values.astype(dtype)
+    # python number parsing allows underscores, e.g. in 582_1
+    if values.size and b'_' not in b''.join(values.tolist()):
+        for candidate in (np.int64, np.float64):
+            try:
+                return values.astype(candidate)
+            except (ValueError, OverflowError):
+                pass
+    return np.char.decode(values, 'utf-8')
+
+
+def _lineChunks(filename, mapped):
+    """
+    Lists of the lines of the file. Without mapped the file is read at once
+    into one list, with mapped the lines are taken from the memory map
+    CHUNK_LINES at a time, so only one chunk of them is held as strings.
+    """
+    with open(filename, "rb") as datafile:
+        if not mapped:
+            yield datafile.read().splitlines()
+            return
+        if os.path.getsize(filename) == 0:
+            return  # empty files cannot be mapped
+        contents = mmap.mmap(datafile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            lines = iter(contents.readline, b"")
+            for chunk in iter(lambda: list(itertools.islice(lines, CHUNK_LINES)), []):
+                yield chunk
+        finally:
+            contents.close()
+
+
+def cacheName(filename):
+    return filename + ".cache.npz"
+
+
+def _cacheKey(filename, arguments):
+    """
+    Hash of the contents of the file, the arguments it is parsed with and
+    the cache version
+    """
+    key = hashlib.sha1()
+    with open(filename, "rb") as datafile:
+        for block in iter(lambda: datafile.read(1 << 20), b""):
+            key.update(block)
+    key.update(repr((CACHE_VERSION, arguments)).encode())
+    return key.hexdigest()
+
+
+def _loadCache(filename, key):
+    """
+    Columns stored for key, None if there are none
+    """
+    try:
+        with np.load(cacheName(filename), allow_pickle=False) as cache:
+            if str(cache["key"]) != key:
+                return None
+            labels = json.loads(str(cache["labels"]))
+            return dict((label, cache["column%d" % i]) for i, label in enumerate(labels))
+    except (IOError, OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def _saveCache(filename, key, result):
+    """
+    Store the columns next to the file. Nothing is stored if the directory
+    cannot be written.
+    """
+    arrays = dict(("column%d" % i, column) for i, column in enumerate(result.values()))
+    arrays["key"] = np.array(key)
+    arrays["labels"] = np.array(json.dumps(list(result.keys())))
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        handle, temporary = tempfile.mkstemp(suffix=".npz", dir=directory)
+    except (IOError, OSError):
+        return
+    saved = False
+    try:
+        with os.fdopen(handle, "wb") as cache:
+            np.savez(cache, **arrays)
+        # replace at once, so readers never see half a file
+        os.replace(temporary, cacheName(filename))
+        saved = True
+    except (IOError, OSError):
+        pass
+    finally:
+        if not saved:
+            os.remove(temporary)
+
+
+def cachedColumns(filename, arguments, parse):
+    """
+    Columns returned by parse(), a dictionary of arrays, stored in
+    <filename>.cache.npz. They are read from there as long as the contents
+    of the file and the arguments, which must identify the parser and
+    everything it is called with, are the same.
+    """
+    key = _cacheKey(filename, arguments)
+    result = _loadCache(filename, key)
+    if result is None:
+        result = parse()
+        _saveCache(filename, key, result)
+    return result
+
+
+def readColumns(filename, hasLabels=True, headerLines=0, delimiter=r'\s+',
+                dtypes=None, mapped=False, cache=False):
+    """Load a n-column ascii file like readFile, but into a dictionary of
+    numpy arrays. Every column is an array of int, float or str, the first
+    that fits all of its values, unless dtypes gives the type of its
+    label. With mapped the file is memory mapped instead of read into a
+    single string, for large files. With cache the columns are stored in
+    <filename>.cache.npz and read from there as long as the contents of
+    the file and the arguments are the same."""
+
+    if not os.path.exists(filename):
+        raise RuntimeError("File '%s' does not exist" % filename)
+
+    if cache:
+        # the dtypes are keyed by their names, types do not repr the same everywhere
+        types = sorted((repr(label), np.dtype(dtype).str) for label, dtype in (dtypes or {}).items())
+        return cachedColumns(filename, ("readColumns", hasLabels, headerLines, delimiter, types),
+                             lambda: readColumns(filename, hasLabels, headerLines, delimiter,
+                                                 dtypes, mapped))
+
+    if delimiter == r'\s+':
+        # whitespace is split without a regular expression
+        split = bytes.split
+    else:
+        splitter = re.compile(delimiter.encode())
+        split = lambda line: splitter.split(line.strip()) if line.strip() else []
+
+    # every chunk of lines becomes a table of byte strings, so a mapped file
+    # is never held as strings all at once
+    labels = None
+    numcol = None
+    tables = []
+    start = 0
+    for lines in _lineChunks(filename, mapped):
+        first = max(start, headerLines)
+        end = start + len(lines)
+        lines = lines[first - start:]
+        start = end
+
+        # skip blank lines, all others must have the same number of columns
+        rows = [(linenum, row) for linenum, row in enumerate(map(split, lines), first) if row]
+        if numcol is None and rows:
+            numcol = len(rows[0][1])
+        if any(len(row) != numcol for _, row in rows):
+            linenum = next(linenum for linenum, row in rows if len(row) != numcol)
+            raise Exception("Number of columns varies at line %d in '%s'"
+                            % (linenum, filename))
+        rows = [row for _, row in rows]
+
+        if hasLabels and labels is None and rows:
+            labels = [label.decode('utf-8') for label in rows[0]]
+            rows = rows[1:]
+        if rows:
+            tables.append(np.array(rows, dtype=bytes))
+
+    # set up resulting data structure
+    if not hasLabels:
+        labels = range(numcol or 0)
+    elif labels is None:
+        raise RuntimeError("File '%s' has no labels" % filename)
+    dtypes = dtypes or {}
+
+    if tables:
+        table = np.concatenate(tables)
+    else:
+        table = np.empty((0, len(labels)), dtype=bytes)
+    result = {}
+    for i, label in enumerate(labels):
+        result[label] = _typedColumn(table[:, i], dtypes.get(label))
+    return result
+
 if __name__ == "__main__":
     info = readFile("SEQ_geom.txt")
     print("******************************")
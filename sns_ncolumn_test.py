@@ -0,0 +1,127 @@
+#!/bin/env python
+from sns_ncolumn import cacheName, cachedColumns, readColumns, readFile
+import numpy as np
+import sns_ncolumn
+import os
+from testutils import TempDirTestCase
+import unittest
+
+SURVEY = """# surveyed corners
+bank Point_ID x y z
+1 1_1 0.5 -1 2.25
+1 1_2 1.5 -1 2.25e-1
+
+2 2_1 nan 3 -0
+"""
+
+
+class TestReadColumns(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.filename = self.write("survey.txt", SURVEY)
+
+    def testTypes(self):
+        for mapped in (False, True):
+            columns = readColumns(self.filename, headerLines=1, mapped=mapped)
+            self.assertEqual(list(columns), ["bank", "Point_ID", "x", "y", "z"])
+            self.assertEqual(columns["bank"].dtype, np.int64)
+            self.assertEqual(columns["Point_ID"].tolist(), ["1_1", "1_2", "2_1"])
+            self.assertEqual(columns["y"].dtype, np.int64)
+            self.assertEqual(columns["z"].tolist(), [2.25, .225, 0.])
+            self.assertTrue(np.isnan(columns["x"][2]))
+
+        # same values as readFile
+        strings = readFile(self.filename, headerLines=1)
+        columns = readColumns(self.filename, headerLines=1, dtypes={"y": float})
+        self.assertEqual(columns["y"].dtype, np.float64)
+        for label in ("x", "z"):
+            np.testing.assert_array_equal(columns[label],
+                                          [float(value) for value in strings[label]])
+
+    def testChunks(self):
+        # the header, the labels and a blank line fall in different chunks
+        expected = readColumns(self.filename, headerLines=1)
+        chunkLines = sns_ncolumn.CHUNK_LINES
+        try:
+            for sns_ncolumn.CHUNK_LINES in (1, 2, 3):
+                columns = readColumns(self.filename, headerLines=1, mapped=True)
+                self.assertEqual(list(columns), list(expected))
+                for label in expected:
+                    np.testing.assert_array_equal(columns[label], expected[label])
+            with open(self.filename, "a") as handle:
+                handle.write("3 3_1 1. 2.\n")
+            self.assertRaises(Exception, readColumns, self.filename, headerLines=1, mapped=True)
+        finally:
+            sns_ncolumn.CHUNK_LINES = chunkLines
+
+    def testLabels(self):
+        columns = readColumns(self.filename, hasLabels=False, headerLines=2,
+                              delimiter=" ", dtypes={1: str})
+        self.assertEqual(sorted(columns), [0, 1, 2, 3, 4])
+        self.assertEqual(columns[0].tolist(), [1, 1, 2])
+        self.assertEqual(columns[1].dtype.kind, "U")
+
+    def testCache(self):
+        for hasLabels, headerLines in ((True, 1), (False, 2)):
+            expected = readColumns(self.filename, hasLabels, headerLines)
+            for _ in range(2):  # stores the columns, then reads them back
+                columns = readColumns(self.filename, hasLabels, headerLines, cache=True)
+                self.assertTrue(os.path.exists(cacheName(self.filename)))
+                self.assertEqual(list(columns), list(expected))
+                for label in expected:
+                    self.assertEqual(columns[label].dtype, expected[label].dtype)
+                    np.testing.assert_array_equal(columns[label], expected[label])
+
+        # other arguments and changed contents are parsed again
+        columns = readColumns(self.filename, headerLines=1, dtypes={"y": float}, cache=True)
+        self.assertEqual(columns["y"].dtype, np.float64)
+        with open(self.filename, "a") as handle:
+            handle.write("3 3_1 1. 2. 3.\n")
+        columns = readColumns(self.filename, headerLines=1, dtypes={"y": float}, cache=True)
+        self.assertEqual(columns["bank"].tolist(), [1, 1, 2, 3])
+
+        # a broken cache is replaced
+        with open(cacheName(self.filename), "w") as handle:
+            handle.write("not a cache")
+        columns = readColumns(self.filename, headerLines=1, cache=True)
+        self.assertEqual(columns["y"].tolist(), [-1, -1, 3, 2])
+
+    def testCachedColumns(self):
+        calls = []
+
+        def parse():
+            calls.append(1)
+            return {"a": np.array([.1, .2]), "b": np.array(["x", "y"])}
+
+        for _ in range(2):
+            columns = cachedColumns(self.filename, ("parser", 1), parse)
+            self.assertEqual(columns["a"].tolist(), [.1, .2])
+            self.assertEqual(columns["b"].tolist(), ["x", "y"])
+        self.assertEqual(len(calls), 1)
+        # another parser does not get the columns of the first one
+        cachedColumns(self.filename, ("parser", 2), parse)
+        self.assertEqual(len(calls), 2)
+
+    def testCacheNotSaved(self):
+        def failingSave(handle, **arrays):
+            handle.write(b"partial")
+            raise ValueError("cannot save")
+
+        save = np.savez
+        np.savez = failingSave
+        try:
+            self.assertRaises(ValueError, cachedColumns, self.filename, ("parser", 1),
+                              lambda: {"a": np.array([.1, .2])})
+        finally:
+            np.savez = save
+        self.assertEqual(os.listdir(self.direc), ["survey.txt"])
+
+    def testErrors(self):
+        with open(self.filename, "a") as handle:
+            handle.write("3 3_1 1. 2.\n")
+        self.assertRaises(Exception, readColumns, self.filename, headerLines=1)
+        self.assertRaises(RuntimeError, readColumns, self.path("missing.txt"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,10 +1,25 @@
 #!/usr/bin/env python
 
+from concurrent.futures import ProcessPoolExecutor
+import datetime
 import difflib
+import io
+import json
 import logging
 import os
+import platform
+import runpy
+import shutil
 import subprocess
 import sys
+import time
+import traceback
+import warnings
+
+from lxml import etree as le
+
+import geomcache
+import idfdiff
 
 __version__ = "0.1.1"
 LOGLEVELS = ["INFO", "WARNING", "DEBUG"]
@@ -15,7 +30,10 @@ __original_idf = '_Definition_master.xml'
 __idf = '_Definition.xml'
 
 __key_last_modified = 'last-modified='
-__key_valid_to = 'valid-to'
+MANTID_INDEX = os.path.join(geomcache.CACHE_DIR, "mantid_index.json")
+
+# third party modules imported once per worker for the in-process runner
+WARM_MODULES = ["numpy", "lxml.etree", "scipy", "h5py", "pandas", "dateutil.parser"]
 
 
 def findGeoms():
@@ -46,53 +64,156 @@ def toOutputNames(filename):
     return golden, result, instr
 
 
-def findMantidInstrFile(mantiddir, instr):
-    # get all files in the directory
+def indexMantidInstruments(mantiddir, cachefile=None):
+    """
+    Read the root tag of every definition file in mantiddir. The index is
+    kept in cachefile until the directory is modified.
+    :return: dictionary of the instrument name, the start of the file name,
+             to the list of its [valid-from, valid-to, filename]
+    """
+    mtime = os.stat(mantiddir).st_mtime_ns
+    if cachefile is not None and os.path.exists(cachefile):
+        with open(cachefile) as handle:
+            cached = json.load(handle)
+        if cached["directory"] == mantiddir and cached["mtime"] == mtime:
+            return cached["instruments"]
+
     all_files = os.listdir(mantiddir)
     if len(all_files) <= 0:
         raise RuntimeError("Failed to find any files in " + mantiddir)
 
-    # reduce to just the ones that are IDFs for this instrument
-    candidates = []
-    for filename in all_files:
-        if filename.startswith(instr) and filename.endswith(".xml") and \
-                "Definition" in filename:
-            candidates.append(os.path.join(mantiddir, filename))
-
-    # pop them open and look for the valid-to information
-    datemap={}
-    for filename in candidates:
-        handle = open(filename)
-        for line in handle:
-            if __key_valid_to in line:
-                break
-            if not __key_valid_to in line:
-                raise RuntimeError("Failed to find 'valid-to' tag in " + filename)
-            line = line[line.index(__key_valid_to)+len(__key_valid_to):].strip()
-            line = line[line.index('=') + 1:].strip()
-            line = line[1:].strip()
-            line = line.split()[0]
-            datemap[line] = filename
+    instruments = {}
+    for filename in sorted(all_files):
+        if not filename.endswith(".xml") or "Definition" not in filename:
+            continue
+        instr = filename[:filename.index("Definition")].rstrip("_")
+        filename = os.path.join(mantiddir, filename)
+        try:
+            attrib = idfdiff.rootAttributes(filename)
+        except le.XMLSyntaxError as e:
+            logging.warning(" Failed to read " + filename + ": " + str(e))
+            continue
+        instruments.setdefault(instr, []).append([attrib.get("valid-from"),
+                                                  attrib.get("valid-to"), filename])
+
+    if cachefile is not None:
+        if not os.path.isdir(os.path.dirname(cachefile)):
+            os.makedirs(os.path.dirname(cachefile))
+        with open(cachefile, "w") as handle:
+            json.dump(dict(directory=mantiddir, mtime=mtime, instruments=instruments), handle)
+    return instruments
+
+
+def findMantidInstrFile(mantiddir, instr, index=None):
+    if index is None:
+        index = indexMantidInstruments(mantiddir)
+
+    # the definitions whose file name starts with the instrument
+    candidates = [entry for name in sorted(index.keys()) if name.startswith(instr)
+                  for entry in index[name]]
+    if len(candidates) <= 0:
+        raise RuntimeError("Failed to find a definition of " + instr + " in " + mantiddir)
+    for valid_from, valid_to, filename in candidates:
+        if valid_to is None:
+            raise RuntimeError("Failed to find 'valid-to' tag in " + filename)
 
     # return the one that has the latest valid-to date
-    dates = datemap.keys()
-    dates.sort()
-    return datemap[dates[-1]]
+    return max(candidates, key=lambda entry: (entry[1], entry[0] or ""))[2]
 
 
-def copyFromMantid(mantiddir, instr, goldenfile):
-    mantidfile = findMantidInstrFile(mantiddir, instr)
+def copyFromMantid(mantiddir, instr, goldenfile, index=None):
+    mantidfile = findMantidInstrFile(mantiddir, instr, index)
     shutil.copy(mantidfile, goldenfile)
 
 
-def runGeom(pyscript, goldenfile, outfile, generateGolden):
+def warmUp():
+    """
+    Import the heavy third party modules, so generators run in-process
+    don't pay for them
+    """
+    for name in WARM_MODULES:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+
+def runScript(pyscript):
+    """
+    Run a generator in this interpreter, as "python pyscript" would from the
+    current directory. The working directory, sys.argv, sys.path, warning
+    filters, logging handlers and numpy print options (wand_geometry
+    changes them) are restored afterwards and the modules
+    imported from the repository are unloaded, so the next script starts
+    from a clean state while third party modules stay imported.
+    :return: the exit code and the standard output and error
+    """
+    cwd = os.getcwd()
+    argv, path = sys.argv[:], sys.path[:]
+    modules = set(sys.modules.keys())
+    logger = logging.getLogger()
+    handlers, level = logger.handlers[:], logger.level
+    numpy = sys.modules.get("numpy")
+    if numpy is not None:
+        printoptions, errstate = numpy.get_printoptions(), numpy.geterr()
+    stdout, stderr = sys.stdout, sys.stderr
+    out, err = io.StringIO(), io.StringIO()
+    repository = os.path.dirname(os.path.realpath(__file__))
+    scriptdir = os.path.dirname(os.path.realpath(pyscript))
+
+    sys.argv = [pyscript]
+    # like the interpreter, only the directory of the script is added
+    sys.path[0] = scriptdir
+    sys.stdout, sys.stderr = out, err
+    try:
+        with warnings.catch_warnings():
+            runpy.run_path(pyscript, run_name="__main__")
+        retcode = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            retcode = e.code or 0
+        else:
+            err.write(str(e.code) + "\n")
+            retcode = 1
+    except BaseException:
+        etype, value, tb = sys.exc_info()
+        # start the traceback at the script, as the interpreter would, not
+        # in runScript and runpy
+        script = os.path.realpath(pyscript)
+        while tb is not None and os.path.realpath(tb.tb_frame.f_code.co_filename) != script:
+            tb = tb.tb_next
+        err.write("".join(traceback.format_exception(etype, value, tb)))
+        retcode = 1
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(cwd)
+        sys.argv, sys.path[:] = argv, path
+        logger.handlers, logger.level = handlers, level
+        if numpy is not None:
+            numpy.set_printoptions(**printoptions)
+            numpy.seterr(**errstate)
+        for name in set(sys.modules.keys()) - modules:
+            filename = getattr(sys.modules[name], "__file__", None) or ""
+            filename = os.path.realpath(filename)
+            if filename.startswith(repository + os.sep) or filename.startswith(scriptdir + os.sep):
+                del sys.modules[name]
+    return retcode, out.getvalue(), err.getvalue()
+
+
+def runGeom(pyscript, goldenfile, outfile, generateGolden, inprocess=False):
+    """
+    :return: the exit code of the script, None if it could not be run
+    """
     logging.info("*****"+pyscript+"*****")
     cmd = "python %s" % pyscript
     try:
-        proc = subprocess.Popen(cmd, shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = proc.communicate()
-        retcode = proc.wait()
+        if inprocess:
+            retcode, out, err = runScript(pyscript)
+        else:
+            proc = subprocess.Popen(cmd, shell=True,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = proc.communicate()
+            retcode = proc.wait()
         if retcode:
             if len(out) > 0:
                 logging.warning("----output----")
@@ -102,7 +223,7 @@ def runGeom(pyscript, goldenfile, outfile, generateGolden):
                 logging.warning(err)
             if retcode == 2:
                 logging.info(' Skip creating ' + outfile)
-                return
+                return retcode
             else:
                 logging.error(cmd + " returned " + str(retcode))
         else:
@@ -114,6 +235,7 @@ def runGeom(pyscript, goldenfile, outfile, generateGolden):
                 logging.debug(err)
     except ValueError:
         logging.error(" Cannot run " + pyscript)
+        return None
 
     if generateGolden:
         if os.path.exists(goldenfile):
@@ -122,6 +244,90 @@ def runGeom(pyscript, goldenfile, outfile, generateGolden):
         if os.path.exists(outfile):
             os.rename(outfile, goldenfile)
             logging.info(" Created " + goldenfile)
+    return retcode
+
+
+def newResult():
+    """
+    What the report records of every script
+    """
+    return dict(returncode=None, wall_time=None, cached=False, status=None,
+                bytes=None, elements=None)
+
+
+def failed(result):
+    """
+    Whether a script returned an error, other than skipping its geometry,
+    or its output differs from the golden file
+    """
+    return result["returncode"] not in (None, 0, 2) or result["status"] == "differ"
+
+
+def measureGeom(result, pyscript, goldenfile, outfile, generateGolden, inprocess=False,
+                run=True):
+    """
+    Run a geometry if requested and record its exit code, its wall time and
+    the size of its output in result
+    """
+    if run:
+        start = time.perf_counter()
+        result["returncode"] = runGeom(pyscript, goldenfile, outfile, generateGolden, inprocess)
+        result["wall_time"] = time.perf_counter() - start
+    if generateGolden:
+        outfile = goldenfile
+    if os.path.exists(outfile):
+        result["bytes"] = os.path.getsize(outfile)
+        result["elements"] = idfdiff.countElements(outfile)
+
+
+def writeReport(filename, results):
+    """
+    Write the results of every script as JUnit xml if filename ends with
+    .xml, as json otherwise
+    """
+    if not filename.endswith(".xml"):
+        report = dict(version=__version__, python=platform.python_version(),
+                      created=datetime.datetime.now().isoformat(), generators=results)
+        with open(filename, "w") as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+        return
+
+    suites = le.Element("testsuites")
+    suite = le.SubElement(suites, "testsuite", name="test_unchanged",
+                          timestamp=datetime.datetime.now().isoformat())
+    counts = dict(failures=0, errors=0, skipped=0)
+    total = 0.
+    for script, result in results.items():
+        wall_time = result["wall_time"] or 0.
+        total += wall_time
+        case = le.SubElement(suite, "testcase", classname="test_unchanged", name=script,
+                             time="%.3f" % wall_time)
+        properties = le.SubElement(case, "properties")
+        for key in sorted(result.keys()):
+            le.SubElement(properties, "property", name=key, value=str(result[key]))
+        if result["status"] == "error" or \
+                (result["wall_time"] is not None and result["returncode"] not in (0, 2)):
+            counts["errors"] += 1
+            le.SubElement(case, "error", message="returned " + str(result["returncode"]))
+        elif result["status"] == "differ":
+            counts["failures"] += 1
+            le.SubElement(case, "failure", message="differs from the golden file")
+        elif result["returncode"] == 2 or result["status"] in ("no golden", "no output"):
+            counts["skipped"] += 1
+            le.SubElement(case, "skipped", message=result["status"] or "returned 2")
+    suite.set("tests", str(len(results)))
+    for key, value in counts.items():
+        suite.set(key, str(value))
+    suite.set("time", "%.3f" % total)
+    le.ElementTree(suites).write(filename, pretty_print=True, xml_declaration=True,
+                                 encoding="UTF-8")
+
+
+def logCacheCheck(pyscript, reasons):
+    if reasons:
+        logging.info(" Running " + pyscript + ": " + ", ".join(reasons))
+    else:
+        logging.info(" Skip running " + pyscript + " - inputs unchanged")
 
 
 def getModified(instrTag):
@@ -135,14 +341,52 @@ def getModified(instrTag):
     return modified, newline[1:]
 
 
-def compareGeom(golden, outfile):
+def compareGeom(golden, outfile, unified=False, tolerance=idfdiff.TOLERANCE):
+    """
+    Compare the elements of the files and print the differences by XPath,
+    or their lines as a unified diff. Files that are not well-formed are
+    always compared by lines.
+    :return: "match", "differ", "no golden" or "no output"
+    """
     if not os.path.exists(golden):
         logging.warning(" Failed to find the original geometry " + golden + " - not comparing")
-        return
+        return "no golden"
     if not os.path.exists(outfile):
         logging.warning(" Failed to find the new geometry " + outfile)
-        return
+        return "no output"
+    if unified:
+        return compareLines(golden, outfile)
 
+    counts = dict(removed=0, added=0, changed=0)
+    try:
+        for name, filename in (("Compare", golden), ("With", outfile)):
+            modified = idfdiff.rootAttributes(filename).get("last-modified")
+            if modified is not None:
+                logging.info(" " + name + " " + filename + ' last-modified="' + modified + '"')
+            else:
+                logging.info(filename + " last-modified is None")
+        # collect all the differences first, so nothing is printed before a
+        # parse error makes it fall back to comparing lines
+        differences = list(idfdiff.compare(golden, outfile, tolerance))
+    except le.XMLSyntaxError as e:
+        logging.warning(" Failed to parse the geometries (" + str(e) + ") - comparing lines")
+        return compareLines(golden, outfile)
+    for difference in differences:
+        if not sum(counts.values()):
+            logging.info(" ========================================")
+            sys.stdout.write("--- %s\n+++ %s\n" % (golden, outfile))
+        counts[difference.kind] += 1
+        sys.stdout.write(idfdiff.formatDifference(difference) + "\n")
+
+    if sum(counts.values()):
+        logging.info(" " + str(counts["removed"]) + " node(s) removed, " + str(counts["added"]) +
+                     " added and " + str(counts["changed"]) + " value(s) changed")
+        return "differ"
+    logging.info(" " + os.path.split(golden)[1] + " and " + os.path.split(outfile)[1] + " match")
+    return "match"
+
+
+def compareLines(golden, outfile):
     oldData = open(golden).readlines()
     newData = open(outfile).readlines()
 
@@ -185,8 +429,102 @@ def compareGeom(golden, outfile):
         # rerun and write out
         diff = difflib.unified_diff(oldData, newData, golden, outfile)
         sys.stdout.writelines(diff)
-    else:
-        logging.info(" " + os.path.split(golden)[1] + " and " + os.path.split(outfile)[1] + " match")
+        return "differ"
+    logging.info(" " + os.path.split(golden)[1] + " and " + os.path.split(outfile)[1] + " match")
+    return "match"
+
+
+class BufferHandler(logging.Handler):
+    """
+    Keep the log messages of a worker process so the parent can replay them
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelno, record.getMessage()))
+
+
+def processGeom(pyscript, outnames, loglevel, run=True, generateGolden=False,
+                compare=True, inprocess=False, unified=False, tolerance=idfdiff.TOLERANCE):
+    """
+    Run and compare a single geometry in a worker process
+    :return: the log messages as (level, message), the printed output and
+             the result of the script for the report
+    """
+    handler = BufferHandler()
+    logger = logging.getLogger()
+    logger.handlers = [handler]
+    logger.setLevel(loglevel)
+    master, output, instrument = outnames
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        result = newResult()
+        measureGeom(result, pyscript, master, output, generateGolden, inprocess, run)
+        if compare:
+            result["status"] = compareGeom(master, output, unified, tolerance)
+        return handler.messages, sys.stdout.getvalue(), result
+    finally:
+        sys.stdout = stdout
+
+
+def processGeoms(outfiles, jobs, loglevel, run=True, generateGolden=False,
+                 compare=True, inprocess=False, unified=False, tolerance=idfdiff.TOLERANCE,
+                 cache=None, results=None, strict=False):
+    """
+    Run and compare the geometries in a pool of jobs worker processes. The
+    logs and differences of every script are reported together, in the
+    order of the scripts. With inprocess, the workers run the generators
+    themselves instead of starting an interpreter for each one. With a
+    cache, only the scripts whose inputs changed are run. The result of
+    every script is added to results.
+    :return: the number of scripts that could not be processed, and with
+             strict also of those that failed or differ
+    """
+    if results is None:
+        results = {}
+    failures = 0
+    checks = {}
+    before = {}
+    initializer = warmUp if inprocess else None
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer) as executor:
+        futures = []
+        for key in outfiles.keys():
+            runKey = run
+            if run and cache is not None:
+                checks[key] = cache.check(key)
+                runKey = bool(checks[key][0])
+                before[key] = geomcache.outputFiles(outfiles[key][1])
+            futures.append(executor.submit(processGeom, key, outfiles[key], loglevel,
+                                           runKey, generateGolden, compare, inprocess,
+                                           unified, tolerance))
+        for key, future in zip(outfiles.keys(), futures):
+            if key in checks:
+                logCacheCheck(key, checks[key][0])
+            try:
+                messages, output, result = future.result()
+            except Exception:
+                failures += 1
+                logging.error("Failed to process " + key + "\n" + traceback.format_exc())
+                results[key] = newResult()
+                results[key]["status"] = "error"
+                continue
+            result["cached"] = key in checks and not checks[key][0]
+            results[key] = result
+            if strict and failed(result):
+                failures += 1
+            for level, message in messages:
+                logging.log(level, message)
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            if result["returncode"] == 0 and key in checks:
+                cache.store(key, checks[key][1],
+                            geomcache.writtenFiles(outfiles[key][1], before[key]))
+    if cache is not None:
+        cache.save()
+    return failures
 
 
 if __name__ == "__main__":
@@ -203,6 +541,29 @@ if __name__ == "__main__":
     parser.add_argument("--diffonly", action="store_true",
                         help="Don't run the geometries, only calculate the differences")
     parser.add_argument("--script", help="Script file to run")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of geometries to run and compare in parallel, "
+                             "0 for one per CPU, default is 1")
+    parser.add_argument("--in-process", dest="inprocess", action="store_true",
+                        help="Run the geometries inside warm worker processes "
+                             "instead of a new interpreter for each one")
+    parser.add_argument("--unified", action="store_true",
+                        help="Show the differences as a unified diff of the lines "
+                             "instead of comparing the elements")
+    parser.add_argument("--tolerance", type=float, default=idfdiff.TOLERANCE,
+                        help="Relative and absolute tolerance when comparing numbers, "
+                             "default is %g" % idfdiff.TOLERANCE)
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only run the geometries whose script, local modules or data "
+                             "files changed since they were cached in " + geomcache.CACHE_DIR +
+                             ", ignored with --setup")
+    parser.add_argument("--strict", action="store_true",
+                        help="Exit with an error when a geometry fails to run or differs "
+                             "from its golden file")
+    parser.add_argument("--report", default=None,
+                        help="Write the exit code, wall time, output size and comparison of "
+                             "every geometry to this file, as JUnit if it ends with .xml and "
+                             "json otherwise")
 
     # parse the command line
     options = parser.parse_args()
@@ -243,22 +604,59 @@ if __name__ == "__main__":
             raise RuntimeError("Specified non-existent instrument directory " + mantidloc)
         if not os.path.isdir(mantidloc):
             raise RuntimeError(mantidloc + " is not a directory")
-        import shutil
+        index = indexMantidInstruments(mantidloc, MANTID_INDEX)
         for key in outfiles.keys():
-            copyFromMantid(mantidloc, outfiles[key][2], outfiles[key][0])
+            copyFromMantid(mantidloc, outfiles[key][2], outfiles[key][0], index)
         sys.exit(0)
 
-    # run each one
-    if not options.diffonly:
+    # run and compare in parallel
+    cache = None
+    if options.incremental and not options.setup and not options.diffonly:
+        cache = geomcache.GeometryCache()
+
+    results = dict((key, newResult()) for key in outfiles.keys())
+    try:
+        jobs = options.jobs if options.jobs > 0 else os.cpu_count()
+        if jobs > 1 or options.inprocess:
+            failures = processGeoms(outfiles, jobs, options.loglevel,
+                                    run=not options.diffonly,
+                                    generateGolden=options.setup,
+                                    compare=not options.setup,
+                                    inprocess=options.inprocess,
+                                    unified=options.unified,
+                                    tolerance=options.tolerance,
+                                    cache=cache, results=results,
+                                    strict=options.strict)
+            sys.exit(1 if failures else 0)
+
+        # run each one
         for key in outfiles.keys():
             master, output, instrument = outfiles[key]
-            runGeom(key, master, output, options.setup)
-
-    # exit early if we are in setup
-    if options.setup:
-        sys.exit(0)
-
-    # calculate and display the differences
-    for key in outfiles.keys():
-        master, output, instrument = outfiles[key]
-        compareGeom(master, output)
+            run = not options.diffonly
+            if run and cache is not None:
+                reasons, inputs = cache.check(key)
+                logCacheCheck(key, reasons)
+                results[key]["cached"] = not reasons
+                run = bool(reasons)
+                before = geomcache.outputFiles(output)
+            measureGeom(results[key], key, master, output, options.setup, run=run)
+            if run and cache is not None and results[key]["returncode"] == 0:
+                cache.store(key, inputs, geomcache.writtenFiles(output, before))
+        if cache is not None:
+            cache.save()
+
+        # exit early if we are in setup
+        if options.setup:
+            sys.exit(0)
+
+        # calculate and display the differences
+        for key in outfiles.keys():
+            master, output, instrument = outfiles[key]
+            results[key]["status"] = compareGeom(master, output, options.unified,
+                                                 options.tolerance)
+        if options.strict and any(failed(result) for result in results.values()):
+            sys.exit(1)
+    finally:
+        if options.report is not None:
+            writeReport(options.report, results)
+            logging.info(" Wrote " + options.report)
@@ -0,0 +1,71 @@
+import os
+import unittest
+
+import test_unchanged
+from testutils import TempDirTestCase
+
+IDF = '<?xml version="1.0"?>\n<instrument name="%s" valid-from="%s" %s>\n</instrument>\n'
+
+
+class TestMantidIndex(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.mantiddir = self.path("instrument")
+        os.mkdir(self.mantiddir)
+        self.cachefile = self.path("cache/mantid_index.json")
+
+    def writeIdf(self, filename, valid_from, valid_to=None):
+        valid_to = 'valid-to="%s"' % valid_to if valid_to is not None else ""
+        return self.write(os.path.join("instrument", filename),
+                          IDF % (filename.split("_")[0], valid_from, valid_to))
+
+    def testLatestValidTo(self):
+        self.writeIdf("CNCS_Definition_2010.xml", "2010-01-01", "2017-12-31 23:59:59")
+        latest = self.writeIdf("CNCS_Definition.xml", "2018-01-01", "2100-01-31 23:59:59")
+        self.writeIdf("CNCS_Definition_2017.xml", "2017-01-01", "2017-12-31 23:59:59")
+        self.assertEqual(test_unchanged.findMantidInstrFile(self.mantiddir, "CNCS"), latest)
+
+    def testPrefix(self):
+        self.writeIdf("CNCS_Definition.xml", "2010-01-01", "2100-01-31 23:59:59")
+        powgen = self.writeIdf("POWGEN_Definition_2015.xml", "2015-01-01", "2100-01-31 23:59:59")
+        self.writeIdf("POWGEN_Parameters.xml", "2015-01-01", "2200-01-31 23:59:59")
+        self.writeIdf("POWGEN_Definition_2011.xml", "2011-01-01", "2014-12-31 23:59:59")
+        self.assertEqual(test_unchanged.findMantidInstrFile(self.mantiddir, "POW"), powgen)
+        index = test_unchanged.indexMantidInstruments(self.mantiddir)
+        self.assertEqual(sorted(index.keys()), ["CNCS", "POWGEN"])
+        self.assertRaises(RuntimeError, test_unchanged.findMantidInstrFile,
+                          self.mantiddir, "SEQUOIA", index)
+
+    def testMissingValidTo(self):
+        self.writeIdf("CNCS_Definition.xml", "2010-01-01", "2100-01-31 23:59:59")
+        self.writeIdf("CNCS_Definition_2009.xml", "2009-01-01")
+        self.assertRaises(RuntimeError, test_unchanged.findMantidInstrFile,
+                          self.mantiddir, "CNCS")
+
+    def testMalformed(self):
+        cncs = self.writeIdf("CNCS_Definition.xml", "2010-01-01", "2017-12-31 23:59:59")
+        self.write("instrument/CNCS_Definition_broken.xml", '<instrument name="CNCS" valid-to')
+        index = test_unchanged.indexMantidInstruments(self.mantiddir)
+        self.assertEqual(index, {"CNCS": [["2010-01-01", "2017-12-31 23:59:59", cncs]]})
+        self.assertEqual(test_unchanged.findMantidInstrFile(self.mantiddir, "CNCS", index), cncs)
+
+    def testCache(self):
+        cncs = self.writeIdf("CNCS_Definition.xml", "2010-01-01", "2100-01-31 23:59:59")
+        index = test_unchanged.indexMantidInstruments(self.mantiddir, self.cachefile)
+        self.assertTrue(os.path.exists(self.cachefile))
+        self.assertEqual(test_unchanged.indexMantidInstruments(self.mantiddir, self.cachefile), index)
+
+        # the cache is used as long as the directory is not modified
+        stat = os.stat(self.mantiddir)
+        os.remove(cncs)
+        os.utime(self.mantiddir, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(test_unchanged.indexMantidInstruments(self.mantiddir, self.cachefile), index)
+
+        seq = self.writeIdf("SEQ_Definition.xml", "2010-01-01", "2100-01-31 23:59:59")
+        os.utime(self.mantiddir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        index = test_unchanged.indexMantidInstruments(self.mantiddir, self.cachefile)
+        self.assertEqual(index, {"SEQ": [["2010-01-01", "2100-01-31 23:59:59", seq]]})
+
+
+if __name__ == "__main__":
+    unittest.main()
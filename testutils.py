@@ -0,0 +1,32 @@
+"""
+Shared fixtures of the unit tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TempDirTestCase(unittest.TestCase):
+    """
+    Test case that runs every test with a new temporary directory,
+    self.direc, which is removed afterwards
+    """
+    def setUp(self):
+        self.direc = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.direc)
+
+    def path(self, name):
+        return os.path.join(self.direc, name)
+
+    def write(self, name, text):
+        """
+        Write text to the file name in the temporary directory
+        :return: the path of the file
+        """
+        filename = self.path(name)
+        with open(filename, "w") as handle:
+            handle.write(text)
+        return filename
@@ -35,6 +35,7 @@ import pandas as pd
 from lxml import etree as le  # python-lxml on rpm based systems
 from helper import INCH_TO_METRE, MantidGeom
 from rectangle import Rectangle, makeLocation
+from sns_ncolumn import cachedColumns
 
 
 # -----------------------------------------------------------------------------
@@ -69,7 +70,11 @@ def read_survey_measurements(filename: str = SURVEY_RESULTS) -> pd.DataFrame:
     -------
     :@return: pandas dataframe
     """
-    return pd.read_csv(filename)
+    # the columns pandas parses are cached, so the values stay the same
+    columns = cachedColumns(filename, ("pandas.read_csv", pd.__version__),
+                            lambda: dict((label, column.to_numpy())
+                                         for label, column in pd.read_csv(filename).items()))
+    return pd.DataFrame(columns)
 
 
 def addEightPack(instr, name: str, tube_type: str, upsidedown: bool = False):